@@ -1,76 +1,186 @@
 # api/web.py
+import asyncio
 import os
 import sys
+import time
+import uuid
 
-import psycopg2
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Optional, Tuple
 # 导入业务逻辑模块
 # 导入数据库连接工具
-from database.database_conn import get_db_connection
+from database.database_conn import get_db_connection, get_connection_pool_stats, PoolExhausted, per_worker_size
 from service.buildings_service import update_all_buildings_info_batch
 
-from service.collision_service import get_collision_buildings_info
-from service.buildings_service_file import insert_buildings_from_file
+from service.collision_service import get_collision_buildings_info_async, get_collision_buildings_info_batch, \
+    get_path_collision_hits, summarize_path_collisions, get_nearest_obstacles_async, prepare_async_statements
+from service.collision_index import init_building_index, get_building_index, is_building_index_current, \
+    start_building_index_rebuild, close_building_index
+from service.collision_cache import init_collision_cache
+from service.height_map import init_height_map, get_height_map, close_height_map
+from service.buildings_service_file import insert_buildings_from_file, insert_buildings_from_file_bulk, \
+    insert_buildings_from_file_parallel, insert_buildings_from_file_delta, insert_buildings_from_stream
+from service.building_reader import ChunkPipe, STREAM_FORMATS, detect_format
+from service.job_runner import init_job_runner, get_job_runner, close_job_runner
+from service.job_store import JobStore
+from service.building_maintenance import cluster_buildings, RECLUSTER_MIN_CHANGED_ROWS
 from utils.logger import logger
 
 # 获取当前文件所在目录的上一级目录
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 
-from database.database_conn import init_connection_pool, close_connection_pool # 导入初始化和关闭函数
+from database.database_conn import init_connection_pool, close_connection_pool, DB_CONN_STRING # 导入初始化和关闭函数
+from database.async_database_conn import init_async_connection_pool, close_async_connection_pool, \
+    get_async_db_connection, get_async_connection_pool_stats
+from service.building_events import start_buildings_changed_relay, stop_buildings_changed_relay
 
-# --- 初始化连接池 ---
-# 在创建 FastAPI 应用实例之前调用
-try:
-    init_connection_pool()
-except Exception as e:
-    # 如果连接池初始化失败，应用可能无法正常工作
-    print(f"Failed to initialize database connection pool: {e}")
-    # 根据你的错误处理策略，可以选择退出应用
-    # sys.exit(1) # 取消注释以在初始化失败时退出
-    raise # 或者重新抛出异常
+# 连接池在 lifespan 中初始化：多进程部署时每个进程 fork 之后各自建立连接，不能在导入时创建
+
+# 碰撞检测引擎: db（PostGIS 查询） 或 memory（启动时加载到内存 R-tree）
+COLLISION_ENGINE = os.getenv("COLLISION_ENGINE", "db").lower()
+# 批量碰撞检测每次 SQL 往返处理的点数
+COLLISION_BATCH_CHUNK_SIZE = int(os.getenv("COLLISION_BATCH_CHUNK_SIZE", "1000"))
+
+# 高度栅格预检：查询点附近最高的建筑物也低于查询高度时直接判为无碰撞，不做精确查询
+HEIGHT_MAP_ENABLED = os.getenv("HEIGHT_MAP_ENABLED", "false").lower() == "true"
+HEIGHT_MAP_CELL_SIZE = float(os.getenv("HEIGHT_MAP_CELL_SIZE", "2"))
+HEIGHT_MAP_TILE_SIZE = int(os.getenv("HEIGHT_MAP_TILE_SIZE", "256"))
+
+# 退出时等待处理中的请求归还数据库连接的最长秒数（与 main.py 的优雅退出时间一致）
+WEB_GRACEFUL_TIMEOUT = float(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+
+# 后台任务（导入、高度补全）并发数（各 Web 进程合计）和保留的已结束任务数
+JOB_MAX_WORKERS = per_worker_size(int(os.getenv("JOB_MAX_WORKERS", "2")))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "100"))
+# 任务状态存储: db（数据库表，多进程部署时任一进程都能查询和取消任务） 或 memory（仅本进程内存，单进程使用）
+JOB_STORE = os.getenv("JOB_STORE", "db").lower()
+# 执行任务的进程写入进度、读取取消请求的间隔秒数
+JOB_SYNC_INTERVAL = float(os.getenv("JOB_SYNC_INTERVAL", "2"))
+# 未结束的任务超过该秒数没有心跳时视为执行它的进程已退出
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+
+# --- 碰撞结果缓存（仅用于 db 引擎）---
+collision_cache = None
+if COLLISION_ENGINE != "memory" and os.getenv("COLLISION_CACHE_ENABLED", "true").lower() == "true":
+    collision_cache = init_collision_cache(
+        max_size=int(os.getenv("COLLISION_CACHE_SIZE", "100000")),
+        ttl=float(os.getenv("COLLISION_CACHE_TTL", "300")),
+        geohash_precision=int(os.getenv("COLLISION_CACHE_GEOHASH_PRECISION", "9")),
+        height_bucket=float(os.getenv("COLLISION_CACHE_HEIGHT_BUCKET", "5")),
+    )
+
+# --- 只读状态（内存碰撞索引、高度栅格）---
+# main.py 生产模式预加载时在主进程中构建一次，fork 出的各进程写时复制共享，lifespan 中不再重复构建
+_preloaded = False
+
+
+def _load_shared_state(start_threads: bool):
+    if COLLISION_ENGINE == "memory":
+        with get_db_connection(statement_timeout=0) as conn:
+            init_building_index(conn, start=start_threads)
+        logger.info("碰撞检测引擎: 内存 R-tree")
+    if HEIGHT_MAP_ENABLED:
+        with get_db_connection(statement_timeout=0) as conn:
+            init_height_map(conn, cell_size=HEIGHT_MAP_CELL_SIZE, tile_size=HEIGHT_MAP_TILE_SIZE,
+                            start=start_threads)
+
+
+def preload_shared_state():
+    """
+    在 fork 之前于主进程中构建只读状态。
+    使用只含一个连接的临时连接池，构建完成后关闭，子进程不会继承数据库连接；
+    高度栅格的后台重建线程在各进程的 lifespan 中启动。
+    """
+    global _preloaded
+    init_connection_pool(min_size=1, max_size=1, statement_timeout=0)
+    try:
+        _load_shared_state(start_threads=False)
+    finally:
+        close_connection_pool()
+    _preloaded = True
+    print("Shared state preloaded.")
 
 
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动时的逻辑 (已经移到上面了，但如果需要在 lifespan 内部做，可以放这里)
-    # init_connection_pool() # 如果上面没有调用，可以在这里调用
+    # 启动时的逻辑：连接池、后台线程都在本进程中创建（多进程部署时在 fork 之后）
+    try:
+        init_connection_pool()
+    except Exception as e:
+        # 如果连接池初始化失败，应用无法正常工作
+        print(f"Failed to initialize database connection pool: {e}")
+        raise
+    # 异步连接池必须在事件循环中创建，新连接预编译异步查询
+    await init_async_connection_pool(init=prepare_async_statements)
+    # 其它进程导入/更新建筑物后通知本进程的缓存和高度栅格
+    start_buildings_changed_relay(DB_CONN_STRING)
+    job_store = JobStore(get_db_connection, stale_seconds=JOB_STALE_SECONDS) if JOB_STORE == "db" else None
+    init_job_runner(max_workers=JOB_MAX_WORKERS, history_size=JOB_HISTORY_SIZE, store=job_store,
+                    sync_interval=JOB_SYNC_INTERVAL)
+    if not _preloaded:
+        _load_shared_state(start_threads=True)
+    else:
+        if COLLISION_ENGINE == "memory":
+            start_building_index_rebuild()
+        if get_height_map() is not None:
+            get_height_map().start()
     print("Application startup complete.")
     yield # 应用运行期间
-    # 关闭时的逻辑
-    close_connection_pool()
+    # 关闭时的逻辑：处理中的请求已结束，等待后台任务停止，再等连接归还后关闭连接池
+    close_job_runner()
+    close_height_map()
+    close_building_index()
+    stop_buildings_changed_relay()
+    await close_async_connection_pool(WEB_GRACEFUL_TIMEOUT)
+    close_connection_pool(WEB_GRACEFUL_TIMEOUT)
     print("Application shutdown complete.")
 
 # 使用 lifespan 参数创建 FastAPI 应用
 app = FastAPI(title="3D Building Collision Detector", openapi_prefix="/api/v1", lifespan=lifespan)
-@app.post("/update_buildings_info")
-async def update_buildings_info ():
+
+
+@app.exception_handler(PoolExhausted)
+async def pool_exhausted_handler(request: Request, exc: PoolExhausted):
     """
-    更新建筑物信息。
+    连接池等待超时或排队已满时返回 429 和 Retry-After，过载时快速失败而不是大量 500。
     """
-    try:
-        # 使用原有逻辑进行碰撞检测
-        #with get_db_connection_simple() as conn:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="nyc",
-            user="postgres",
-            password="123456"
-        )
-        result = update_all_buildings_info_batch(conn)
-        return  result
-
-    except Exception as e:
-        logger.error(f"更新建筑物时发生错误: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail={
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+        content={
+            "detail": {
                 "status": "error",
-                "message": f"更新建筑物时发生错误: {str(e)}"
+                "message": f"服务繁忙，请稍后重试: {exc}"
             }
-        )
+        },
+    )
+
+@app.post("/update_buildings_info")
+async def update_buildings_info (
+    run_id: Optional[str] = Query(None, description="任务ID，传入已有任务ID时从上次的断点继续"),
+    only_missing: bool = Query(False, description="只更新高度为空的建筑物"),
+    stale_before: Optional[str] = Query(None, description="同时更新 update_time 早于该时间的建筑物，如 2025-01-01"),
+):
+    """
+    更新建筑物信息（补全高度）。
+    作为后台任务执行，立即返回 job_id，通过 /jobs/{job_id} 查询进度和结果。
+    """
+    def run(job):
+        # 读取和写入各使用一个连接池中的连接
+        with get_db_connection(statement_timeout=0) as conn, get_db_connection(statement_timeout=0) as write_conn:
+            return update_all_buildings_info_batch(conn, run_id=run_id, only_missing=only_missing,
+                                                   stale_before=stale_before, write_conn=write_conn,
+                                                   progress=job.report)
+
+    job = await run_in_threadpool(get_job_runner().submit, "update_buildings_info", run, run_id=run_id,
+                                  only_missing=only_missing, stale_before=stale_before)
+    return {"job_id": job.id, "status": job.status}
 
 
 @app.get("/collision_info")
@@ -91,9 +201,30 @@ async def collision_info(
 
         logger.info(f"经纬度和高度: {longitude}, {latitude}, {height}, 碰撞距离: {collision_distance}")
 
-        # 使用原有逻辑进行碰撞检测
-        with get_db_connection() as conn:
-            result = get_collision_buildings_info(conn, longitude, latitude, height, collision_distance)
+        height_map = get_height_map()
+        if height_map is not None and height_map.is_clear(longitude, latitude, height, collision_distance):
+            # 高度栅格预检：附近没有高于查询高度的建筑物
+            result = []
+        elif COLLISION_ENGINE == "memory" and is_building_index_current():
+            # 内存引擎：本地 R-tree 查询，不占用连接池；建筑物变更后索引重建完成前走数据库查询
+            result = get_building_index().query(longitude, latitude, height, collision_distance)
+        else:
+            result = collision_cache.get(longitude, latitude, height, collision_distance) if collision_cache else None
+
+            if result is None:
+                # 异步连接池查询，等待数据库时不阻塞事件循环
+                async with get_async_db_connection() as conn:
+                    if collision_cache:
+                        # 缓存未命中：查询整个缓存网格的超集结果，写入缓存后本地复核当前点
+                        key = collision_cache.make_key(longitude, latitude, height, collision_distance)
+                        generation = collision_cache.generation
+                        candidates = await get_collision_buildings_info_async(
+                            conn, *collision_cache.superset_query(key), with_collision_geom=True)
+                        result = collision_cache.put(key, candidates, generation,
+                                                     longitude, latitude, height, collision_distance)
+                    else:
+                        result = await get_collision_buildings_info_async(conn, longitude, latitude, height,
+                                                                          collision_distance)
 
         # 判断是否有碰撞结果
         is_collision = len(result) > 0
@@ -109,6 +240,9 @@ async def collision_info(
 
         return response
 
+    except PoolExhausted:
+        # 连接池繁忙，由 pool_exhausted_handler 返回 429
+        raise
     except Exception as e:
         logger.error(f"检测碰撞时发生错误: {str(e)}")
         raise HTTPException(
@@ -118,35 +252,417 @@ async def collision_info(
                 "message": f"检测碰撞时发生错误: {str(e)}"
             }
         )
+@app.get("/collision_cache/stats")
+async def collision_cache_stats():
+    """
+    碰撞结果缓存统计（命中/未命中次数、命中率、当前大小）。
+    """
+    if collision_cache is None:
+        return {"status": "success", "enabled": False}
+    return {"status": "success", "enabled": True, **collision_cache.stats()}
+
+
+@app.get("/db_pool/stats")
+async def db_pool_stats():
+    """
+    数据库连接池统计（连接数、排队数、获取连接的等待时间、超时和拒绝次数）。
+    """
+    return {
+        "status": "success",
+        "sync_pool": get_connection_pool_stats(),
+        "async_pool": get_async_connection_pool_stats(),
+    }
+
+
+@app.get("/height_map/stats")
+async def height_map_stats():
+    """
+    高度栅格统计（分块数、内存占用、预检次数和直接判为无碰撞的比例）。
+    """
+    height_map = get_height_map()
+    if height_map is None:
+        return {"status": "success", "enabled": False}
+    return {"status": "success", "enabled": True, **height_map.stats()}
+
+
+class CollisionPoint(BaseModel):
+    longitude: float = Field(..., description="经度（WGS84）")
+    latitude: float = Field(..., description="纬度（WGS84）")
+    height: float = Field(..., description="高度（米）")
+    collision_distance: float = Field(2, description="碰撞距离（米），默认距离为2米")
+
+
+@app.post("/collision_info/batch")
+async def collision_info_batch(points: List[CollisionPoint]):
+    """
+    批量判断多个 WGS84 经纬高点是否与建筑物发生碰撞。
+    返回结果包含:
+    - results: 与输入顺序一致的逐点结果，每项含 is_collision 以及碰撞时的 building_infos
+    - collision_count: 发生碰撞的点数
+    """
+    try:
+
+        logger.info(f"批量碰撞检测点数: {len(points)}")
+
+        point_tuples = [(p.longitude, p.latitude, p.height, p.collision_distance) for p in points]
+
+        # 高度栅格预检判为无碰撞的点不再做精确查询
+        height_map = get_height_map()
+        if height_map is not None:
+            pending = [i for i, p in enumerate(point_tuples) if not height_map.is_clear(*p)]
+        else:
+            pending = list(range(len(point_tuples)))
+        pending_tuples = [point_tuples[i] for i in pending]
+
+        if not pending_tuples:
+            pending_result = []
+        elif COLLISION_ENGINE == "memory" and is_building_index_current():
+            index = get_building_index()
+            pending_result = [index.query(*p) for p in pending_tuples]
+        else:
+            # 同步连接池在线程中获取和查询，等待空闲连接时不阻塞事件循环
+            def query_batch():
+                with get_db_connection() as conn:
+                    return get_collision_buildings_info_batch(conn, pending_tuples, COLLISION_BATCH_CHUNK_SIZE)
+
+            pending_result = await run_in_threadpool(query_batch)
+
+        batch_result = [[] for _ in point_tuples]
+        for i, result in zip(pending, pending_result):
+            batch_result[i] = result
+
+        results = []
+        for result in batch_result:
+            is_collision = len(result) > 0
+            item = {"is_collision": is_collision}
+            # 只有当有碰撞时才返回building_infos字段
+            if is_collision:
+                item["building_infos"] = result
+            results.append(item)
+
+        return {
+            "status": "success",
+            "collision_count": sum(1 for item in results if item["is_collision"]),
+            "results": results,
+        }
+
+    except PoolExhausted:
+        # 连接池繁忙，由 pool_exhausted_handler 返回 429
+        raise
+    except Exception as e:
+        logger.error(f"批量检测碰撞时发生错误: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "status": "error",
+                "message": f"批量检测碰撞时发生错误: {str(e)}"
+            }
+        )
+
+
+class PathCollisionRequest(BaseModel):
+    coordinates: List[Tuple[float, float, float]] = Field(
+        ..., min_length=2, description="航线顶点列表，每个顶点为 [经度, 纬度, 高度（米）]（WGS84）")
+    clearance: float = Field(2, description="安全距离（米），默认距离为2米")
+
+
+@app.post("/collision_info/path")
+async def collision_info_path(request: PathCollisionRequest):
+    """
+    判断三维航线（折线）是否与建筑物发生碰撞，航段高度按顶点线性插值。
+    返回结果包含:
+    - is_collision: 是否发生碰撞 (true/false)
+    - first_hit: 沿航线第一个碰撞位置 (如果发生碰撞)
+    - building_infos: 碰撞的建筑物列表及各自首次碰撞位置 (如果发生碰撞)
+    """
+    try:
+
+        vertices = [tuple(c) for c in request.coordinates]
+        logger.info(f"航线顶点数: {len(vertices)}, 安全距离: {request.clearance}")
+
+        if COLLISION_ENGINE == "memory" and is_building_index_current():
+            hits = get_building_index().query_path_hits(vertices, request.clearance)
+        else:
+            def query_path():
+                with get_db_connection() as conn:
+                    return get_path_collision_hits(conn, vertices, request.clearance)
+
+            hits = await run_in_threadpool(query_path)
+
+        response = {"status": "success"}
+        response.update(summarize_path_collisions(vertices, hits))
+        return response
+
+    except PoolExhausted:
+        # 连接池繁忙，由 pool_exhausted_handler 返回 429
+        raise
+    except Exception as e:
+        logger.error(f"检测航线碰撞时发生错误: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "status": "error",
+                "message": f"检测航线碰撞时发生错误: {str(e)}"
+            }
+        )
+
+
+@app.get("/collision_info/clearance")
+async def collision_info_clearance(
+    longitude: float = Query(..., description="经度（WGS84）"),
+    latitude: float = Query(..., description="纬度（WGS84）"),
+    height: float = Query(..., description="高度（米）"),
+    k: int = Query(1, ge=1, le=100, description="返回最近的建筑物数量"),
+    max_distance: Optional[float] = Query(None, gt=0, description="最大查找距离（米），默认不限制"),
+):
+    """
+    查询 WGS84 经纬高点周围高于该高度的最近 k 栋建筑物（一次 KNN 索引扫描），用于获取实际的安全距离。
+    返回结果包含:
+    - clearance: 到最近障碍物的水平距离（米），范围内没有障碍物时为 null
+    - obstacles: 按水平距离从近到远的建筑物列表，每项含 horizontal_distance（米）
+      和 vertical_margin（建筑物高出查询高度的米数）
+    """
+    try:
+
+        logger.info(f"最近障碍物查询: {longitude}, {latitude}, {height}, k={k}, max_distance={max_distance}")
+
+        async with get_async_db_connection() as conn:
+            obstacles = await get_nearest_obstacles_async(conn, longitude, latitude, height, k, max_distance)
+
+        return {
+            "status": "success",
+            "clearance": obstacles[0]["horizontal_distance"] if obstacles else None,
+            "obstacles": obstacles,
+        }
+
+    except PoolExhausted:
+        # 连接池繁忙，由 pool_exhausted_handler 返回 429
+        raise
+    except Exception as e:
+        logger.error(f"查询最近障碍物时发生错误: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "status": "error",
+                "message": f"查询最近障碍物时发生错误: {str(e)}"
+            }
+        )
+
+
 @app.post("/insert_buildings_info")
 async def insert_buildings_info(
     file_path: str = Query(..., description="文件路径）"),
+    mode: str = Query("row", description="导入方式: row（逐行插入）、bulk（COPY 批量导入）、parallel（多进程分片导入） 或 delta（增量导入）"),
+    workers: Optional[int] = Query(None, description="parallel 方式的进程数，默认为 CPU 核数"),
+    delete_missing: bool = Query(False, description="delta 方式下是否删除文件中已不存在的建筑物"),
+    file_format: Optional[str] = Query(None, description="文件格式: text、geojson、geojsonseq、flatgeobuf 或 geoparquet，默认按扩展名判断"),
 ):
     """
-     导入建筑物信息
+     导入建筑物信息。
+     作为后台任务执行，立即返回 job_id，通过 /jobs/{job_id} 查询进度和结果。
     """
-    try:
+    logger.info(f"文件路径:{file_path}, 导入方式:{mode}")
+
+    def import_file(job):
+        with get_db_connection(statement_timeout=0) as conn:
+            if mode == "parallel":
+                # 各子进程使用自己的连接，conn 只用于合并分片
+                return insert_buildings_from_file_parallel(conn, file_path, workers=workers, file_format=file_format,
+                                                           progress=job.report)
+            if mode == "bulk":
+                return insert_buildings_from_file_bulk(conn, file_path, file_format=file_format,
+                                                       progress=job.report)
+            if mode == "delta":
+                return insert_buildings_from_file_delta(conn, file_path, delete_missing=delete_missing,
+                                                        file_format=file_format, progress=job.report)
+            return insert_buildings_from_file(conn, file_path, file_format=file_format, progress=job.report)
+
+    def run(job):
+        result = import_file(job)
+        schedule_recluster(result)
+        return result
+
+    job = await run_in_threadpool(get_job_runner().submit, "insert_buildings_info", run, file_path=file_path,
+                                  mode=mode, workers=workers, delete_missing=delete_missing, file_format=file_format)
+    return {"job_id": job.id, "status": job.status}
+
 
-        logger.info(f"文件路径:{file_path}")
+# --- 表数据空间聚簇 ---
 
-        # 使用原有逻辑进行碰撞检测
-        with get_db_connection() as conn:
-            result = insert_buildings_from_file(conn,file_path)
+def _run_cluster_buildings(job, force):
+    with get_db_connection(statement_timeout=0) as conn:
+        return cluster_buildings(conn, force=force)
 
-        if result:
-            return result
 
+def schedule_recluster(result):
+    """
+    导入变更的行数较多时，提交一个后台任务检查 geohash 聚簇程度，必要时重新 CLUSTER。
+    所有进程中同时只有一个聚簇任务：已有未结束的聚簇任务时不再提交，返回该任务的 job_id。
+    """
+    if not result:
+        return
+    changed = result.get("success_count", 0) + result.get("deleted_count", 0)
+    if changed >= RECLUSTER_MIN_CHANGED_ROWS:
+        runner = get_job_runner()
+        job = runner.submit("cluster_buildings", lambda job: _run_cluster_buildings(job, False), exclusive=True,
+                            force=False, changed_rows=changed)
+        if job is not None:
+            result["cluster_job_id"] = job.id
+        else:
+            active = runner.active("cluster_buildings")
+            result["cluster_job_id"] = active["job_id"] if active else None
+
+
+@app.post("/maintenance/cluster_buildings")
+async def cluster_buildings_info(
+    force: bool = Query(False, description="是否强制 CLUSTER（默认只在聚簇程度低于阈值时执行）"),
+):
+    """
+    按中心点 geohash 顺序重排建筑物表（CLUSTER），作为后台任务执行，立即返回 job_id。
+    CLUSTER 期间会锁表，碰撞查询需等待。已有未结束的聚簇任务时不再提交，返回该任务的状态。
+    """
+    runner = get_job_runner()
+    job = await run_in_threadpool(runner.submit, "cluster_buildings",
+                                  lambda job: _run_cluster_buildings(job, force), exclusive=True, force=force)
+    if job is None:
+        active = await run_in_threadpool(runner.active, "cluster_buildings")
+        if active is not None:
+            return {"job_id": active["job_id"], "status": active["status"]}
+        raise HTTPException(status_code=409, detail="聚簇任务提交失败，请稍后重试")
+    return {"job_id": job.id, "status": job.status}
+
+
+# --- 后台任务 ---
+
+@app.get("/jobs")
+async def list_jobs():
+    """
+    列出后台任务（含最近结束的任务）及其进度
+    """
+    return await run_in_threadpool(get_job_runner().list)
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """
+    查询后台任务状态、进度（已处理/总数、速率、预计剩余时间）和结果
+    """
+    job = await run_in_threadpool(get_job_runner().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在")
+    return job
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    取消后台任务：未开始的任务不再执行，运行中的任务在下次上报进度时停止
+    （高度补全会先提交断点，之后可用同一 run_id 继续）。
+    """
+    job = await run_in_threadpool(get_job_runner().cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在")
+    return job
+
+
+# --- 流式上传导入 ---
+# 接收线程与导入线程之间最多缓冲的数据块数（每块通常不超过 64KB）
+UPLOAD_QUEUE_CHUNKS = int(os.getenv("UPLOAD_QUEUE_CHUNKS", "16"))
+# 上传导入的拒绝文件目录
+UPLOAD_REJECT_DIR = os.getenv("UPLOAD_REJECT_DIR", "rejects")
+# 每接收多少字节记录一次进度
+UPLOAD_PROGRESS_BYTES = 64 * 1024 * 1024
+
+
+@app.post("/insert_buildings_info/upload")
+async def upload_buildings_info(
+    request: Request,
+    file_name: Optional[str] = Query(None, description="上传的文件名，用于判断格式和是否为 gzip 压缩"),
+    file_format: Optional[str] = Query(None, description="文件格式: text、geojson 或 geojsonseq，默认按文件名判断"),
+    mode: str = Query("bulk", description="导入方式: bulk（COPY 批量导入） 或 delta（增量导入）"),
+    delete_missing: bool = Query(False, description="delta 方式下是否删除文件中已不存在的建筑物"),
+):
+    """
+    流式上传并导入建筑物文件。
+    请求体为文件原始内容（可使用分块传输），边接收边解析并 COPY 入库，不在磁盘或内存中暂存整个文件；
+    gzip 压缩的文件需设置 Content-Encoding: gzip 或文件名以 .gz 结尾。
+    注意：不接受 multipart/form-data，FastAPI 的 UploadFile 会先把整个文件暂存到磁盘。
+    """
+    gzipped = request.headers.get("content-encoding", "").lower() == "gzip" \
+        or (file_name or "").lower().endswith(".gz")
+    file_format = file_format or (detect_format(file_name) if file_name else "text")
+    if file_format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400,
+                            detail=f"格式 {file_format} 不支持流式上传，支持: {', '.join(STREAM_FORMATS)}")
+    if mode not in ("bulk", "delta"):
+        raise HTTPException(status_code=400, detail=f"不支持的导入方式: {mode}")
+
+    os.makedirs(UPLOAD_REJECT_DIR, exist_ok=True)
+    reject_file_path = os.path.join(UPLOAD_REJECT_DIR,
+                                    f"upload_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.reject")
+    logger.info(f"开始流式导入: 文件名={file_name}, 格式={file_format}, gzip={gzipped}, 导入方式={mode}")
+
+    pipe = ChunkPipe(UPLOAD_QUEUE_CHUNKS)
+    # 进度计数：已接收的字节数、导入线程已解析的记录数
+    progress = {"bytes_received": 0, "records_processed": 0}
+
+    def report(done):
+        progress["records_processed"] = done
+
+    def load():
+        try:
+            with get_db_connection(statement_timeout=0) as conn:
+                return insert_buildings_from_stream(conn, pipe.stream, file_format, gzipped, reject_file_path,
+                                                    upsert=mode == "delta", delete_missing=delete_missing,
+                                                    progress=report)
+        finally:
+            pipe.close()
+
+    # 导入在线程中运行，请求体数据块经有界管道传入（管道满时暂停接收，形成反压）
+    load_future = asyncio.get_running_loop().run_in_executor(None, load)
+
+    next_report = UPLOAD_PROGRESS_BYTES
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            progress["bytes_received"] += len(chunk)
+            if not pipe.try_feed(chunk) and not await run_in_threadpool(pipe.feed, chunk):
+                # 导入线程已提前结束（出错），不再接收
+                break
+            if progress["bytes_received"] >= next_report:
+                logger.info(f"流式导入已接收 {progress['bytes_received'] / 1024 / 1024:.0f} MB, "
+                            f"已解析 {progress['records_processed']} 条")
+                next_report += UPLOAD_PROGRESS_BYTES
+        await run_in_threadpool(pipe.feed, None)
+    except Exception as e:
+        # 客户端断开等情况：让导入线程在读取时抛出异常并回滚
+        logger.error(f"接收上传数据时出错: {str(e)}")
+        await run_in_threadpool(pipe.feed, ConnectionAbortedError(f"上传中断: {e}"))
+
+    try:
+        result = await load_future
+    except PoolExhausted:
+        # 连接池繁忙，由 pool_exhausted_handler 返回 429
+        raise
+    except Exception as e:
+        logger.error(f"流式导入时发生错误: {str(e)}")
         return {
             "success": False,
             "code": 500,
-            "errorMsg": "未知错误"
+            "message": f"流式导入时发生错误: {str(e)}",
+            "progress": progress,
         }
+    logger.info(f"流式导入结束: 接收 {progress['bytes_received']} 字节, 解析 {progress['records_processed']} 条")
+    await run_in_threadpool(schedule_recluster, result)
 
-    except Exception as e:
-        logger.error(f"导入建筑物信息发生错误: {str(e)}")
+    if result:
+        result["progress"] = progress
+        return result
 
-        return {
-            "success": False,
-            "code": 501,
-            "errorMsg": "导入时发生异常"
-        }
\ No newline at end of file
+    return {
+        "success": False,
+        "code": 500,
+        "message": "流式导入失败",
+        "progress": progress,
+    }
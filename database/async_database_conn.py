@@ -0,0 +1,156 @@
+# database/async_database_conn.py
+import asyncio
+import os
+import time
+import asyncpg
+from contextlib import asynccontextmanager
+from typing import Optional, AsyncGenerator
+
+# 复用同步连接模块中加载好的 .env 配置
+from database.database_conn import db_config, POOL_TIMEOUT, POOL_MAX_WAITING, POOL_RETRY_AFTER, \
+    CONN_MAX_LIFETIME, STATEMENT_TIMEOUT, per_worker_size
+from database.connection_pool import PoolTimeout, PoolOverloaded
+from utils.logger import logger
+
+# --- 异步连接池配置 ---
+# 从环境变量中读取连接池配置，设置默认值
+# 与同步连接池相同，多进程部署时为整个服务的总数
+ASYNC_MIN_CONN_SIZE = per_worker_size(int(os.getenv("DB_ASYNC_MIN_CONN_SIZE", "10"))) # 最小连接数
+ASYNC_MAX_CONN_SIZE = per_worker_size(int(os.getenv("DB_ASYNC_MAX_CONN_SIZE", "50"))) # 最大连接数
+
+logger.info(f"异步连接池配置: Min={ASYNC_MIN_CONN_SIZE}, Max={ASYNC_MAX_CONN_SIZE}")
+
+
+class _TimedConnection(asyncpg.Connection):
+    """记录建立时间的连接，用于按存活时间回收（asyncpg 自带的 max_inactive_connection_lifetime 只按空闲时间）"""
+    __slots__ = ("created_at",)
+
+
+# --- 全局异步连接池实例 ---
+async_connection_pool: Optional[asyncpg.Pool] = None
+# 等待连接的协程数和等待时间统计（等待超时、排队上限与同步连接池共用配置）
+_async_waiting = 0
+_async_stats = {"checkouts": 0, "wait_total": 0.0, "wait_max": 0.0, "timeouts": 0, "rejected": 0, "recycled": 0}
+
+async def init_async_connection_pool(init=None):
+    """
+    初始化全局异步连接池（asyncpg）。
+    必须在事件循环中调用，通常放在 FastAPI 的 lifespan 启动阶段。
+    init 为每个新连接建立后执行一次的协程函数（如预编译常用语句）。
+    """
+    global async_connection_pool
+
+    async def init_connection(conn):
+        conn.created_at = time.monotonic()
+        if init is not None:
+            await init(conn)
+
+    if async_connection_pool is None:
+        try:
+            async_connection_pool = await asyncpg.create_pool(
+                database=db_config["dbname"],
+                user=db_config["user"],
+                password=db_config["password"],
+                host=db_config["host"],
+                port=int(db_config["port"]) if db_config["port"] else None,
+                min_size=ASYNC_MIN_CONN_SIZE,
+                max_size=ASYNC_MAX_CONN_SIZE,
+                # 会话设置在建立连接时设置一次。存活超过 CONN_MAX_LIFETIME 的连接在归还时关闭
+                # （与同步连接池相同，见 get_async_db_connection），空闲超过该时间的连接也由 asyncpg 关闭
+                connection_class=_TimedConnection,
+                max_inactive_connection_lifetime=CONN_MAX_LIFETIME,
+                init=init_connection,
+                server_settings={
+                    "application_name": "building_collision",
+                    "statement_timeout": str(STATEMENT_TIMEOUT),
+                },
+            )
+            logger.info("✅ 异步数据库连接池初始化成功")
+        except Exception as e:
+            logger.error(f"❌ 异步数据库连接池初始化失败: {e}")
+            raise
+    else:
+        logger.info("⚠️ 异步数据库连接池已存在，无需重复初始化")
+
+async def close_async_connection_pool(timeout: Optional[float] = None):
+    """
+    关闭全局异步连接池。
+    应该在应用关闭时调用；等待使用中的连接归还，超过 timeout 秒后强制断开。
+    """
+    global async_connection_pool
+    if async_connection_pool:
+        try:
+            try:
+                await asyncio.wait_for(async_connection_pool.close(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ 关闭异步连接池超时，强制断开剩余连接")
+                async_connection_pool.terminate()
+            async_connection_pool = None # 重置为 None
+            logger.info("✅ 异步数据库连接池已关闭")
+        except Exception as e:
+            logger.error(f"❌ 关闭异步数据库连接池时出错: {e}")
+
+# --- 使用异步连接池的上下文管理器 ---
+@asynccontextmanager
+async def get_async_db_connection() -> AsyncGenerator[asyncpg.Connection, None]:
+    """
+    从异步连接池获取数据库连接的上下文管理器。
+    等待空闲连接时不会阻塞事件循环，连接在退出时自动归还。
+    注意：需要在使用此函数前调用 init_async_connection_pool()。
+    """
+    if async_connection_pool is None:
+        logger.error("❌ 异步连接池未初始化，请先调用 init_async_connection_pool()")
+        raise RuntimeError("Async connection pool not initialized")
+
+    global _async_waiting
+    if async_connection_pool.get_idle_size() == 0 \
+            and async_connection_pool.get_size() >= async_connection_pool.get_max_size() \
+            and _async_waiting >= POOL_MAX_WAITING:
+        _async_stats["rejected"] += 1
+        logger.warning(f"⚠️ 异步连接池繁忙: 等待连接的请求已达上限 ({POOL_MAX_WAITING})")
+        raise PoolOverloaded(f"等待数据库连接的请求已达上限 ({POOL_MAX_WAITING})", POOL_RETRY_AFTER)
+
+    start = time.monotonic()
+    _async_waiting += 1
+    try:
+        conn = await async_connection_pool.acquire(timeout=POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        _async_stats["timeouts"] += 1
+        logger.warning(f"⚠️ 异步连接池繁忙: {POOL_TIMEOUT:g} 秒内没有空闲连接")
+        raise PoolTimeout(f"{POOL_TIMEOUT:g} 秒内没有空闲的数据库连接", POOL_RETRY_AFTER)
+    finally:
+        _async_waiting -= 1
+
+    wait_time = time.monotonic() - start
+    _async_stats["checkouts"] += 1
+    _async_stats["wait_total"] += wait_time
+    _async_stats["wait_max"] = max(_async_stats["wait_max"], wait_time)
+    try:
+        logger.debug("🔄 从异步连接池获取连接")
+        yield conn
+    finally:
+        if time.monotonic() - conn.created_at > CONN_MAX_LIFETIME:
+            # 关闭后连接池在下次取用时新建连接；关闭的连接随即从连接池中移除，release 不再处理
+            _async_stats["recycled"] += 1
+            await conn.close()
+        await async_connection_pool.release(conn)
+
+def get_async_connection_pool_stats() -> dict:
+    """
+    异步连接池统计（连接数、排队数、平均/最大等待时间、超时和拒绝次数），未初始化时返回空字典。
+    """
+    if async_connection_pool is None:
+        return {}
+    checkouts = _async_stats["checkouts"]
+    return {
+        "max_size": async_connection_pool.get_max_size(),
+        "size": async_connection_pool.get_size(),
+        "idle": async_connection_pool.get_idle_size(),
+        "waiting": _async_waiting,
+        "checkouts": checkouts,
+        "avg_wait_ms": round(_async_stats["wait_total"] / checkouts * 1000, 3) if checkouts else 0.0,
+        "max_wait_ms": round(_async_stats["wait_max"] * 1000, 3),
+        "timeouts": _async_stats["timeouts"],
+        "rejected": _async_stats["rejected"],
+        "recycled": _async_stats["recycled"],
+    }
@@ -0,0 +1,304 @@
+import collections
+import threading
+import time
+from typing import Optional
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool
+from psycopg2.extras import RealDictCursor
+
+from utils.logger import logger
+
+# 保留最近多少次获取连接的等待时间用于计算分位数
+WAIT_SAMPLE_SIZE = 1000
+
+
+class PoolExhausted(pool.PoolError):
+    """
+    连接池繁忙：等待超时或等待队列已满。
+    继承 PoolError，原有按 PoolError 处理的代码不受影响；retry_after 为建议客户端重试的间隔（秒）。
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PoolTimeout(PoolExhausted):
+    """在等待时间内没有空闲连接"""
+
+
+class PoolOverloaded(PoolExhausted):
+    """等待连接的请求数已达上限，直接拒绝"""
+
+
+class _PooledConnection:
+    """物理连接及其元数据"""
+    __slots__ = ("conn", "created_at", "last_used", "statement_timeout")
+
+    def __init__(self, conn, statement_timeout):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.statement_timeout = statement_timeout
+
+
+class BoundedConnectionPool:
+    """
+    有界等待的线程安全连接池（替代 ThreadedConnectionPool）。
+    - 连接全部占用时在 timeout 秒内排队等待，超时抛出 PoolTimeout；
+      排队的请求数达到 max_waiting 时直接抛出 PoolOverloaded，由接口返回 429
+    - 会话设置（UTF8 编码、RealDictCursor、statement_timeout、application_name）在建立物理连接时设置一次
+    - 空闲超过 health_check_idle 秒的连接取出时先 SELECT 1 检查，失效则重建；
+      存活超过 max_lifetime 秒的连接归还时关闭，之后按需新建
+    - stats() 返回等待次数、等待时间（平均、P95、最大）、超时和拒绝次数等
+    """
+
+    def __init__(self, dsn, min_size, max_size, timeout=5.0, max_waiting=100, max_lifetime=3600.0,
+                 health_check_idle=30.0, statement_timeout=0, retry_after=1, application_name="building_collision"):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"连接池大小配置无效: min={min_size}, max={max_size}")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_waiting = max_waiting
+        self.max_lifetime = max_lifetime
+        self.health_check_idle = health_check_idle
+        self.statement_timeout = statement_timeout
+        self.retry_after = retry_after
+        self.application_name = application_name
+
+        self._cond = threading.Condition()
+        # 空闲连接后进先出，常用的连接保持温热，多余的连接空闲到期后被回收
+        self._idle = collections.deque()
+        self._in_use = {}
+        # 已建立和正在建立的连接数
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_samples = collections.deque(maxlen=WAIT_SAMPLE_SIZE)
+        self._timeouts = 0
+        self._rejected = 0
+        self._created = 0
+        self._recycled = 0
+        self._health_check_failures = 0
+
+        for _ in range(min_size):
+            self._size += 1
+            try:
+                self._idle.append(self._connect(self.statement_timeout))
+            except Exception:
+                self._size -= 1
+                self.closeall()
+                raise
+
+    def _connect(self, statement_timeout):
+        """建立物理连接，会话设置随启动参数一次发送，不额外往返"""
+        conn = psycopg2.connect(
+            self.dsn,
+            client_encoding="UTF8",
+            application_name=self.application_name,
+            options=f"-c statement_timeout={int(statement_timeout)}",
+        )
+        conn.cursor_factory = RealDictCursor
+        with self._cond:
+            self._created += 1
+        return _PooledConnection(conn, statement_timeout)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, entry):
+        try:
+            with entry.conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute("SELECT 1")
+            entry.conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ 空闲连接健康检查失败，重建连接: {e}")
+            return False
+
+    def _prepare(self, entry, statement_timeout):
+        """
+        取出连接前的检查：超过最大存活时间或健康检查失败的连接替换为新连接；
+        调用方要求的 statement_timeout 与连接当前值不同时才执行 SET。
+        """
+        now = time.monotonic()
+        if entry is not None and now - entry.created_at > self.max_lifetime:
+            with self._cond:
+                self._recycled += 1
+            self._close_quietly(entry.conn)
+            entry = None
+        elif entry is not None and now - entry.last_used > self.health_check_idle and not self._is_healthy(entry):
+            with self._cond:
+                self._health_check_failures += 1
+            self._close_quietly(entry.conn)
+            entry = None
+
+        if entry is None:
+            return self._connect(statement_timeout)
+
+        if entry.statement_timeout != statement_timeout:
+            # SET 需立即提交，否则调用方回滚事务时会一并撤销
+            try:
+                with entry.conn.cursor() as cur:
+                    cur.execute("SET statement_timeout = %s", (int(statement_timeout),))
+                entry.conn.commit()
+            except Exception:
+                self._close_quietly(entry.conn)
+                raise
+            entry.statement_timeout = statement_timeout
+        return entry
+
+    def getconn(self, timeout: Optional[float] = None, statement_timeout: Optional[int] = None):
+        """
+        获取连接。timeout 为最长等待秒数，默认取连接池配置；
+        statement_timeout 为本次使用的语句超时（毫秒，0 不限制），默认取连接池配置，后台任务可传 0。
+        """
+        timeout = self.timeout if timeout is None else timeout
+        statement_timeout = self.statement_timeout if statement_timeout is None else statement_timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        with self._cond:
+            if self._closed:
+                raise pool.PoolError("connection pool is closed")
+            if not self._idle and self._size >= self.max_size and self._waiting >= self.max_waiting:
+                self._rejected += 1
+                raise PoolOverloaded(f"等待数据库连接的请求已达上限 ({self.max_waiting})", self.retry_after)
+
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # 占住一个名额，在锁外建立连接
+                    self._size += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"{timeout:g} 秒内没有空闲的数据库连接", self.retry_after)
+                self._waiting += 1
+                waited = True
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                if self._closed:
+                    raise pool.PoolError("connection pool is closed")
+
+            wait_time = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_samples.append(wait_time)
+            if waited:
+                self._waited += 1
+                self._wait_total += wait_time
+                self._wait_max = max(self._wait_max, wait_time)
+
+        try:
+            entry = self._prepare(entry, statement_timeout)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use[id(entry.conn)] = entry
+        return entry.conn
+
+    def putconn(self, conn, close: bool = False):
+        """
+        归还连接。未结束的事务会回滚；已断开、状态未知或超过最大存活时间的连接直接关闭。
+        """
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            raise pool.PoolError("trying to put unkeyed connection")
+
+        discard = close or conn.closed or self._closed
+        if not discard:
+            try:
+                status = conn.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        recycle = not discard and time.monotonic() - entry.created_at > self.max_lifetime
+
+        if discard or recycle:
+            self._close_quietly(conn)
+        with self._cond:
+            if recycle:
+                self._recycled += 1
+            if discard or recycle:
+                self._size -= 1
+            else:
+                entry.last_used = time.monotonic()
+                self._idle.append(entry)
+            self._cond.notify()
+
+    def closeall(self, timeout: float = 0):
+        """
+        关闭连接池：不再发放连接（等待中的请求收到 PoolError），关闭所有空闲连接，
+        使用中的连接归还时关闭。timeout > 0 时最多等待该秒数让使用中的连接归还（优雅退出）。
+        """
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._close_quietly(entry.conn)
+
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_use:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"⚠️ 关闭连接池时仍有 {len(self._in_use)} 个连接未归还")
+                    break
+                self._cond.wait(remaining)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self):
+        """连接数、等待时间和拒绝情况统计"""
+        with self._cond:
+            samples = sorted(self._wait_samples)
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "waited_checkouts": self._waited,
+                "avg_wait_ms": round(self._wait_total / self._waited * 1000, 3) if self._waited else 0.0,
+                "p95_wait_ms": round(samples[int(len(samples) * 0.95)] * 1000, 3) if samples else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 3),
+                "timeouts": self._timeouts,
+                "rejected": self._rejected,
+                "created": self._created,
+                "recycled": self._recycled,
+                "health_check_failures": self._health_check_failures,
+            }
@@ -2,7 +2,6 @@
 import os
 import psycopg2
 from psycopg2 import pool # 导入 pool 模块
-from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
 from typing import Optional, Generator
 import logging
@@ -19,6 +18,7 @@ dotenv_env_path = os.path.join(dotenv_path_dir, f".env.{env}")
 # logger = logging.getLogger(__name__)
 # 使用你现有的 logger
 from utils.logger import logger
+from database.connection_pool import BoundedConnectionPool, PoolExhausted, PoolTimeout, PoolOverloaded
 
 logger.info(f"加载环境变量文件: {dotenv_env_path}")
 # 加载环境变量
@@ -35,33 +35,54 @@ db_config = {
 
 # --- 连接池配置 ---
 # 从环境变量中读取连接池配置，设置默认值
-MIN_CONN_SIZE = int(os.getenv("DB_MIN_CONN_SIZE", "10")) # 最小连接数
-MAX_CONN_SIZE = int(os.getenv("DB_MAX_CONN_SIZE", "80")) # 最大连接数
+# 多进程部署时（main.py 生产模式设置 WEB_WORKER_COUNT）连接数为整个服务的总数，平均分给各进程
+WEB_WORKER_COUNT = max(int(os.getenv("WEB_WORKER_COUNT", "1")), 1)
+
+def per_worker_size(total: int) -> int:
+    """总连接数平均分给各 Web 进程后每个进程的连接数（向上取整，至少为 1）"""
+    return max(-(-total // WEB_WORKER_COUNT), 1)
+
+MIN_CONN_SIZE = per_worker_size(int(os.getenv("DB_MIN_CONN_SIZE", "10"))) # 最小连接数
+MAX_CONN_SIZE = per_worker_size(int(os.getenv("DB_MAX_CONN_SIZE", "80"))) # 最大连接数
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5")) # 连接全部占用时最长等待秒数
+POOL_MAX_WAITING = int(os.getenv("DB_POOL_MAX_WAITING", "100")) # 最多排队等待的请求数，超过直接拒绝（429）
+POOL_RETRY_AFTER = int(os.getenv("DB_POOL_RETRY_AFTER", "1")) # 拒绝时建议客户端重试的间隔（秒）
+CONN_MAX_LIFETIME = float(os.getenv("DB_CONN_MAX_LIFETIME", "3600")) # 物理连接最长存活秒数
+CONN_HEALTH_CHECK_IDLE = float(os.getenv("DB_CONN_HEALTH_CHECK_IDLE", "30")) # 空闲超过该秒数的连接取出前先检查
+STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0")) # 语句超时（毫秒），0 不限制；后台任务不受限制
 
 # 构建连接字符串（过滤掉 None 值）
 DB_CONN_STRING = " ".join([f"{k}={v}" for k, v in db_config.items() if v is not None])
 logger.info(f"数据库连接字符串 (用于连接池): {DB_CONN_STRING}")
-logger.info(f"连接池配置: Min={MIN_CONN_SIZE}, Max={MAX_CONN_SIZE}")
+logger.info(f"连接池配置: Min={MIN_CONN_SIZE}, Max={MAX_CONN_SIZE}, 等待超时={POOL_TIMEOUT}s, "
+            f"最大排队={POOL_MAX_WAITING}, 语句超时={STATEMENT_TIMEOUT}ms")
 
 # --- 全局连接池实例 ---
 # 声明全局变量，稍后初始化
-connection_pool: Optional[psycopg2.pool.ThreadedConnectionPool] = None
+connection_pool: Optional[BoundedConnectionPool] = None
 
-def init_connection_pool():
+def init_connection_pool(min_size: Optional[int] = None, max_size: Optional[int] = None,
+                         statement_timeout: Optional[int] = None):
     """
     初始化全局连接池。
     应该在应用启动时调用一次。
+    min_size / max_size 默认取环境变量中的配置，导入子进程等场景可以传入更小的值；
+    statement_timeout（毫秒）默认取 DB_STATEMENT_TIMEOUT，只运行长任务的进程传 0。
     """
     global connection_pool
     if connection_pool is None:
         try:
-            # 创建 ThreadedConnectionPool
-            # cursor_factory=RealDictCursor 不能直接传给 pool，需要在获取连接后设置
-            connection_pool = psycopg2.pool.ThreadedConnectionPool(
-                MIN_CONN_SIZE,
-                MAX_CONN_SIZE,
-                DB_CONN_STRING
-                # cursor_factory=RealDictCursor # 注意：pool 不直接支持 cursor_factory
+            # 会话设置（UTF8、RealDictCursor、statement_timeout）在建立物理连接时设置一次
+            connection_pool = BoundedConnectionPool(
+                DB_CONN_STRING,
+                min_size if min_size is not None else MIN_CONN_SIZE,
+                max_size if max_size is not None else MAX_CONN_SIZE,
+                timeout=POOL_TIMEOUT,
+                max_waiting=POOL_MAX_WAITING,
+                max_lifetime=CONN_MAX_LIFETIME,
+                health_check_idle=CONN_HEALTH_CHECK_IDLE,
+                statement_timeout=statement_timeout if statement_timeout is not None else STATEMENT_TIMEOUT,
+                retry_after=POOL_RETRY_AFTER,
             )
             logger.info("✅ 数据库连接池初始化成功")
         except Exception as e:
@@ -70,76 +91,70 @@ def init_connection_pool():
     else:
         logger.info("⚠️ 数据库连接池已存在，无需重复初始化")
 
-def close_connection_pool():
+def close_connection_pool(timeout: float = 0):
     """
     关闭全局连接池。
-    应该在应用关闭时调用。
+    应该在应用关闭时调用；timeout 为等待使用中的连接归还的最长秒数。
     """
     global connection_pool
     if connection_pool:
         try:
-            connection_pool.closeall()
+            connection_pool.closeall(timeout)
             connection_pool = None # 重置为 None
             logger.info("✅ 数据库连接池已关闭")
         except Exception as e:
             logger.error(f"❌ 关闭数据库连接池时出错: {e}")
 
+def get_connection_pool_stats() -> dict:
+    """
+    连接池统计（连接数、等待时间、超时和拒绝次数），连接池未初始化时返回空字典。
+    """
+    return connection_pool.stats() if connection_pool else {}
+
 # --- 使用连接池的上下文管理器 ---
 @contextmanager
-def get_db_connection() -> Generator[psycopg2.extensions.connection, None, None]:
+def get_db_connection(timeout: Optional[float] = None,
+                      statement_timeout: Optional[int] = None) -> Generator[psycopg2.extensions.connection, None, None]:
     """
     从连接池获取数据库连接的上下文管理器。
     自动处理连接的获取和归还。
+    连接全部占用时最多等待 timeout 秒（默认 DB_POOL_TIMEOUT），超时或排队已满时抛出 PoolExhausted。
+    导入、高度补全、CLUSTER 等长任务传 statement_timeout=0 取消语句超时。
     注意：需要在使用此函数前调用 init_connection_pool()。
     """
     global connection_pool
-    conn = None
     if connection_pool is None:
         logger.error("❌ 连接池未初始化，请先调用 init_connection_pool()")
         raise RuntimeError("Connection pool not initialized")
 
     try:
-        # 从连接池获取一个连接
-        conn = connection_pool.getconn()
-        if conn:
-            # 设置连接的游标工厂为 RealDictCursor
-            # 注意：每次获取连接后都需要设置，因为 pool 本身不管理这个
-            conn.cursor_factory = RealDictCursor
-            conn.set_client_encoding('UTF8')
-            logger.debug("🔄 从连接池获取连接")
-            yield conn
-        else:
-            logger.error("❌ 无法从连接池获取数据库连接")
-            raise psycopg2.OperationalError("Failed to get connection from pool")
+        conn = connection_pool.getconn(timeout=timeout, statement_timeout=statement_timeout)
+    except PoolExhausted as pe:
+        logger.warning(f"⚠️ 连接池繁忙: {pe}")
+        raise
     except psycopg2.pool.PoolError as pe:
         logger.error(f"❌ 连接池错误: {pe}")
         raise
     except Exception as e:
         logger.error(f"❌ 从连接池获取连接时发生错误: {e}")
-        # 如果发生错误，且连接已获取，则立即放回池中
-        if conn:
-            connection_pool.putconn(conn)
         raise
+
+    logger.debug("🔄 从连接池获取连接")
+    try:
+        yield conn
     finally:
-        # 确保连接在使用后被归还到池中
-        if conn:
+        # 确保连接在使用后被归还到池中（未结束的事务回滚，损坏的连接关闭）
+        try:
+            connection_pool.putconn(conn)
+            logger.debug("🔄 连接已归还到连接池")
+        except Exception as putback_error:
+            logger.error(f"❌ 将连接归还到连接池时出错: {putback_error}")
+            # 如果归还失败，尝试关闭连接以避免泄露
             try:
-                # 检查连接是否仍然有效（可选，但推荐）
-                # conn.reset() # 重置连接状态，但这可能不总是必要的或推荐的
-                # 更安全的做法是检查连接是否处于良好状态再放回
-                # 但如果发生错误，可能连接状态已损坏，直接放回可能有问题
-                # 一种策略是：如果发生异常，关闭连接并让池创建新连接
-                # 但通常 putconn 会处理这些问题。
-                connection_pool.putconn(conn)
-                logger.debug("🔄 连接已归还到连接池")
-            except Exception as putback_error:
-                logger.error(f"❌ 将连接归还到连接池时出错: {putback_error}")
-                # 如果归还失败，尝试关闭连接以避免泄露
-                try:
-                    conn.close()
-                    logger.warning("⚠️ 连接归还失败，已强制关闭连接")
-                except Exception as close_error:
-                     logger.error(f"❌ 强制关闭连接时也出错: {close_error}")
+                conn.close()
+                logger.warning("⚠️ 连接归还失败，已强制关闭连接")
+            except Exception as close_error:
+                 logger.error(f"❌ 强制关闭连接时也出错: {close_error}")
 
 # --- （可选）简化版获取连接函数（不推荐用于需要自动关闭的场景）---
 # 如果你需要一个简单的函数来获取连接（例如在某些特定场景下），
@@ -156,8 +171,6 @@ def get_db_connection() -> Generator[psycopg2.extensions.connection, None, None]
 #     try:
 #         conn = connection_pool.getconn()
 #         if conn:
-#             conn.cursor_factory = RealDictCursor
-#             conn.set_client_encoding('UTF8')
 #             return conn
 #         else:
 #             raise psycopg2.OperationalError("Failed to get connection from pool")
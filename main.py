@@ -1,15 +1,133 @@
+import argparse
+import gc
+import os
+
 import uvicorn
+from dotenv import load_dotenv
 
+# 与 database/database_conn.py 相同，按 ENV 加载 .env.{ENV}（启动参数需要在导入应用之前读取）
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), f".env.{os.getenv('ENV', 'development')}"))
 
-def main():
+HOST = os.getenv("WEB_HOST", "0.0.0.0")
+PORT = int(os.getenv("WEB_PORT", "8000"))
+# 运行模式: development（单进程，代码变更自动重载） 或 production（多进程）
+SERVER_MODE = os.getenv("SERVER_MODE", "development").lower()
+# 生产模式的 Web 进程数，0 表示按可用 CPU 核数
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))
+# 生产模式是否在主进程预加载只读状态（内存碰撞索引、高度栅格）后再 fork，各进程写时复制共享
+WEB_PRELOAD = os.getenv("WEB_PRELOAD", "true").lower() == "true"
+# 优雅退出：停止接收新请求后等待处理中的请求完成、连接归还的最长秒数
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+# HTTP keep-alive 秒数
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "5"))
+
+
+def available_cpus() -> int:
+    """当前进程可用的 CPU 核数（容器中绑核时小于主机核数）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def run_development():
     uvicorn.run(
         "api.web:app",
-        host="0.0.0.0",
-        port=8000,
+        host=HOST,
+        port=PORT,
         reload=True,
         log_level="info"
     )
 
 
+def _worker_class():
+    """
+    gunicorn 的 uvicorn worker：安装了 uvloop / httptools 时使用（auto），
+    收到 SIGTERM 后最多等待 WEB_GRACEFUL_TIMEOUT 秒让处理中的请求完成，再执行 lifespan 关闭连接池。
+    """
+    try:
+        from uvicorn_worker import UvicornWorker
+    except ImportError:
+        from uvicorn.workers import UvicornWorker
+
+    class CollisionWorker(UvicornWorker):
+        CONFIG_KWARGS = {"loop": "auto", "http": "auto", "timeout_graceful_shutdown": WEB_GRACEFUL_TIMEOUT}
+
+    return CollisionWorker
+
+
+def run_production(workers: int, preload: bool):
+    """
+    多进程运行：gunicorn 主进程管理 workers 个 uvicorn worker，共用同一监听端口。
+    preload 为 True 时主进程先导入应用并构建只读状态，再 fork 出各 worker；
+    没有 gunicorn 时（如 Windows）退回 uvicorn 自带的多进程（spawn 启动，不能预加载）。
+    """
+    # 连接池按进程数平均分配 DB_*_CONN_SIZE（见 database/database_conn.py），须在导入应用之前设置
+    os.environ["WEB_WORKER_COUNT"] = str(workers)
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print(f"未安装 gunicorn，使用 uvicorn 多进程模式（{workers} 个进程，不预加载）")
+        uvicorn.run(
+            "api.web:app",
+            host=HOST,
+            port=PORT,
+            workers=workers,
+            loop="auto",
+            http="auto",
+            timeout_keep_alive=WEB_KEEPALIVE,
+            timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT,
+            log_level="info"
+        )
+        return
+
+    class ProductionApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from api.web import app, preload_shared_state
+            if self.cfg.preload_app:
+                # 在主进程中构建一次；之后的对象不再参与循环垃圾回收的扫描，
+                # 避免 GC 写对象头导致共享的内存页被逐个复制
+                preload_shared_state()
+                gc.freeze()
+            return app
+
+    print(f"生产模式: {workers} 个 worker, 预加载={preload}")
+    ProductionApplication({
+        "bind": f"{HOST}:{PORT}",
+        "workers": workers,
+        "worker_class": _worker_class(),
+        "preload_app": preload,
+        "graceful_timeout": WEB_GRACEFUL_TIMEOUT,
+        "keepalive": WEB_KEEPALIVE,
+        # 预加载和 lifespan 启动（构建索引、建立连接池）可能较慢，不按默认 30 秒判定 worker 无响应
+        "timeout": max(WEB_GRACEFUL_TIMEOUT, 120),
+        "loglevel": "info",
+    }).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="3D Building Collision Detector")
+    parser.add_argument("--mode", choices=["development", "production"], default=SERVER_MODE,
+                        help="运行模式，默认取环境变量 SERVER_MODE")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS,
+                        help="生产模式的 Web 进程数，0 表示按可用 CPU 核数")
+    parser.add_argument("--no-preload", action="store_true", help="生产模式下不在主进程预加载只读状态")
+    args = parser.parse_args()
+
+    if args.mode == "production":
+        run_production(args.workers or available_cpus(), WEB_PRELOAD and not args.no_preload)
+    else:
+        run_development()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
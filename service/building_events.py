@@ -0,0 +1,153 @@
+import json
+import os
+import select
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import psycopg2
+
+from utils.logger import logger
+
+# 外包框 (min_lon, min_lat, max_lon, max_lat)，None 表示范围未知（视为全部）
+Bounds = Optional[Tuple[float, float, float, float]]
+
+_listeners: List[Callable[[Bounds], None]] = []
+_relay: Optional["BuildingEventsRelay"] = None
+
+
+def register_buildings_changed_listener(listener: Callable[[Bounds], None]):
+    """
+    注册建筑物数据变更监听器（例如碰撞结果缓存）。
+    导入、更新建筑物的流程在提交后会以变更区域的外包框调用监听器。
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def _dispatch(bounds: Bounds):
+    for listener in list(_listeners):
+        try:
+            listener(bounds)
+        except Exception as e:
+            logger.error(f"❌ 建筑物变更监听器执行失败: {e}")
+
+
+def notify_buildings_changed(bounds: Bounds):
+    """
+    通知所有监听器：bounds 范围内的建筑物已发生变化。
+    监听器出错只记录日志，不影响导入/更新流程。
+    已启动跨进程转发时同时通知其它进程。
+    """
+    _dispatch(bounds)
+    if _relay is not None:
+        _relay.publish(bounds)
+
+
+# --- 跨进程转发 ---
+# 多进程部署（main.py 生产模式）时每个进程有自己的缓存和高度栅格，某个进程导入或更新建筑物后
+# 通过 PostgreSQL NOTIFY 通知其它进程，各进程的转发线程 LISTEN 后调用本进程的监听器。
+CHANNEL = "buildings_changed"
+# 转发线程等待通知的轮询间隔（秒），也是连接断开后的重连间隔
+RELAY_POLL_INTERVAL = 5
+
+
+class BuildingEventsRelay:
+    """
+    用专用连接 LISTEN 变更通道，收到其它进程的通知后调用本进程的监听器；
+    publish 使用另一条专用连接发送 NOTIFY（不占用连接池）。
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._pid = os.getpid()
+        self._stopped = False
+        self._publish_conn = None
+        self._publish_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._listening_once = False
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, application_name="building_collision_events")
+        conn.autocommit = True
+        return conn
+
+    def publish(self, bounds: Bounds):
+        payload = json.dumps({"pid": self._pid, "bounds": list(bounds) if bounds is not None else None})
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publish_conn is None or self._publish_conn.closed:
+                        self._publish_conn = self._connect()
+                    with self._publish_conn.cursor() as cur:
+                        cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+                    return
+                except psycopg2.Error as e:
+                    self._publish_conn = None
+                    if attempt:
+                        logger.error(f"❌ 发送建筑物变更通知失败: {e}")
+
+    def _listen_loop(self):
+        conn = None
+        while not self._stopped:
+            try:
+                if conn is None:
+                    conn = self._connect()
+                    with conn.cursor() as cur:
+                        cur.execute(f"LISTEN {CHANNEL}")
+                    # 断线期间可能漏掉通知，重连后按范围未知处理
+                    if self._listening_once:
+                        _dispatch(None)
+                    self._listening_once = True
+                if select.select([conn], [], [], RELAY_POLL_INTERVAL) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    message = json.loads(notify.payload)
+                    if message.get("pid") == self._pid:
+                        continue
+                    bounds = message.get("bounds")
+                    _dispatch(tuple(bounds) if bounds is not None else None)
+            except Exception as e:
+                logger.error(f"❌ 建筑物变更通知监听出错，{RELAY_POLL_INTERVAL} 秒后重连: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+                time.sleep(RELAY_POLL_INTERVAL)
+        if conn is not None:
+            conn.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._listen_loop, name="building-events-relay", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join(timeout=RELAY_POLL_INTERVAL + 1)
+        with self._publish_lock:
+            if self._publish_conn is not None:
+                self._publish_conn.close()
+                self._publish_conn = None
+
+
+def start_buildings_changed_relay(dsn: str):
+    """
+    启动跨进程变更转发（每个 Web 进程在启动时调用一次，须在 fork 之后）。
+    """
+    global _relay
+    if _relay is None:
+        _relay = BuildingEventsRelay(dsn)
+        _relay.start()
+        logger.info("✅ 建筑物变更跨进程转发已启动")
+
+
+def stop_buildings_changed_relay():
+    global _relay
+    if _relay is not None:
+        _relay.stop()
+        _relay = None
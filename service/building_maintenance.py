@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+
+import psycopg2
+
+from database.database_conn import init_connection_pool, get_db_connection
+
+BUILDINGS_TABLE = "hz_yuhang_buildings"
+# 按中心点 geohash（Z 序空间填充曲线）排序的表达式索引，CLUSTER 以它为顺序重排表数据
+GEOHASH_INDEX = "hz_yuhang_buildings_geohash_idx"
+
+# geohash 排序的相关系数低于该值时重新 CLUSTER（1 表示表的物理顺序与 geohash 顺序完全一致）
+RECLUSTER_CORRELATION_THRESHOLD = float(os.getenv("RECLUSTER_CORRELATION_THRESHOLD", "0.9"))
+# 一次导入变更的行数达到该值时，在导入后检查是否需要重新 CLUSTER
+RECLUSTER_MIN_CHANGED_ROWS = int(os.getenv("RECLUSTER_MIN_CHANGED_ROWS", "10000"))
+# 多进程之间互斥执行 CLUSTER 的 advisory 锁键
+CLUSTER_LOCK_KEY = f"cluster:{BUILDINGS_TABLE}"
+
+
+def ensure_geohash_index(conn):
+    """
+    创建 geohash 表达式索引（已存在时跳过）。
+    CLUSTER 不能使用部分索引，索引不带 WHERE 条件（geom 为空的行索引值为 NULL）；
+    早期版本创建的部分索引先删除再重建。
+    """
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute("""
+            SELECT i.indpred IS NOT NULL
+            FROM pg_index i
+            WHERE i.indexrelid = to_regclass(%s)
+        """, (GEOHASH_INDEX,))
+        row = cur.fetchone()
+        if row and row[0]:
+            print(f"删除部分索引 {GEOHASH_INDEX}，重建为完整索引")
+            cur.execute(f"DROP INDEX {GEOHASH_INDEX}")
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS {GEOHASH_INDEX}
+                ON {BUILDINGS_TABLE} (ST_GeoHash(ST_Centroid(geom), 10))
+        """)
+    conn.commit()
+
+
+def clustering_correlation(conn):
+    """
+    更新统计信息，返回表的物理顺序与 geohash 顺序的相关系数（-1~1），没有统计信息时返回 None。
+    表达式索引的统计信息记录在 pg_stats 中以索引名为 tablename 的行。
+    """
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute(f"ANALYZE {BUILDINGS_TABLE}")
+        cur.execute("""
+            SELECT correlation FROM pg_stats
+            WHERE schemaname = current_schema() AND tablename = %s
+        """, (GEOHASH_INDEX,))
+        row = cur.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+
+def cluster_buildings(conn, force=False, threshold=RECLUSTER_CORRELATION_THRESHOLD):
+    """
+    按 geohash 顺序 CLUSTER 建筑物表，使空间上相邻的建筑物存放在相邻的数据页，
+    碰撞查询命中的少量建筑物只需读取很少的页。
+    force=False 时只在相关系数低于 threshold 时执行。
+    注意：CLUSTER 期间持有 ACCESS EXCLUSIVE 锁，碰撞查询会等待到 CLUSTER 结束。
+    多个进程同时调用时用会话级 advisory 锁保证只有一个执行，其余直接返回 skipped。
+    """
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (CLUSTER_LOCK_KEY,))
+        acquired = cur.fetchone()[0]
+    conn.commit()
+    if not acquired:
+        print("其他进程正在执行 CLUSTER，跳过")
+        return {"clustered": False, "skipped": True, "reason": "其他进程正在执行 CLUSTER"}
+
+    try:
+        return _cluster_buildings(conn, force, threshold)
+    finally:
+        conn.rollback()
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (CLUSTER_LOCK_KEY,))
+        conn.commit()
+
+
+def _cluster_buildings(conn, force, threshold):
+    ensure_geohash_index(conn)
+
+    correlation = clustering_correlation(conn)
+    print(f"当前 geohash 顺序相关系数: {correlation}")
+    if not force and correlation is not None and abs(correlation) >= threshold:
+        print(f"相关系数不低于 {threshold}，无需重新 CLUSTER")
+        return {"clustered": False, "correlation_before": correlation, "correlation_after": correlation}
+
+    start_time = time.time()
+    with conn.cursor() as cur:
+        cur.execute(f"CLUSTER {BUILDINGS_TABLE} USING {GEOHASH_INDEX}")
+    conn.commit()
+    elapsed = time.time() - start_time
+
+    correlation_after = clustering_correlation(conn)
+    print(f"CLUSTER 完成, 耗时 {elapsed:.2f} 秒, 相关系数 {correlation} -> {correlation_after}")
+
+    return {
+        "clustered": True,
+        "correlation_before": correlation,
+        "correlation_after": correlation_after,
+        "elapsed_seconds": elapsed,
+    }
+
+
+# 维护命令：python -m service.building_maintenance [--force]
+if __name__ == "__main__":
+    init_connection_pool(min_size=1, max_size=1, statement_timeout=0)
+    with get_db_connection() as conn:
+        print(cluster_buildings(conn, force="--force" in sys.argv[1:]))
@@ -0,0 +1,431 @@
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+from typing import Any, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+# 可选依赖：FlatGeobuf 需要 pyogrio，GeoParquet 需要 pyarrow，两者的 WKB 几何都需要 shapely 转换为 WKT
+try:
+    import shapely
+    SHAPELY_AVAILABLE = True
+except ImportError:
+    SHAPELY_AVAILABLE = False
+
+try:
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+try:
+    from pyogrio.raw import open_arrow
+    PYOGRIO_AVAILABLE = True
+except ImportError:
+    PYOGRIO_AVAILABLE = False
+
+# 标准 GeoJSON FeatureCollection 需要 ijson 才能流式解析，否则整体读入
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+# 默认高度字段，依次查找
+DEFAULT_HEIGHT_FIELDS = ("building_height", "height")
+# 列式格式每批读取的行数
+DEFAULT_BATCH_SIZE = 10000
+
+# 扩展名（去掉 .gz 后）与格式的对应关系，未列出的按文本行格式处理
+_FORMAT_BY_EXTENSION = {
+    ".geojson": "geojson",
+    ".json": "geojson",
+    ".geojsonl": "geojsonseq",
+    ".geojsons": "geojsonseq",
+    ".geojsonseq": "geojsonseq",
+    ".ndjson": "geojsonseq",
+    ".fgb": "flatgeobuf",
+    ".parquet": "geoparquet",
+    ".geoparquet": "geoparquet",
+}
+
+
+class BuildingRecord(NamedTuple):
+    """
+    读取器产出的一条建筑物记录。
+    line_num: 文本格式为行号，其他格式为要素序号（从 1 开始）
+    wkt: MULTIPOLYGON 的 WKT；error 不为 None 时为 None
+    height: 建筑物高度，缺失时为 None
+    attributes: 几何和高度以外的属性
+    error: 解析失败的原因，解析成功为 None
+    raw: 原始内容（文本行或要素 JSON），用于写拒绝文件
+    """
+    line_num: int
+    wkt: Optional[str]
+    height: Optional[float]
+    attributes: Dict[str, Any]
+    error: Optional[str]
+    raw: str
+
+
+def parse_building_line(line):
+    """
+    解析一行建筑物数据，格式: MULTIPOLYGON(((...))),高度
+    返回 (wkt_geom, building_height)，格式错误时抛出 ValueError（异常信息即拒绝原因）。
+    """
+    parts = line.rsplit(',', 1)  # 从右边分割一次
+    if len(parts) != 2:
+        raise ValueError("格式错误")
+
+    # 移除可能存在的首尾双引号或单引号
+    wkt_geom = parts[0].strip().strip('"').strip("'")
+    height_str = parts[1].strip()
+
+    if not (wkt_geom.upper().startswith('MULTIPOLYGON') and wkt_geom.endswith('))')):
+        raise ValueError("WKT可能格式错误 (不以MULTIPOLYGON开头或不以))结尾)")
+
+    try:
+        building_height = float(height_str)
+    except ValueError:
+        raise ValueError(f"高度格式错误: {height_str}")
+
+    return wkt_geom, building_height
+
+
+def detect_format(file_path: str) -> str:
+    """
+    根据扩展名判断文件格式: text / geojson / geojsonseq / flatgeobuf / geoparquet
+    """
+    name = file_path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return _FORMAT_BY_EXTENSION.get(os.path.splitext(name)[1], "text")
+
+
+def _open_binary(file_path: str):
+    """以二进制方式打开文件，.gz 结尾的按 gzip 流式解压"""
+    if file_path.lower().endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+# --- 文本行格式 ---
+
+def read_text_lines(numbered_lines: Iterable[Tuple[int, str]]) -> Iterator[BuildingRecord]:
+    """
+    把 (行号, 行内容) 解析为记录，空行跳过。
+    """
+    for line_num, line in numbered_lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            wkt_geom, building_height = parse_building_line(line)
+        except ValueError as e:
+            yield BuildingRecord(line_num, None, None, {}, str(e), line)
+            continue
+        yield BuildingRecord(line_num, wkt_geom, building_height, {}, None, line)
+
+
+def _read_text_stream(stream, **_) -> Iterator[BuildingRecord]:
+    yield from read_text_lines(enumerate(io.TextIOWrapper(stream, encoding="utf-8"), 1))
+
+
+# --- GeoJSON ---
+
+def _ring_wkt(ring) -> str:
+    return "(" + ",".join(f"{point[0]} {point[1]}" for point in ring) + ")"
+
+
+def _polygon_wkt(polygon) -> str:
+    return "(" + ",".join(_ring_wkt(ring) for ring in polygon) + ")"
+
+
+def geojson_to_wkt(geometry) -> str:
+    """
+    把 GeoJSON 的 Polygon / MultiPolygon 转为 MULTIPOLYGON WKT（只取前两维坐标）。
+    其他几何类型抛出 ValueError。
+    """
+    if not geometry:
+        raise ValueError("缺少几何")
+    geometry_type = geometry.get("type")
+    coordinates = geometry.get("coordinates")
+    if geometry_type == "Polygon":
+        polygons = [coordinates]
+    elif geometry_type == "MultiPolygon":
+        polygons = coordinates
+    else:
+        raise ValueError(f"不支持的几何类型: {geometry_type}")
+    if not polygons:
+        raise ValueError("几何为空")
+    return "MULTIPOLYGON(" + ",".join(_polygon_wkt(polygon) for polygon in polygons) + ")"
+
+
+def _pop_height(attributes: Dict[str, Any], height_fields) -> Optional[float]:
+    """从属性中取出高度字段（第一个存在的），并从属性中移除"""
+    for field in height_fields:
+        if field in attributes:
+            value = attributes.pop(field)
+            return None if value is None else float(value)
+    return None
+
+
+def _feature_record(index: int, feature, height_fields) -> BuildingRecord:
+    attributes = dict(feature.get("properties") or {})
+    try:
+        wkt_geom = geojson_to_wkt(feature.get("geometry"))
+        building_height = _pop_height(attributes, height_fields)
+    except (ValueError, TypeError, IndexError) as e:
+        return BuildingRecord(index, None, None, attributes, str(e), json.dumps(feature, ensure_ascii=False))
+    return BuildingRecord(index, wkt_geom, building_height, attributes, None, json.dumps(feature, ensure_ascii=False))
+
+
+def _read_geojson_stream(stream, height_fields=DEFAULT_HEIGHT_FIELDS, **_) -> Iterator[BuildingRecord]:
+    if IJSON_AVAILABLE:
+        features = ijson.items(stream, "features.item", use_float=True)
+    else:
+        print("⚠️ 未安装 ijson，GeoJSON 将整体读入内存解析")
+        features = json.load(stream).get("features", [])
+    for index, feature in enumerate(features, 1):
+        yield _feature_record(index, feature, height_fields)
+
+
+def _read_geojsonseq_stream(stream, height_fields=DEFAULT_HEIGHT_FIELDS, **_) -> Iterator[BuildingRecord]:
+    """
+    每行一个 Feature 的 GeoJSON 序列（GeoJSONSeq / 换行分隔 GeoJSON），行首可带 RS 分隔符。
+    """
+    for line_num, line in enumerate(io.TextIOWrapper(stream, encoding="utf-8"), 1):
+        line = line.strip().lstrip("\x1e")
+        if not line:
+            continue
+        try:
+            feature = json.loads(line)
+        except ValueError as e:
+            yield BuildingRecord(line_num, None, None, {}, f"JSON 格式错误: {e}", line)
+            continue
+        yield _feature_record(line_num, feature, height_fields)
+
+
+# --- 列式格式（WKB 几何） ---
+
+def _wkb_to_wkt(wkb_values):
+    """
+    批量把 WKB 转为 MULTIPOLYGON WKT，返回 [(wkt, error), ...]
+    """
+    geoms = shapely.from_wkb(wkb_values, on_invalid="ignore")
+    results = []
+    for geom in geoms:
+        if geom is None or geom.is_empty:
+            results.append((None, "几何为空或无法解析"))
+            continue
+        geom = shapely.force_2d(geom)
+        if geom.geom_type == "Polygon":
+            geom = shapely.MultiPolygon([geom])
+        elif geom.geom_type != "MultiPolygon":
+            results.append((None, f"不支持的几何类型: {geom.geom_type}"))
+            continue
+        # rounding_precision=-1 保留完整精度（默认只保留 6 位小数）
+        results.append((shapely.to_wkt(geom, rounding_precision=-1), None))
+    return results
+
+
+def _batch_records(batch, geometry_column: str, height_fields, first_index: int) -> Iterator[BuildingRecord]:
+    """把一个 pyarrow RecordBatch 转为记录"""
+    columns = batch.to_pydict()
+    geometries = _wkb_to_wkt(columns.pop(geometry_column))
+    for offset, (wkt_geom, error) in enumerate(geometries):
+        attributes = {name: values[offset] for name, values in columns.items()}
+        index = first_index + offset
+        try:
+            building_height = _pop_height(attributes, height_fields)
+        except (ValueError, TypeError) as e:
+            wkt_geom, building_height, error = None, None, f"高度格式错误: {e}"
+        raw = json.dumps(attributes, ensure_ascii=False, default=str)
+        yield BuildingRecord(index, wkt_geom, building_height, attributes, error, raw)
+
+
+def _read_geoparquet(file_path: str, height_fields=DEFAULT_HEIGHT_FIELDS, batch_size=DEFAULT_BATCH_SIZE,
+                     **_) -> Iterator[BuildingRecord]:
+    """
+    按批读取 GeoParquet（每次最多 batch_size 行），几何列按 geo 元数据中的 primary_column 确定。
+    """
+    if not (PYARROW_AVAILABLE and SHAPELY_AVAILABLE):
+        raise ImportError("读取 GeoParquet 需要安装 pyarrow 和 shapely")
+
+    parquet_file = pq.ParquetFile(file_path)
+    metadata = parquet_file.schema_arrow.metadata or {}
+    if b"geo" not in metadata:
+        raise ValueError(f"{file_path} 不是 GeoParquet 文件（缺少 geo 元数据）")
+    geo = json.loads(metadata[b"geo"])
+    geometry_column = geo["primary_column"]
+    encoding = geo["columns"][geometry_column].get("encoding", "WKB")
+    if encoding.upper() != "WKB":
+        raise ValueError(f"不支持的 GeoParquet 几何编码: {encoding}")
+
+    index = 1
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield from _batch_records(batch, geometry_column, height_fields, index)
+        index += batch.num_rows
+
+
+def _read_flatgeobuf(file_path: str, height_fields=DEFAULT_HEIGHT_FIELDS, batch_size=DEFAULT_BATCH_SIZE,
+                     **_) -> Iterator[BuildingRecord]:
+    """
+    通过 pyogrio 的 Arrow 流按批读取 FlatGeobuf。
+    """
+    if not (PYOGRIO_AVAILABLE and SHAPELY_AVAILABLE):
+        raise ImportError("读取 FlatGeobuf 需要安装 pyogrio 和 shapely")
+
+    with open_arrow(file_path, batch_size=batch_size, use_pyarrow=True) as (meta, reader):
+        geometry_column = meta.get("geometry_name") or "wkb_geometry"
+        index = 1
+        for batch in reader:
+            yield from _batch_records(batch, geometry_column, height_fields, index)
+            index += batch.num_rows
+
+
+# 可以从顺序字节流读取的格式（支持 gzip 压缩）
+_STREAM_READERS = {
+    "text": _read_text_stream,
+    "geojson": _read_geojson_stream,
+    "geojsonseq": _read_geojsonseq_stream,
+}
+
+# 需要随机访问文件的列式格式
+_FILE_READERS = {
+    "flatgeobuf": _read_flatgeobuf,
+    "geoparquet": _read_geoparquet,
+}
+
+STREAM_FORMATS = tuple(_STREAM_READERS)
+
+
+def _read_stream_file(file_path: str, stream_reader, **kwargs) -> Iterator[BuildingRecord]:
+    with _open_binary(file_path) as stream:
+        yield from stream_reader(stream, **kwargs)
+
+
+def read_buildings(file_path: str, file_format: Optional[str] = None, height_fields=DEFAULT_HEIGHT_FIELDS,
+                   batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[BuildingRecord]:
+    """
+    流式读取建筑物文件，逐条产出 BuildingRecord，内存占用与文件大小无关。
+    file_format 为空时按扩展名判断；文本和 GeoJSON 格式支持 .gz 压缩。
+    文件不存在时抛出 FileNotFoundError，格式或依赖不满足时抛出 ValueError / ImportError。
+    """
+    file_format = file_format or detect_format(file_path)
+    if file_format not in _STREAM_READERS and file_format not in _FILE_READERS:
+        raise ValueError(f"不支持的文件格式: {file_format}")
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(file_path)
+    if file_format in _STREAM_READERS:
+        return _read_stream_file(file_path, _STREAM_READERS[file_format], height_fields=height_fields)
+    return _FILE_READERS[file_format](file_path, height_fields=height_fields, batch_size=batch_size)
+
+
+def count_records(file_path: str, file_format: Optional[str] = None) -> Optional[int]:
+    """
+    估算文件中的记录数，用于任务进度的总数：
+    未压缩的文本行格式统计换行数，GeoParquet / FlatGeobuf 读取元数据；其他情况返回 None（未知）。
+    """
+    file_format = file_format or detect_format(file_path)
+    try:
+        if file_format in ("text", "geojsonseq") and not file_path.lower().endswith(".gz"):
+            count = 0
+            last_byte = b"\n"
+            with open(file_path, "rb") as file:
+                for block in iter(lambda: file.read(1024 * 1024), b""):
+                    count += block.count(b"\n")
+                    last_byte = block[-1:]
+            # 最后一行没有换行符时也算一条
+            return count + (0 if last_byte == b"\n" else 1)
+        if file_format == "geoparquet" and PYARROW_AVAILABLE:
+            return pq.ParquetFile(file_path).metadata.num_rows
+        if file_format == "flatgeobuf" and PYOGRIO_AVAILABLE:
+            from pyogrio import read_info
+            return read_info(file_path)["features"]
+    except (OSError, ValueError, KeyError):
+        return None
+    return None
+
+
+def read_buildings_stream(stream, file_format: str = "text", gzipped: bool = False,
+                          height_fields=DEFAULT_HEIGHT_FIELDS) -> Iterator[BuildingRecord]:
+    """
+    从顺序读取的二进制流（例如上传的请求体）读取建筑物记录，只支持 STREAM_FORMATS 中的格式。
+    gzipped=True 时边读边解压。
+    """
+    reader = _STREAM_READERS.get(file_format)
+    if reader is None:
+        raise ValueError(f"格式 {file_format} 不支持流式读取，支持: {', '.join(STREAM_FORMATS)}")
+    if gzipped:
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    return reader(stream, height_fields=height_fields)
+
+
+class ChunkPipe:
+    """
+    生产者线程/协程写入 bytes 块、消费者以只读二进制流读取的有界管道。
+    队列满时 feed 阻塞（反压），因此内存占用只与队列长度有关，与数据总量无关。
+    消费者结束（正常或出错）后调用 close，之后 feed 不再阻塞并返回 False。
+    """
+
+    def __init__(self, max_chunks: int = 16):
+        self._chunks = queue.Queue(maxsize=max_chunks)
+        self._closed = threading.Event()
+        self.stream = io.BufferedReader(_ChunkPipeStream(self._chunks))
+
+    def try_feed(self, chunk) -> bool:
+        """不阻塞地写入一块，队列已满时返回 False"""
+        try:
+            self._chunks.put_nowait(chunk)
+            return True
+        except queue.Full:
+            return False
+
+    def feed(self, chunk) -> bool:
+        """写入一块（None 表示结束，异常对象表示生产者出错），消费者已关闭时返回 False"""
+        while not self._closed.is_set():
+            try:
+                self._chunks.put(chunk, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self):
+        self._closed.set()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+
+class _ChunkPipeStream(io.RawIOBase):
+    """ChunkPipe 的读取端，读到 None 视为 EOF，读到异常对象则抛出"""
+
+    def __init__(self, chunks: queue.Queue):
+        self._chunks = chunks
+        self._buffer = b""
+        self._offset = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._offset >= len(self._buffer):
+            if self._eof:
+                return 0
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+                return 0
+            if isinstance(chunk, BaseException):
+                raise chunk
+            self._buffer, self._offset = chunk, 0
+
+        n = min(len(b), len(self._buffer) - self._offset)
+        b[:n] = self._buffer[self._offset:self._offset + n]
+        self._offset += n
+        return n
@@ -1,61 +1,121 @@
+import multiprocessing
+import os
 import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
 import psycopg2
 import requests
 import hashlib
 import geohash2  # 需要安装: pip install geohash2
 import json  # 用于处理 WKT 解析可能需要的辅助
+import re
 
-# 尝试导入 shapely 来计算中心点，如果失败则回退到简单方法
-try:
-    from shapely.geometry import shape, mapping
-    from shapely import wkt
-    SHAPELY_AVAILABLE = True
-except ImportError:
-    SHAPELY_AVAILABLE = False
-    print("警告: 未安装 Shapely 库。将使用简化的 GeoHash 中心点计算方法。")
-    # 可以考虑在此处导入 regex 或其他库来更安全地解析 WKT，但为了简单起见，我们使用基本的字符串操作。
-
-def calculate_centroid_simple(wkt_geom):
-    """使用简单的字符串解析方法计算 WKT 多边形的近似中心点"""
-    # 这是一个非常简化的实现，假设是 MULTIPOLYGON(((...))) 或 POLYGON((...))
-    # 并且只取第一个环的第一个点作为参考来估算中心
-    # 更精确的方法需要使用 GIS 库如 Shapely
-    try:
-        # 移除 MULTIPOLYGON 和括号，获取坐标部分
-        # 例如: "MULTIPOLYGON(((1 2, 3 4, 5 6, 1 2)))" -> "1 2, 3 4, 5 6, 1 2"
-        import re
-        # 匹配最内层的括号内容 (假设只有一个主多边形)
-        match = re.search(r'\(\(([^)]+)\)\)', wkt_geom)
-        if not match:
-             # 尝试匹配 POLYGON
-             match = re.search(r'\(([^)]+)\)', wkt_geom.split('POLYGON', 1)[-1])
-        if not match:
-            raise ValueError("无法从 WKT 提取坐标")
-
-        coords_str = match.group(1)
-        coords = []
-        for pair in coords_str.split(','):
-            lon_str, lat_str = pair.strip().split()
-            coords.append((float(lon_str), float(lat_str)))
-
-        if not coords:
-            raise ValueError("未找到坐标")
-
-        # 计算所有坐标的平均值作为近似中心点
-        # 注意：这在跨经度180度或极地附近可能不准确，但对于一般情况足够
-        avg_lon = sum(c[0] for c in coords) / len(coords)
-        avg_lat = sum(c[1] for c in coords) / len(coords)
-        return avg_lon, avg_lat
-    except Exception as e:
-        print(f"计算中心点时出错 (简化方法): {e}")
-        # 回退：使用第一个坐标点
+import numpy as np
+
+from database.database_conn import init_connection_pool, get_db_connection
+from service.building_events import notify_buildings_changed
+from service.building_reader import count_records, detect_format, parse_building_line, read_buildings, \
+    read_buildings_stream, read_text_lines
+from utils.geo_utils import wkt_bounds, merge_bounds, geohash_encode_array
+
+# 拆分 MULTIPOLYGON 中的多边形 / 环
+_POLYGON_SPLIT = re.compile(r'\)\s*\)\s*,\s*\(\s*\(')
+_RING_SPLIT = re.compile(r'\)\s*,\s*\(')
+
+
+def _parse_polygon_rings(wkt_geom):
+    """
+    把 POLYGON / MULTIPOLYGON 的 WKT 拆成 [(坐标数组, 是否外环), ...]
+    """
+    body = wkt_geom[wkt_geom.index('('):].strip()
+    body = body.lstrip('( ').rstrip(') ')
+    rings = []
+    for polygon_text in _POLYGON_SPLIT.split(body):
+        for ring_index, ring_text in enumerate(_RING_SPLIT.split(polygon_text)):
+            coords = np.array(ring_text.strip('() ').replace(',', ' ').split(), dtype=float).reshape(-1, 2)
+            rings.append((coords, ring_index == 0))
+    return rings
+
+
+def _calculate_centroids_numpy(wkt_geoms):
+    """
+    批量面积加权中心点（鞋带公式），内环（洞）面积按负值计入。
+    先把所有环的坐标拼接成一个数组，再用 numpy 按环归约，避免逐点的 Python 循环。
+    """
+    n = len(wkt_geoms)
+    lons = np.full(n, np.nan)
+    lats = np.full(n, np.nan)
+
+    ring_coords, ring_geom, ring_is_shell, ring_lengths = [], [], [], []
+    references = np.zeros((n, 2))
+    for geom_index, wkt_geom in enumerate(wkt_geoms):
         try:
-             match = re.search(r'(-?\d+\.?\d*)\s+(-?\d+\.?\d*)', wkt_geom)
-             if match:
-                 return float(match.group(1)), float(match.group(2))
-        except:
-             pass
-        raise ValueError(f"无法计算 WKT 的中心点: {wkt_geom}")
+            rings = _parse_polygon_rings(wkt_geom)
+        except (ValueError, IndexError) as e:
+            print(f"计算中心点时出错 (numpy 方法): {e}")
+            continue
+        rings = [(coords, is_shell) for coords, is_shell in rings if len(coords) > 0]
+        if not rings:
+            continue
+        # 以第一个坐标为参考点平移，避免经纬度大数相乘造成精度损失
+        references[geom_index] = rings[0][0][0]
+        for coords, is_shell in rings:
+            ring_coords.append(coords)
+            ring_geom.append(geom_index)
+            ring_is_shell.append(is_shell)
+            ring_lengths.append(len(coords))
+
+    if not ring_coords:
+        return lons, lats
+
+    ring_geom = np.array(ring_geom)
+    ring_lengths = np.array(ring_lengths)
+    starts = np.concatenate(([0], np.cumsum(ring_lengths)[:-1]))
+
+    coords = np.concatenate(ring_coords) - np.repeat(references[ring_geom], ring_lengths, axis=0)
+    x, y = coords[:, 0], coords[:, 1]
+
+    # 每个环内的下一个顶点（环尾接回环首）
+    next_index = np.arange(len(x)) + 1
+    next_index[starts + ring_lengths - 1] = starts
+    x_next, y_next = x[next_index], y[next_index]
+
+    cross = x * y_next - x_next * y
+    ring_area = np.add.reduceat(cross, starts) / 2
+    ring_moment_x = np.add.reduceat((x + x_next) * cross, starts) / 6
+    ring_moment_y = np.add.reduceat((y + y_next) * cross, starts) / 6
+
+    # 外环面积取正、内环取负，与环的方向无关
+    weight = np.sign(ring_area) * np.where(ring_is_shell, 1.0, -1.0)
+    area = np.bincount(ring_geom, weights=weight * ring_area, minlength=n)
+    moment_x = np.bincount(ring_geom, weights=weight * ring_moment_x, minlength=n)
+    moment_y = np.bincount(ring_geom, weights=weight * ring_moment_y, minlength=n)
+
+    # 面积为 0 的退化几何，回退到顶点平均值
+    vertex_count = np.bincount(ring_geom, weights=ring_lengths, minlength=n)
+    vertex_sum_x = np.bincount(np.repeat(ring_geom, ring_lengths), weights=x, minlength=n)
+    vertex_sum_y = np.bincount(np.repeat(ring_geom, ring_lengths), weights=y, minlength=n)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        degenerate = area == 0
+        cx = np.where(degenerate, vertex_sum_x / vertex_count, moment_x / area)
+        cy = np.where(degenerate, vertex_sum_y / vertex_count, moment_y / area)
+
+    parsed = vertex_count > 0
+    lons[parsed] = cx[parsed] + references[parsed, 0]
+    lats[parsed] = cy[parsed] + references[parsed, 1]
+    return lons, lats
+
+
+def calculate_centroids(wkt_geoms):
+    """
+    批量计算 WKT 多边形的面积加权中心点，返回 (经度数组, 纬度数组)。
+    无法解析的几何对应位置为 NaN。
+    使用 numpy 鞋带公式，结果与 Shapely 的 centroid 一致，且比逐个 wkt.loads 更快。
+    """
+    return _calculate_centroids_numpy(list(wkt_geoms))
+
 
 def generate_osm_id_pure_code(wkt_geom, precision=12):
     """
@@ -63,17 +123,10 @@ def generate_osm_id_pure_code(wkt_geom, precision=12):
     """
     try:
         # 1. 计算几何的中心点 (需要解析 WKT)
-        if SHAPELY_AVAILABLE:
-            try:
-                # 尝试使用 Shapely 解析 WKT 并获取精确中心点
-                geom_obj = wkt.loads(wkt_geom)
-                centroid = geom_obj.centroid
-                lon, lat = centroid.x, centroid.y
-            except Exception as e:
-                print(f"Shapely 解析 WKT 失败: {e}, 回退到简化方法。")
-                lon, lat = calculate_centroid_simple(wkt_geom)
-        else:
-            lon, lat = calculate_centroid_simple(wkt_geom)
+        lons, lats = calculate_centroids([wkt_geom])
+        lon, lat = float(lons[0]), float(lats[0])
+        if np.isnan(lon) or np.isnan(lat):
+            raise ValueError(f"无法计算 WKT 的中心点: {wkt_geom}")
 
         # 2. 使用中心点计算 GeoHash
         geohash_str = geohash2.encode(lat, lon, precision=10) # 10-12位通常足够区分
@@ -103,115 +156,247 @@ def generate_osm_id_pure_code(wkt_geom, precision=12):
         raise # 重新抛出异常，让上层处理
 
 
-# ... (update_all_buildings_info_batch 和 process_building_batch 函数保持不变) ...
+# 批量导入时每次批量生成 osm_id 的行数
+OSM_ID_CHUNK_SIZE = 5000
+# osm_id 的取值范围 (0 到 999,999,999,999)
+OSM_ID_MODULUS = 10**12
+# 计算 osm_id 时 geohash 的精度
+OSM_ID_GEOHASH_PRECISION = 10
+# 输入数据中自带 osm_id 的属性名
+OSM_ID_FIELD = "osm_id"
+
 
+def _osm_id_from_key(key):
+    """对 geohash（或加盐后的 geohash）做 SHA256，取模得到 12 位整数"""
+    return int(hashlib.sha256(key.encode('utf-8')).hexdigest(), 16) % OSM_ID_MODULUS
 
-def insert_buildings_from_file(conn, file_path='buildings_output.txt'):
+
+def _existing_osm_id_geohashes(conn, osm_ids):
     """
-    从文件中读取建筑物数据并插入到数据库
-    文件格式: MULTIPOLYGON(((...)),高度
+    查询表中已存在的 osm_id 及其建筑物中心点的 geohash，返回 {osm_id: geohash}
     """
+    if not osm_ids:
+        return {}
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute("""
+            SELECT osm_id, ST_GeoHash(ST_Centroid(geom), %s)
+            FROM hz_yuhang_buildings
+            WHERE osm_id = ANY(%s)
+        """, (OSM_ID_GEOHASH_PRECISION, list(osm_ids)))
+        return dict(cur.fetchall())
+
+
+def centroid_geohashes(wkt_geoms):
+    """批量计算建筑物中心点的 geohash（精度 OSM_ID_GEOHASH_PRECISION），无法计算中心点的位置为 None"""
+    lons, lats = calculate_centroids(wkt_geoms)
+    valid = ~(np.isnan(lons) | np.isnan(lats))
+    geohashes = [None] * len(wkt_geoms)
+    for i, geohash_str in zip(np.flatnonzero(valid), geohash_encode_array(lats[valid], lons[valid],
+                                                                            OSM_ID_GEOHASH_PRECISION)):
+        geohashes[i] = geohash_str
+    return geohashes
+
+
+def source_osm_id(attributes):
+    """
+    记录属性中自带的 osm_id（GeoJSON / GeoParquet / FlatGeobuf 的 osm_id 字段），没有或无效时返回 None。
+    自带 id 的建筑物按该 id 匹配表中已有的行，中心点移动到其他网格后仍是同一栋建筑物。
+    """
+    value = attributes.get(OSM_ID_FIELD)
+    if value is None or isinstance(value, bool):
+        return None
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
+        osm_id = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if osm_id != value and str(osm_id) != str(value).strip():
+        # 非整数（如 12.5）不作为 id
+        return None
+    return osm_id if 0 <= osm_id < 2**63 else None
 
-        print(f"读取到 {len(lines)} 行数据")
+
+def _resolve_osm_id(candidate, geohash_str, conn, assigned, existing):
+    """
+    从 candidate 开始依次加盐，直到找到未被占用的 osm_id，登记到 assigned 后返回。
+    被占用指：已分配给本次导入的其他建筑物，或表中已存在且中心点 geohash 不同。
+    existing 为已查询过的 {osm_id: geohash} 缓存（conn 为 None 时不查表）。
+    """
+    salt = 0
+    while True:
+        taken = candidate in assigned
+        if not taken and conn is not None:
+            if candidate not in existing:
+                existing.update(_existing_osm_id_geohashes(conn, [candidate]))
+            owner = existing.get(candidate)
+            taken = owner is not None and owner != geohash_str
+        if not taken:
+            assigned[candidate] = geohash_str
+            return candidate
+        salt += 1
+        candidate = _osm_id_from_key(f"{geohash_str}#{salt}")
+
+
+def generate_osm_ids(wkt_geoms, conn=None, assigned=None):
+    """
+    批量生成 osm_id，与 generate_osm_id_pure_code 的算法一致（中心点 geohash -> SHA256 -> 取模），
+    但中心点和 geohash 按数组批量计算，并检测重复：
+    - 同一批内两栋建筑物 osm_id 相同（同一 geohash 网格或哈希碰撞）
+    - 与表中已有 osm_id 相同但中心点 geohash 不同（不是同一栋建筑物）
+    冲突时按 (geohash, WKT 摘要) 排序，排在前面的保留原 id，其余依次对 geohash 加盐 (#1, #2, ...) 重新计算，
+    结果与输入顺序无关、可重复。表中 geohash 相同的已有 id 视为同一建筑物的重复导入，不算冲突。
+
+    conn 不为 None 时检查表中已有的 osm_id；assigned 为跨批次共享的 {osm_id: geohash}，用于分块调用时去重。
+    返回 (osm_id 列表, geohash 列表)，无法计算中心点的位置为 None。
+    """
+    assigned = {} if assigned is None else assigned
+    osm_ids = [None] * len(wkt_geoms)
+
+    geohashes = centroid_geohashes(wkt_geoms)
+    valid_indices = [i for i, geohash_str in enumerate(geohashes) if geohash_str is not None]
+
+    base_ids = {i: _osm_id_from_key(geohashes[i]) for i in valid_indices}
+    existing = _existing_osm_id_geohashes(conn, set(base_ids.values())) if conn is not None else {}
+
+    batch_conflicts = 0
+    table_conflicts = 0
+
+    def wkt_digest(i):
+        return hashlib.sha256(wkt_geoms[i].encode('utf-8')).digest()
+
+    # 按 osm_id 分组；同组多栋建筑物时按 WKT 摘要排序，排第一的保留原 id
+    groups = {}
+    for i in valid_indices:
+        groups.setdefault(base_ids[i], []).append(i)
+    keepers, others = [], []
+    for members in groups.values():
+        if len(members) > 1:
+            members = sorted(members, key=lambda i: (wkt_digest(i), i))
+            batch_conflicts += len(members) - 1
+        keepers.append(members[0])
+        others.extend(members[1:])
+
+    # 确定性的处理顺序：先处理保留原 id 的建筑物，再按 (geohash, WKT 摘要) 为其余建筑物加盐
+    others.sort(key=lambda i: (geohashes[i], wkt_digest(i), i))
+    for i in keepers + others:
+        candidate = _resolve_osm_id(base_ids[i], geohashes[i], conn, assigned, existing)
+        if candidate != base_ids[i] and base_ids[i] not in assigned:
+            table_conflicts += 1
+        osm_ids[i] = candidate
+
+    if batch_conflicts or table_conflicts:
+        print(f"osm_id 冲突已重新分配: 批内 {batch_conflicts} 个, 与表中已有 {table_conflicts} 个")
+
+    return osm_ids, geohashes
+
+
+def _chunked(records, size):
+    """把记录迭代器按 size 条分块"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert_buildings_from_file(conn, file_path='buildings_output.txt', file_format=None, progress=None):
+    """
+    从文件中读取建筑物数据并插入到数据库
+    文件格式: MULTIPOLYGON(((...)),高度；也支持 gzip、GeoJSON、FlatGeobuf、GeoParquet（见 building_reader）
+    progress(done, total) 为进度回调（例如后台任务的 Job.report），total 未知时为 None。
+    """
+    try:
+        records = read_buildings(file_path, file_format)
+        total = count_records(file_path, file_format) if progress else None
 
         cur = conn.cursor()
+        _set_simplify_tolerance(cur)
         success_count = 0
         error_count = 0
+        total_count = 0
+        # 本次导入涉及的区域，用于通知碰撞结果缓存失效
+        changed_bounds = None
+        # 本次导入已分配的 {osm_id: geohash}，跨分块去重
+        assigned = {}
 
-        for line_num, line in enumerate(lines, 1):
-            line = line.strip()
-            if not line:
-                continue
+        for chunk in _chunked(records, OSM_ID_CHUNK_SIZE):
+            total_count += len(chunk)
 
-            try:
-                # 解析行数据
-                # 格式: MULTIPOLYGON(((...)),13.56
-                parts = line.rsplit(',', 1)  # 从右边分割一次
-                if len(parts) != 2:
-                    print(f"✗ 第{line_num}行格式错误: {line}")
+            # 按块批量生成 osm_id（向量化计算中心点，并检查与表中已有 id 的冲突）
+            valid_records = [record for record in chunk if record.error is None]
+            osm_ids, _ = generate_osm_ids([record.wkt for record in valid_records], conn=conn, assigned=assigned)
+            osm_id_by_line = {record.line_num: osm_id for record, osm_id in zip(valid_records, osm_ids)}
+
+            for record in chunk:
+                line_num = record.line_num
+                if record.error is not None:
+                    print(f"✗ 第{line_num}行{record.error}: {record.raw}")
                     error_count += 1
                     continue
 
-                wkt_geom_raw = parts[0].strip()
-                height_str = parts[1].strip()
+                wkt_geom = record.wkt
+                building_height = record.height
+                osm_id = osm_id_by_line.get(line_num)
+                if osm_id is None:
+                    print(f"✗ 第{line_num}行生成 osm_id 失败: 无法计算中心点 - WKT: {wkt_geom}")
+                    error_count += 1
+                    continue
+
+                try:
+                    # 插入数据库，osm_id 的值来自 Python 计算
+                    insert_query = """
+                        INSERT INTO hz_yuhang_buildings (geom, building_height, osm_id)
+                        VALUES (
+                            ST_GeomFromText(%s, 4326),
+                            %s,
+                            %s -- 直接使用 Python 计算好的 osm_id
+                        )
+                    """
+
+                    cur.execute(insert_query, (wkt_geom, building_height, osm_id))
+                    if cur.rowcount == 0:
+                        # 几何修复后为空，被触发器丢弃（见 sql/add_geometry_validation.sql）
+                        print(f"✗ 第{line_num}行几何修复后为空，已跳过 - WKT: {wkt_geom}")
+                        error_count += 1
+                        continue
+                    print(f"✓ 第{line_num}行插入成功: 高度={building_height}米, osm_id={osm_id}")
+                    success_count += 1
+                    changed_bounds = merge_bounds(changed_bounds, wkt_bounds(wkt_geom))
 
-                # --- 处理潜在的引号问题 ---
-                # 移除可能存在的首尾双引号或单引号
-                wkt_geom = wkt_geom_raw.strip().strip('"').strip("'")
-                # --- 处理结束 ---
+                    # 每100条提交一次，避免事务过大
+                    if (success_count + error_count) % 100 == 0:
+                        try:
+                            conn.commit()
+                            print(f"已提交 {success_count + error_count} 条记录")
+                        except psycopg2.Error as commit_error:
+                             print(f"✗ 提交 {success_count + error_count} 条记录时出错: {commit_error}")
+                             conn.rollback()
+                             # 回滚会撤销事务中的 set_config，重新设置简化容差
+                             _set_simplify_tolerance(cur)
+                             # 粗略估计失败数量，实际可能不同，这里简单处理
+                             error_in_batch = 100 - (success_count % 100) if success_count % 100 != 0 else 0
+                             error_count += error_in_batch
+                             success_count -= (100 - error_in_batch)
 
-                # --- 放宽或修改 WKT 格式验证 ---
-                # 更宽松的检查（或者完全移除，让 PostGIS 报错）
-                if not (wkt_geom.upper().startswith('MULTIPOLYGON') and wkt_geom.endswith('))')):
-                     print(f"✗ 第{line_num}行WKT可能格式错误 (不以MULTIPOLYGON开头或不以))结尾): {wkt_geom}")
+                except psycopg2.Error as db_error: # 捕获数据库特定错误
+                     print(f"✗ 第{line_num}行数据库插入错误: {db_error}")
+                     # 打印出 WKT 可能有助于调试
+                     print(f"    WKT: {wkt_geom}, osm_id: {osm_id}")
                      error_count += 1
+                     conn.rollback() # 回滚当前事务
+                     _set_simplify_tolerance(cur)
                      continue
-                # --- 修改结束 ---
-
-                # 验证高度
-                try:
-                    building_height = float(height_str)
-                except ValueError:
-                    print(f"✗ 第{line_num}行高度格式错误: {height_str}")
+                except Exception as e: # 捕获其他未预期的 Python 错误
+                    print(f"✗ 第{line_num}行处理错误: {str(e)}")
                     error_count += 1
                     continue
 
-                # --- 关键修改：在 Python 中生成 osm_id ---
-                try:
-                    osm_id = generate_osm_id_pure_code(wkt_geom)
-                    print(f"  -> 为 WKT 生成的 osm_id: {osm_id}") # 可选：调试输出
-                except Exception as gen_id_error:
-                    print(f"✗ 第{line_num}行生成 osm_id 失败: {gen_id_error} - WKT: {wkt_geom}")
-                    error_count += 1
-                    continue # 跳过这一行
-                # --- 修改结束 ---
-
-
-                # 插入数据库
-                # 修改 INSERT 语句，包含 osm_id，其值来自 Python 计算
-                insert_query = """
-                    INSERT INTO hz_yuhang_buildings (geom, building_height, osm_id)
-                    VALUES (
-                        ST_GeomFromText(%s, 4326),
-                        %s,
-                        %s -- 直接使用 Python 计算好的 osm_id
-                    )
-                """
-
-                # 执行插入，传入 wkt_geom, building_height, osm_id
-                cur.execute(insert_query, (wkt_geom, building_height, osm_id)) # 注意参数顺序
-                print(f"✓ 第{line_num}行插入成功: 高度={building_height}米, osm_id={osm_id}")
-                success_count += 1
-
-                # 每100条提交一次，避免事务过大
-                if (success_count + error_count) % 100 == 0:
-                    try:
-                        conn.commit()
-                        print(f"已提交 {success_count + error_count} 条记录")
-                    except psycopg2.Error as commit_error:
-                         print(f"✗ 提交 {success_count + error_count} 条记录时出错: {commit_error}")
-                         conn.rollback()
-                         # 粗略估计失败数量，实际可能不同，这里简单处理
-                         error_in_batch = 100 - (success_count % 100) if success_count % 100 != 0 else 0
-                         error_count += error_in_batch
-                         success_count -= (100 - error_in_batch)
-
-
-            except psycopg2.Error as db_error: # 捕获数据库特定错误
-                 print(f"✗ 第{line_num}行数据库插入错误: {db_error}")
-                 # 打印出 WKT 可能有助于调试
-                 print(f"    WKT: {wkt_geom}, osm_id: {osm_id}")
-                 error_count += 1
-                 conn.rollback() # 回滚当前事务
-                 continue
-            except Exception as e: # 捕获其他未预期的 Python 错误
-                print(f"✗ 第{line_num}行处理错误: {str(e)}")
-                error_count += 1
-                # 不回滚整个事务，继续处理下一行
-                continue # 这个 continue 在循环末尾是多余的，但显式写出更清晰
+            if progress:
+                progress(total_count, total)
+
+        print(f"读取到 {total_count} 条数据")
 
         # 提交剩余的更改
         try:
@@ -222,24 +407,22 @@ def insert_buildings_from_file(conn, file_path='buildings_output.txt'):
         except psycopg2.Error as commit_error:
              print(f"✗ 提交剩余记录时出错: {commit_error}")
              conn.rollback()
-             # 可能需要更精确地更新 error_count，这里简化处理
-             # 假设剩余未提交的都失败了（这可能不准确）
-             # remaining = (success_count + error_count) % 100
-             # error_count += remaining
-             # success_count -= remaining
 
         cur.close()
 
+        if success_count > 0:
+            notify_buildings_changed(changed_bounds)
+
         print(f"\n文件数据插入完成!")
         print(f"成功插入: {success_count}")
         print(f"处理失败: {error_count}")
-        print(f"总体成功率: {success_count / len(lines) * 100:.1f}%" if lines and len(lines) > 0 else "0%")
+        print(f"总体成功率: {success_count / total_count * 100:.1f}%" if total_count > 0 else "0%")
 
         return {
             "success_count": success_count,
             "error_count": error_count,
-            "total_count": len(lines),
-            "success_rate": success_count / len(lines) * 100 if lines and len(lines) > 0 else 0
+            "total_count": total_count,
+            "success_rate": success_count / total_count * 100 if total_count > 0 else 0
         }
 
     except FileNotFoundError:
@@ -255,6 +438,839 @@ def insert_buildings_from_file(conn, file_path='buildings_output.txt'):
             pass
         return None
 
+# --- COPY 批量导入 ---
+
+# 批量导入使用的 UNLOGGED 暂存表（不写 WAL，COPY 更快）的名称前缀，每次导入加随机后缀，导入结束后删除
+STAGING_TABLE = "hz_yuhang_buildings_staging"
+# 碰撞检测几何的简化容差（米），0 表示不简化。通过会话参数 buildings.simplify_tolerance 传给触发器，
+# 简化结果总是原轮廓的外扩超集（见 sql/add_geometry_simplification.sql）
+SIMPLIFY_TOLERANCE = float(os.getenv("BUILDING_SIMPLIFY_TOLERANCE", "0.5"))
+# WKT 中的数值，统一格式化后再计算哈希（30.2757720 与 30.275772 视为相同）
+_WKT_NUMBER_PATTERN = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?')
+
+
+def _copy_escape(value):
+    """转义 COPY text 格式中的特殊字符，None 写为 NULL"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _IteratorFile:
+    """
+    把逐行产生的字符串包装成只读文件对象，供 cursor.copy_expert 流式读取，
+    不需要先把整个文件读入内存。
+    """
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._iterator)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _unique_staging_table():
+    """生成本次导入专用的暂存表名，多个导入（后台任务、多个 Web 进程）同时进行时互不影响"""
+    return f"{STAGING_TABLE}_{uuid.uuid4().hex[:12]}"
+
+
+def _drop_staging_table(conn, staging_table):
+    """删除暂存表（导入结束或出错后调用），失败只记录，不影响导入结果"""
+    try:
+        # 出错时事务可能已中止（其中新建的暂存表随回滚一起消失）；正常结束时已提交，回滚无影响
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {staging_table}")
+        conn.commit()
+    except psycopg2.Error as drop_error:
+        print(f"✗ 删除暂存表 {staging_table} 失败: {drop_error}")
+        conn.rollback()
+
+
+def _set_simplify_tolerance(cur):
+    """
+    设置当前连接写入建筑物时使用的简化容差。
+    set_config 的会话级设置随事务回滚而撤销，回滚后需要重新调用。
+    """
+    cur.execute("SELECT set_config('buildings.simplify_tolerance', %s, false)", (str(SIMPLIFY_TOLERANCE),))
+
+
+def content_hash(wkt_geom, building_height):
+    """
+    计算一行建筑物数据 (几何, 高度) 的内容哈希，用于增量导入判断数据是否变化。
+    WKT 拆成结构（去掉数值和空白）与坐标数值两部分分别参与哈希，空白和数值写法不影响结果（与来源文件格式无关），
+    高度按表字段精度 (numeric(10,2)) 格式化。
+    """
+    structure = ''.join(_WKT_NUMBER_PATTERN.sub('#', wkt_geom).split()).upper()
+    coords = np.array(_WKT_NUMBER_PATTERN.findall(wkt_geom), dtype=float)
+    height_text = '' if building_height is None else f"{building_height:.2f}"
+
+    digest = hashlib.sha256(f"{structure}|{height_text}|".encode('utf-8'))
+    digest.update(coords.tobytes())
+    return digest.hexdigest()
+
+
+def _make_reject(reject_file, stats):
+    """返回把一行写入拒绝文件并计入 stats["error_count"] 的函数"""
+    def reject(line_num, reason, line):
+        stats["error_count"] += 1
+        reject_file.write(f"{line_num}\t{reason}\t{line}\n")
+    return reject
+
+
+def _copy_to_staging(cur, records, staging_table, reject, stats, progress=None):
+    """
+    新建暂存表，把解析成功的记录（含 osm_id、中心点 geohash、内容哈希）COPY 进去，并按 osm_id 建索引。
+    记录属性中自带 osm_id 的直接使用（source_id 为 true），其余按中心点网格生成；
+    解析失败、无法计算中心点的记录写入拒绝文件。
+    osm_id 只在每块记录内去重（内存占用与导入的记录数无关），跨块的重复由 _dedup_staged 在暂存表中处理。
+    """
+
+    def copy_chunk(chunk):
+        given = [entry for entry in chunk if entry[4] is not None]
+        generated = [entry for entry in chunk if entry[4] is None]
+        rows = []
+        # 本块已分配的 {osm_id: geohash}：先登记自带的 id，本块生成的 id 避开它们
+        assigned = {}
+
+        for (line_num, wkt_geom, building_height, line, osm_id), geohash_str in zip(
+                given, centroid_geohashes([entry[1] for entry in given])):
+            if geohash_str is None:
+                reject(line_num, "无法计算中心点", line)
+            elif osm_id in assigned:
+                reject(line_num, f"osm_id {osm_id} 重复", line)
+            else:
+                assigned[osm_id] = geohash_str
+                rows.append((line_num, wkt_geom, building_height, osm_id, geohash_str, True))
+
+        # osm_id 按块批量生成；与表中已有 id 的冲突在 COPY 完成后统一处理
+        osm_ids, geohashes = generate_osm_ids([entry[1] for entry in generated], assigned=assigned)
+        for (line_num, wkt_geom, building_height, line, _), osm_id, geohash_str in zip(generated, osm_ids, geohashes):
+            if osm_id is None:
+                reject(line_num, "无法计算中心点", line)
+                continue
+            rows.append((line_num, wkt_geom, building_height, osm_id, geohash_str, False))
+
+        for line_num, wkt_geom, building_height, osm_id, geohash_str, source_id in rows:
+            row = (line_num, wkt_geom, building_height, osm_id, geohash_str,
+                   content_hash(wkt_geom, building_height), "t" if source_id else "f")
+            yield "\t".join(_copy_escape(v) for v in row) + "\n"
+
+    def copy_rows():
+        chunk = []
+        for record in records:
+            stats["total_count"] += 1
+            if record.error is not None:
+                reject(record.line_num, record.error, record.raw)
+                continue
+
+            chunk.append((record.line_num, record.wkt, record.height, record.raw, source_osm_id(record.attributes)))
+            if len(chunk) >= OSM_ID_CHUNK_SIZE:
+                yield from copy_chunk(chunk)
+                chunk = []
+                if progress:
+                    progress(stats["total_count"])
+        yield from copy_chunk(chunk)
+        if progress:
+            progress(stats["total_count"])
+
+    start_time = time.time()
+
+    # 暂存表每次新建，结构变化时无需迁移
+    cur.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    cur.execute(f"""
+        CREATE UNLOGGED TABLE {staging_table} (
+            line_num integer,
+            wkt text,
+            building_height numeric(10,2),
+            osm_id bigint,
+            geohash text,
+            content_hash text,
+            source_id boolean NOT NULL DEFAULT false,
+            unchanged boolean NOT NULL DEFAULT false
+        )
+    """)
+
+    cur.copy_expert(f"COPY {staging_table} (line_num, wkt, building_height, osm_id, geohash, content_hash, source_id) "
+                    f"FROM STDIN", _IteratorFile(copy_rows()))
+    # 跨块去重和与表中已有 id 的冲突按 osm_id 查找暂存表
+    cur.execute(f"CREATE INDEX ON {staging_table} (osm_id)")
+    print(f"COPY 到暂存表 {staging_table} 完成, 耗时 {time.time() - start_time:.2f} 秒")
+
+
+def _resolve_table_conflicts(conn, cur, staging_table, assigned):
+    """
+    与表中已有 osm_id 冲突（中心点 geohash 不同，不是同一栋建筑物）的生成 id 重新分配。
+    数据自带的 osm_id 不参与：中心点不同说明建筑物被修改或移动，按同一栋建筑物更新。
+    """
+    cur.execute(f"""
+        SELECT s.line_num, s.osm_id, s.geohash
+        FROM {staging_table} s
+        JOIN hz_yuhang_buildings b ON b.osm_id = s.osm_id
+        WHERE NOT s.source_id AND ST_GeoHash(ST_Centroid(b.geom), %s) IS DISTINCT FROM s.geohash
+    """, (OSM_ID_GEOHASH_PRECISION,))
+    conflicts = cur.fetchall()
+    if conflicts:
+        existing = {}
+        for line_num, osm_id, geohash_str in conflicts:
+            del assigned[osm_id]
+            new_osm_id = _resolve_osm_id(osm_id, geohash_str, conn, assigned, existing)
+            cur.execute(f"UPDATE {staging_table} SET osm_id = %s WHERE line_num = %s", (new_osm_id, line_num))
+        print(f"osm_id 与表中已有建筑物冲突，已重新分配: {len(conflicts)} 个")
+
+
+def _write_from_staging(conn, cur, staging_table, reject, stats, upsert=False, delete_missing=False):
+    """
+    把暂存表写入 hz_yuhang_buildings 并提交，返回 _bulk_load_records 的统计。
+    入库失败以及几何修复后为空（被触发器丢弃）的行写入拒绝文件。
+    """
+    changed_bounds = None
+    unchanged_count = 0
+    deleted_count = 0
+
+    if upsert:
+        # 内容哈希相同的行无需写入，标记为未变化
+        cur.execute(f"""
+            UPDATE {staging_table} s SET unchanged = true
+            FROM hz_yuhang_buildings b
+            WHERE b.osm_id = s.osm_id AND b.content_hash = s.content_hash
+        """)
+        unchanged_count = cur.rowcount
+
+        # 将被更新的建筑物的旧范围也要通知失效
+        cur.execute(f"""
+            SELECT ST_XMin(ext), ST_YMin(ext), ST_XMax(ext), ST_YMax(ext)
+            FROM (
+                SELECT ST_Extent(b.geom) AS ext
+                FROM {staging_table} s JOIN hz_yuhang_buildings b ON b.osm_id = s.osm_id
+                WHERE NOT s.unchanged
+            ) t
+        """)
+        old_bounds = cur.fetchone()
+        if old_bounds[0] is not None:
+            changed_bounds = tuple(old_bounds)
+
+        on_conflict = """
+            ON CONFLICT (osm_id) DO UPDATE
+            SET geom = EXCLUDED.geom,
+                building_height = EXCLUDED.building_height,
+                content_hash = EXCLUDED.content_hash
+            WHERE hz_yuhang_buildings.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+        """
+    else:
+        on_conflict = ""
+
+    # xmax = 0 表示本次新插入的行，否则为 ON CONFLICT 更新的行；
+    # 几何修复后为空的行被触发器丢弃（见 sql/add_geometry_validation.sql），不在 RETURNING 中，单独取出行号
+    insert_query = f"""
+        WITH inserted AS (
+            INSERT INTO hz_yuhang_buildings (geom, building_height, osm_id, content_hash)
+            SELECT ST_GeomFromText(wkt, 4326), building_height, osm_id, content_hash
+            FROM {staging_table}
+            WHERE NOT unchanged {{where}}
+            ORDER BY geohash, line_num
+            {on_conflict}
+            RETURNING osm_id, geom, (xmax = 0) AS is_insert, vertex_count, collision_vertex_count
+        )
+        SELECT inserted_count, updated_count, ST_XMin(ext), ST_YMin(ext), ST_XMax(ext), ST_YMax(ext),
+               vertex_count, collision_vertex_count,
+               (SELECT array_agg(line_num ORDER BY line_num) FROM {staging_table} st
+                WHERE NOT unchanged {{where}}
+                    AND NOT EXISTS (SELECT 1 FROM inserted i WHERE i.osm_id = st.osm_id)) AS dropped_lines
+        FROM (
+            SELECT count(*) FILTER (WHERE is_insert) AS inserted_count,
+                   count(*) FILTER (WHERE NOT is_insert) AS updated_count,
+                   ST_Extent(geom) AS ext,
+                   COALESCE(sum(vertex_count), 0) AS vertex_count,
+                   COALESCE(sum(collision_vertex_count), 0) AS collision_vertex_count
+            FROM inserted
+        ) s
+    """
+
+    inserted_count = 0
+    updated_count = 0
+    # 写入行的原始顶点数与简化后（碰撞检测几何）的顶点数
+    vertex_count = 0
+    collision_vertex_count = 0
+
+    def run_insert(where, params=None):
+        nonlocal inserted_count, updated_count, changed_bounds, vertex_count, collision_vertex_count
+        cur.execute(insert_query.format(where=where), params)
+        (inserted, updated, min_x, min_y, max_x, max_y,
+         vertices, collision_vertices, dropped_lines) = cur.fetchone()
+        if dropped_lines:
+            cur.execute(f"SELECT line_num, wkt, building_height FROM {staging_table} WHERE line_num = ANY(%s)",
+                        (dropped_lines,))
+            for line_num, wkt_geom, building_height in cur.fetchall():
+                reject(line_num, "几何修复后为空", f"{wkt_geom},{building_height}")
+        if inserted + updated == 0:
+            return
+        inserted_count += inserted
+        updated_count += updated
+        vertex_count += vertices
+        collision_vertex_count += collision_vertices
+        changed_bounds = merge_bounds(changed_bounds, (min_x, min_y, max_x, max_y))
+
+    cur.execute("SAVEPOINT bulk_insert")
+    try:
+        # 一条 INSERT ... SELECT 写入全部数据
+        run_insert("")
+    except psycopg2.Error as bulk_error:
+        # 有行入库失败（例如 PostGIS 无法解析的 WKT），逐行写入并把失败行记入拒绝文件
+        print(f"✗ 批量写入失败，改为逐行写入: {bulk_error}")
+        cur.execute("ROLLBACK TO SAVEPOINT bulk_insert")
+
+        cur.execute(f"SELECT line_num, wkt, building_height FROM {staging_table} "
+                    f"WHERE NOT unchanged ORDER BY line_num")
+        staged_rows = cur.fetchall()
+        for line_num, wkt_geom, building_height in staged_rows:
+            cur.execute("SAVEPOINT bulk_row")
+            try:
+                run_insert("AND line_num = %(line_num)s", {"line_num": line_num})
+            except psycopg2.Error as row_error:
+                cur.execute("ROLLBACK TO SAVEPOINT bulk_row")
+                reject(line_num, str(row_error).strip().replace('\n', ' '), f"{wkt_geom},{building_height}")
+
+    if delete_missing:
+        if stats["error_count"] > 0:
+            # 有拒绝行时无法区分"文件中已删除"和"本次解析失败"，不做删除
+            print(f"⚠️ 有 {stats['error_count']} 行处理失败，跳过删除文件中不存在的建筑物")
+        else:
+            # 暂存表包含本次文件中的全部建筑物（含未变化的），不在其中的即为已删除
+            cur.execute(f"""
+                WITH deleted AS (
+                    DELETE FROM hz_yuhang_buildings b
+                    WHERE NOT EXISTS (SELECT 1 FROM {staging_table} s WHERE s.osm_id = b.osm_id)
+                    RETURNING geom
+                )
+                SELECT n, ST_XMin(ext), ST_YMin(ext), ST_XMax(ext), ST_YMax(ext)
+                FROM (SELECT count(*) AS n, ST_Extent(geom) AS ext FROM deleted) d
+            """)
+            deleted_count, min_x, min_y, max_x, max_y = cur.fetchone()
+            if deleted_count > 0:
+                changed_bounds = merge_bounds(changed_bounds, (min_x, min_y, max_x, max_y))
+
+    conn.commit()
+
+    return {
+        "total_count": stats["total_count"],
+        "success_count": inserted_count + updated_count,
+        "error_count": stats["error_count"],
+        "inserted_count": inserted_count,
+        "updated_count": updated_count,
+        "unchanged_count": unchanged_count,
+        "deleted_count": deleted_count,
+        "vertex_count": vertex_count,
+        "collision_vertex_count": collision_vertex_count,
+        "changed_bounds": changed_bounds,
+    }
+
+
+def _bulk_load_records(conn, records, reject_file, staging_table, upsert=False,
+                       delete_missing=False, progress=None):
+    """
+    COPY 批量导入的核心流程，records 为 building_reader 产出的 BuildingRecord 迭代器。
+    staging_table 为本次导入专用的暂存表（见 _unique_staging_table），由调用方在结束后删除。
+    解析失败、入库失败以及几何修复后为空（被触发器丢弃）的记录写入 reject_file。
+    upsert=True 时为增量导入：按 osm_id 比较内容哈希，只插入新建筑物、更新内容变化的建筑物；
+    delete_missing=True 时再删除表中有、本次文件中没有的建筑物。
+    progress(done) 在每解析完一块记录后调用（抛出异常即中止 COPY 并回滚）。
+    提交后返回统计 {"total_count", "success_count", "error_count", "inserted_count", "updated_count",
+    "unchanged_count", "deleted_count", "vertex_count", "collision_vertex_count", "changed_bounds"}，不发送变更通知。
+    """
+    stats = {"total_count": 0, "error_count": 0}
+    reject = _make_reject(reject_file, stats)
+
+    # 连接池中的连接默认使用 RealDictCursor，这里按元组读取结果
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        _set_simplify_tolerance(cur)
+        _copy_to_staging(cur, records, staging_table, reject, stats, progress)
+        # 本次导入已分配的 osm_id 从暂存表查询，不随导入的记录数占用内存
+        assigned = _StagedOsmIds(cur, [staging_table])
+        for _, line_num, reason, line in _dedup_staged(cur, [staging_table], assigned):
+            reject(line_num, reason, line)
+        _resolve_table_conflicts(conn, cur, staging_table, assigned)
+        return _write_from_staging(conn, cur, staging_table, reject, stats, upsert, delete_missing)
+
+
+def _bind_total(progress, file_path, file_format):
+    """把 progress(done, total) 包装成 _bulk_load_records 使用的 progress(done)，total 由文件估算"""
+    if progress is None:
+        return None
+    total = count_records(file_path, file_format)
+    return lambda done: progress(done, total)
+
+
+def _bulk_result(stats, reject_file_path, start_time, delta=False):
+    """
+    输出批量导入统计，并整理成与 insert_buildings_from_file 相同结构的结果
+    """
+    elapsed = time.time() - start_time
+    success_count = stats["success_count"]
+    error_count = stats["error_count"]
+    total_count = stats["total_count"]
+
+    print(f"\n批量导入完成!")
+    print(f"成功插入: {success_count}")
+    print(f"处理失败: {error_count} (详见 {reject_file_path})")
+    print(f"耗时: {elapsed:.2f} 秒, {success_count / elapsed if elapsed > 0 else 0:.0f} 行/秒")
+
+    result = {
+        "success_count": success_count,
+        "error_count": error_count,
+        "total_count": total_count,
+        "success_rate": success_count / total_count * 100 if total_count > 0 else 0,
+        "reject_file": reject_file_path,
+        "elapsed_seconds": elapsed,
+        "rows_per_second": success_count / elapsed if elapsed > 0 else 0
+    }
+    vertex_count = stats.get("vertex_count", 0)
+    if vertex_count > 0:
+        collision_vertex_count = stats["collision_vertex_count"]
+        reduction = (1 - collision_vertex_count / vertex_count) * 100
+        print(f"碰撞检测几何顶点数: {vertex_count} -> {collision_vertex_count} (减少 {reduction:.1f}%)")
+        result["vertex_count"] = vertex_count
+        result["collision_vertex_count"] = collision_vertex_count
+        result["vertex_reduction_percent"] = reduction
+    if delta:
+        print(f"新增: {stats['inserted_count']}, 更新: {stats['updated_count']}, "
+              f"未变化: {stats['unchanged_count']}, 删除: {stats['deleted_count']}")
+        for key in ("inserted_count", "updated_count", "unchanged_count", "deleted_count"):
+            result[key] = stats[key]
+    return result
+
+
+def insert_buildings_from_file_bulk(conn, file_path='buildings_output.txt', reject_file_path=None,
+                                    file_format=None, progress=None):
+    """
+    使用 COPY 批量导入建筑物数据（文件格式同 insert_buildings_from_file）。
+    1. 流式读取文件，合格的记录通过 COPY 写入 UNLOGGED 暂存表
+    2. 一条 INSERT ... SELECT 按中心点 geohash 排序后写入 hz_yuhang_buildings，空间上相邻的建筑物写入相邻的数据页
+    格式错误或入库失败的行写入拒绝文件（默认为 <file_path>.reject），不会中断整个导入。
+    progress 同 insert_buildings_from_file。
+    """
+    if reject_file_path is None:
+        reject_file_path = f"{file_path}.reject"
+    staging_table = _unique_staging_table()
+
+    start_time = time.time()
+
+    try:
+        records = read_buildings(file_path, file_format)
+        with open(reject_file_path, 'w', encoding='utf-8') as reject_file:
+            stats = _bulk_load_records(conn, records, reject_file, staging_table,
+                                       progress=_bind_total(progress, file_path, file_format))
+
+        if stats["success_count"] > 0:
+            notify_buildings_changed(stats["changed_bounds"])
+
+        return _bulk_result(stats, reject_file_path, start_time)
+
+    except FileNotFoundError:
+        print(f"✗ 文件 {file_path} 不存在")
+        return None
+    except Exception as e:
+        print(f"✗ 批量导入时出错: {str(e)}")
+        conn.rollback()
+        return None
+    finally:
+        _drop_staging_table(conn, staging_table)
+
+
+def insert_buildings_from_file_delta(conn, file_path='buildings_output.txt', reject_file_path=None,
+                                     delete_missing=False, file_format=None, progress=None):
+    """
+    增量导入建筑物数据（文件格式同 insert_buildings_from_file），用于日常刷新。
+    记录属性中自带 osm_id（GeoJSON / GeoParquet / FlatGeobuf）时按该 id 匹配表中的行，中心点移动的建筑物也按更新处理；
+    没有时按中心点网格生成 osm_id（同 generate_osm_ids）。
+    每行计算 (几何, 高度) 的内容哈希，与表中同一 osm_id 已存储的哈希比较：
+    新建筑物插入、内容变化的通过 ON CONFLICT (osm_id) DO UPDATE 更新、未变化的不写入；
+    delete_missing=True 时删除表中有而文件中没有的建筑物（有拒绝行时跳过删除）。
+    需要先执行 sql/add_content_hash.sql（content_hash 列和 osm_id 唯一索引）。
+    progress 同 insert_buildings_from_file。
+    """
+    if reject_file_path is None:
+        reject_file_path = f"{file_path}.reject"
+    staging_table = _unique_staging_table()
+
+    start_time = time.time()
+
+    try:
+        records = read_buildings(file_path, file_format)
+        with open(reject_file_path, 'w', encoding='utf-8') as reject_file:
+            stats = _bulk_load_records(conn, records, reject_file, staging_table,
+                                       upsert=True, delete_missing=delete_missing,
+                                       progress=_bind_total(progress, file_path, file_format))
+
+        if stats["success_count"] > 0 or stats["deleted_count"] > 0:
+            notify_buildings_changed(stats["changed_bounds"])
+
+        return _bulk_result(stats, reject_file_path, start_time, delta=True)
+
+    except FileNotFoundError:
+        print(f"✗ 文件 {file_path} 不存在")
+        return None
+    except Exception as e:
+        print(f"✗ 增量导入时出错: {str(e)}")
+        conn.rollback()
+        return None
+    finally:
+        _drop_staging_table(conn, staging_table)
+
+
+def insert_buildings_from_stream(conn, stream, file_format="text", gzipped=False, reject_file_path=None,
+                                 upsert=False, delete_missing=False, progress=None):
+    """
+    从顺序读取的二进制流（例如上传的请求体）边读边导入建筑物数据，不在磁盘或内存中暂存整个文件。
+    流程同 insert_buildings_from_file_bulk；upsert=True 时按 insert_buildings_from_file_delta 增量导入。
+    每次调用使用独立的暂存表，导入结束后删除，多个上传可以同时进行。
+    progress(done) 在每解析完一块记录后调用（流的总条数未知）。
+    """
+    if reject_file_path is None:
+        reject_file_path = f"upload_{time.strftime('%Y%m%d_%H%M%S')}.reject"
+    staging_table = _unique_staging_table()
+
+    start_time = time.time()
+
+    try:
+        records = read_buildings_stream(stream, file_format, gzipped)
+        with open(reject_file_path, 'w', encoding='utf-8') as reject_file:
+            stats = _bulk_load_records(conn, records, reject_file, staging_table,
+                                       upsert=upsert, delete_missing=delete_missing, progress=progress)
+
+        if stats["success_count"] > 0 or stats["deleted_count"] > 0:
+            notify_buildings_changed(stats["changed_bounds"])
+
+        return _bulk_result(stats, reject_file_path, start_time, delta=upsert)
+
+    except Exception as e:
+        print(f"✗ 流式导入时出错: {str(e)}")
+        conn.rollback()
+        return None
+    finally:
+        _drop_staging_table(conn, staging_table)
+
+
+# --- 多进程分片导入 ---
+
+def _compute_shards(file_path, shard_count):
+    """
+    按字节把文件切成 shard_count 片，切点对齐到行首。
+    返回 [(起始字节, 结束字节, 起始行号), ...]
+    """
+    file_size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, 'rb') as file:
+        for i in range(1, shard_count):
+            file.seek(max(file_size * i // shard_count, boundaries[-1]))
+            if file.tell() > 0:
+                file.readline()  # 跳到下一行行首
+            position = file.tell()
+            if position >= file_size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+        boundaries.append(file_size)
+
+        # 统计每片之前的行数，保证拒绝文件中的行号与原文件一致
+        shards = []
+        line_num = 1
+        file.seek(0)
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            shards.append((start, end, line_num))
+            remaining = end - start
+            while remaining > 0:
+                chunk = file.read(min(remaining, 1024 * 1024))
+                line_num += chunk.count(b'\n')
+                remaining -= len(chunk)
+    return shards
+
+
+def _read_shard_lines(file_path, start, end, first_line_num):
+    """逐行读取 [start, end) 字节范围内的内容，产出 (行号, 行内容)"""
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        position = start
+        line_num = first_line_num
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line_num, line.decode('utf-8')
+            line_num += 1
+
+
+def _init_import_worker():
+    """导入子进程初始化：每个进程建立只含一个连接的连接池"""
+    init_connection_pool(min_size=1, max_size=1, statement_timeout=0)
+
+
+def _stage_shard(file_path, start, end, first_line_num, shard_index, staging_table, reject_file_path,
+                 file_format=None):
+    """
+    并行导入第一阶段（子进程）：解析一个分片并 COPY 到该分片的暂存表后提交，此时尚未写入 hz_yuhang_buildings。
+    start 为 None 表示不切分（非纯文本格式），整个文件作为一个分片读取。
+    返回 {"shard", "total_count", "error_count"}。
+    """
+    if start is None:
+        records = read_buildings(file_path, file_format)
+    else:
+        records = read_text_lines(_read_shard_lines(file_path, start, end, first_line_num))
+    stats = {"total_count": 0, "error_count": 0}
+    with get_db_connection() as conn, open(reject_file_path, 'w', encoding='utf-8') as reject_file:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            _copy_to_staging(cur, records, staging_table, _make_reject(reject_file, stats), stats)
+        conn.commit()
+    stats["shard"] = shard_index
+    return stats
+
+
+def _write_shard(staging_table, shard_index, reject_file_path, total_count, error_count):
+    """
+    并行导入第二阶段（子进程）：把一个分片的暂存表写入 hz_yuhang_buildings 并提交，
+    入库失败的行追加到该分片的拒绝文件。返回 _bulk_load_records 的统计（含第一阶段的行数）。
+    """
+    stats = {"total_count": total_count, "error_count": error_count}
+    with get_db_connection() as conn, open(reject_file_path, 'a', encoding='utf-8') as reject_file:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            _set_simplify_tolerance(cur)
+            stats = _write_from_staging(conn, cur, staging_table, _make_reject(reject_file, stats), stats)
+    stats["shard"] = shard_index
+    return stats
+
+
+class _StagedOsmIds:
+    """
+    暂存表（并行导入时为所有分片的暂存表）中已分配的 osm_id，提供 _resolve_osm_id 所需的 assigned 接口（in、赋值、删除）。
+    只有少数 osm_id 需要重新分配，按需查询暂存表，不把全部 id 读入内存。
+    """
+
+    def __init__(self, cur, staging_tables):
+        self._cur = cur
+        self._union = " UNION ALL ".join(f"SELECT osm_id FROM {table} WHERE osm_id = %(osm_id)s"
+                                         for table in staging_tables)
+        self._added = set()
+        self._released = set()
+
+    def __contains__(self, osm_id):
+        if osm_id in self._added:
+            return True
+        if osm_id in self._released:
+            return False
+        self._cur.execute(f"SELECT EXISTS ({self._union})", {"osm_id": osm_id})
+        return self._cur.fetchone()[0]
+
+    def __setitem__(self, osm_id, geohash_str):
+        self._added.add(osm_id)
+        self._released.discard(osm_id)
+
+    def __delitem__(self, osm_id):
+        self._added.discard(osm_id)
+        self._released.add(osm_id)
+
+
+def _dedup_staged(cur, staging_tables, assigned):
+    """
+    处理暂存表之间（并行导入的各分片）以及同一暂存表不同块之间重复的 osm_id，规则与 generate_osm_ids 相同——
+    同一 osm_id 的多行中数据自带该 id 的行优先（多行自带时按 (分片, 行号) 取第一行），
+    其次按 (WKT 摘要, 分片, 行号) 排序，第一行保留原 id，其余生成的 id 依次加盐重新分配；
+    重复的自带 id 中后面的行从暂存表删除。assigned 为 _StagedOsmIds。
+    不提交，返回被删除的行 [(分片, 行号, 原因, 行内容), ...]，由调用方写入拒绝文件。
+    """
+    rejected = []
+    union = " UNION ALL ".join(f"SELECT {shard_index} AS shard, line_num, osm_id, geohash, wkt, building_height, "
+                               f"source_id FROM {table}"
+                               for shard_index, table in enumerate(staging_tables))
+    cur.execute(f"""
+        WITH staged AS ({union})
+        SELECT shard, line_num, osm_id, geohash, wkt, building_height, source_id
+        FROM staged
+        WHERE osm_id IN (SELECT osm_id FROM staged GROUP BY osm_id HAVING count(*) > 1)
+    """)
+    groups = {}
+    for shard_index, line_num, osm_id, geohash_str, wkt_geom, building_height, source_id in cur.fetchall():
+        digest = hashlib.sha256(wkt_geom.encode('utf-8')).digest()
+        # 自带 id 的行按出现顺序排序，生成 id 的行按 WKT 摘要排序
+        groups.setdefault(osm_id, []).append(
+            (not source_id, b"" if source_id else digest, shard_index, line_num, geohash_str, wkt_geom,
+             building_height))
+
+    others = []
+    for osm_id, members in groups.items():
+        members.sort()
+        for generated, digest, shard_index, line_num, geohash_str, wkt_geom, building_height in members[1:]:
+            if generated:
+                others.append((geohash_str, digest, shard_index, line_num, osm_id))
+            else:
+                cur.execute(f"DELETE FROM {staging_tables[shard_index]} WHERE line_num = %s", (line_num,))
+                rejected.append((shard_index, line_num, f"osm_id {osm_id} 重复", f"{wkt_geom},{building_height}"))
+    # 与 generate_osm_ids 相同的确定性顺序：按 (geohash, WKT 摘要) 依次加盐
+    others.sort()
+    for geohash_str, digest, shard_index, line_num, osm_id in others:
+        new_osm_id = _resolve_osm_id(osm_id, geohash_str, None, assigned, {})
+        cur.execute(f"UPDATE {staging_tables[shard_index]} SET osm_id = %s WHERE line_num = %s",
+                    (new_osm_id, line_num))
+    if others or rejected:
+        print(f"暂存表中 osm_id 重复: 重新分配 {len(others)} 个, 自带 id 重复拒绝 {len(rejected)} 个")
+    return rejected
+
+
+def _merge_staged_shards(conn, staging_tables):
+    """
+    并行导入合并阶段（父进程）：各分片只在块内去重 osm_id，这里处理跨块、跨分片的重复（见 _dedup_staged）
+    和与表中已有 id 的冲突，规则与单进程导入相同。
+    全部改写在一个事务中提交，返回被删除的行 [(分片, 行号, 原因, 行内容), ...]，由调用方写入拒绝文件。
+    """
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        assigned = _StagedOsmIds(cur, staging_tables)
+        rejected = _dedup_staged(cur, staging_tables, assigned)
+        for staging_table in staging_tables:
+            _resolve_table_conflicts(conn, cur, staging_table, assigned)
+    conn.commit()
+    return rejected
+
+
+def _merge_shard_stats(stats, shard_results, shard_stats):
+    """把一个分片的写入统计累加到并行导入的总统计"""
+    for key in ("total_count", "success_count", "error_count", "vertex_count", "collision_vertex_count"):
+        stats[key] += shard_stats[key]
+    stats["changed_bounds"] = merge_bounds(stats["changed_bounds"], shard_stats["changed_bounds"])
+    shard_results.append({key: shard_stats[key] for key in ("shard", "total_count", "success_count", "error_count")})
+
+
+def insert_buildings_from_file_parallel(conn, file_path='buildings_output.txt', workers=None, reject_file_path=None,
+                                        file_format=None, progress=None):
+    """
+    多进程并行导入建筑物数据（文件格式同 insert_buildings_from_file）。
+    文件按字节切分为 workers 个分片（切点对齐行首），分三个阶段导入：
+    1. 各子进程使用自己的连接，把分片解析并 COPY 到该分片的暂存表
+    2. 父进程通过 conn 合并：跨分片去重 osm_id，处理与表中已有 id 的冲突（结果与单进程导入一致）
+    3. 各子进程把自己的暂存表写入 hz_yuhang_buildings 并各自提交
+    最后合并各分片的成功/失败统计和拒绝文件。只有未压缩的文本行格式可以按字节切分，其他格式整个文件由一个子进程导入。
+    progress 同 insert_buildings_from_file，在每个分片完成一个阶段时上报（两个阶段各占一半，取消也只在分片之间生效）。
+
+    第三阶段各分片独立提交，出错或取消时未开始的分片不再执行，已提交的分片保留：
+    异常上附带 partial_result（已提交的统计和分片），由后台任务记录到任务结果中，随后重新抛出。
+    """
+    if reject_file_path is None:
+        reject_file_path = f"{file_path}.reject"
+    workers = workers or os.cpu_count() or 1
+    file_format = file_format or detect_format(file_path)
+
+    start_time = time.time()
+
+    try:
+        if file_format == "text" and not file_path.lower().endswith(".gz"):
+            shards = _compute_shards(file_path, workers)
+        else:
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(file_path)
+            print(f"{file_format} 格式不支持按字节切分，使用单个进程导入")
+            shards = [(None, None, 1)]
+    except FileNotFoundError:
+        print(f"✗ 文件 {file_path} 不存在")
+        return None
+
+    print(f"文件切分为 {len(shards)} 个分片，使用 {workers} 个进程导入")
+
+    staging_tables = [_unique_staging_table() for _ in shards]
+    stats = {"total_count": 0, "success_count": 0, "error_count": 0, "vertex_count": 0, "collision_vertex_count": 0,
+             "changed_bounds": None}
+    shard_results = []
+    total = count_records(file_path, file_format) if progress else None
+
+    def report(staged, written):
+        if progress:
+            progress((staged + written) // 2, total)
+
+    # 使用 spawn 启动子进程，避免继承父进程已有的数据库连接
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_import_worker)
+    write_futures = []
+    try:
+        staged_stats = []
+        stage_futures = [
+            executor.submit(_stage_shard, file_path, start, end, first_line_num, shard_index,
+                            staging_tables[shard_index], f"{reject_file_path}.{shard_index}", file_format)
+            for shard_index, (start, end, first_line_num) in enumerate(shards)
+        ]
+        for future in stage_futures:
+            staged_stats.append(future.result())
+            report(sum(shard_stats["total_count"] for shard_stats in staged_stats), 0)
+        staged_total = sum(shard_stats["total_count"] for shard_stats in staged_stats)
+
+        for shard_index, line_num, reason, line in _merge_staged_shards(conn, staging_tables):
+            with open(f"{reject_file_path}.{shard_index}", 'a', encoding='utf-8') as shard_reject:
+                shard_reject.write(f"{line_num}\t{reason}\t{line}\n")
+            staged_stats[shard_index]["error_count"] += 1
+
+        write_futures = [
+            executor.submit(_write_shard, staging_tables[shard_stats["shard"]], shard_stats["shard"],
+                            f"{reject_file_path}.{shard_stats['shard']}",
+                            shard_stats["total_count"], shard_stats["error_count"])
+            for shard_stats in staged_stats
+        ]
+        for future in write_futures:
+            shard_stats = future.result()
+            _merge_shard_stats(stats, shard_results, shard_stats)
+            print(f"分片 {shard_stats['shard']} 导入完成: 成功{shard_stats['success_count']}, "
+                  f"失败{shard_stats['error_count']}")
+            report(staged_total, stats["total_count"])
+    except Exception as e:
+        print(f"✗ 并行导入时出错: {str(e)}")
+        conn.rollback()
+        # 未开始的分片不再执行，等待已开始的分片结束后统计其中已提交的部分
+        executor.shutdown(wait=True, cancel_futures=True)
+        merged_shards = {shard_result["shard"] for shard_result in shard_results}
+        for future in write_futures:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                shard_stats = future.result()
+                if shard_stats["shard"] not in merged_shards:
+                    _merge_shard_stats(stats, shard_results, shard_stats)
+        if stats["success_count"] > 0:
+            notify_buildings_changed(stats["changed_bounds"])
+        e.partial_result = {
+            "partial": True,
+            "success_count": stats["success_count"],
+            "committed_shards": sorted(shard_result["shard"] for shard_result in shard_results),
+            "shard_count": len(shards),
+            "shards": shard_results,
+            "reject_file": reject_file_path,
+        }
+        print(f"已提交 {len(shard_results)}/{len(shards)} 个分片, 成功插入 {stats['success_count']} 行")
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        for staging_table in staging_tables:
+            _drop_staging_table(conn, staging_table)
+        # 按分片顺序合并拒绝文件
+        with open(reject_file_path, 'w', encoding='utf-8') as reject_file:
+            for shard_index in range(len(shards)):
+                shard_reject_path = f"{reject_file_path}.{shard_index}"
+                if os.path.exists(shard_reject_path):
+                    with open(shard_reject_path, 'r', encoding='utf-8') as shard_reject:
+                        reject_file.write(shard_reject.read())
+                    os.remove(shard_reject_path)
+
+    if stats["success_count"] > 0:
+        notify_buildings_changed(stats["changed_bounds"])
+
+    result = _bulk_result(stats, reject_file_path, start_time)
+    result["shards"] = shard_results
+    return result
+
+
 # 使用示例：
 if __name__ == "__main__":
     # 数据库连接示例（请根据实际情况修改）
@@ -0,0 +1,194 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import geohash2
+
+from service.building_events import Bounds, register_buildings_changed_listener
+from utils.geo_utils import LocalProjection, bounds_intersect
+from utils.logger import logger
+
+# 命中后的精确复核需要 shapely
+try:
+    import shapely
+    from shapely.geometry import Point
+    SHAPELY_AVAILABLE = True
+except ImportError:
+    SHAPELY_AVAILABLE = False
+
+# 本地复核时额外放宽的距离（米），吸收局部投影与数据库米制投影（EPSG:4549）之间的厘米级差异，
+# 边界附近宁可判为碰撞也不漏判
+REFINE_TOLERANCE = 0.05
+
+
+class _CacheEntry:
+    __slots__ = ("candidates", "geoms", "projection", "expires_at", "bounds")
+
+    def __init__(self, candidates, geoms, projection, expires_at, bounds):
+        self.candidates = candidates
+        self.geoms = geoms
+        self.projection = projection
+        self.expires_at = expires_at
+        self.bounds = bounds
+
+
+class CollisionCache:
+    """
+    碰撞检测结果缓存（LRU + TTL）。
+
+    缓存键为量化后的 (geohash 网格, 高度分档, collision_distance)。每个键缓存的是一次"超集查询"的结果：
+    以网格中心为查询点、距离放大网格半对角线、高度取分档下限，网格内任意点、分档内任意高度的真实碰撞建筑
+    都包含在其中。命中时在本地对候选建筑做精确的距离和高度复核，因此命中缓存不会把碰撞判成无碰撞。
+    复核使用与数据库查询相同的碰撞检测几何（geom_collision），超集查询的结果需带 collision_geom 列。
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 300, geohash_precision: int = 9,
+                 height_bucket: float = 5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.geohash_precision = geohash_precision
+        self.height_bucket = height_bucket
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 每次失效自增，用于丢弃失效前发起、失效后才返回的查询结果
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def make_key(self, longitude: float, latitude: float, height: float, collision_distance: float) -> tuple:
+        cell = geohash2.encode(latitude, longitude, precision=self.geohash_precision)
+        bucket = math.floor(height / self.height_bucket)
+        return cell, bucket, float(collision_distance)
+
+    def superset_query(self, key: tuple):
+        """
+        返回缓存键对应的超集查询参数 (longitude, latitude, height, collision_distance)。
+        """
+        cell, bucket, collision_distance = key
+        lat, lon, lat_err, lon_err = geohash2.decode_exactly(cell)
+
+        projection = LocalProjection(lon, lat)
+        half_diagonal = math.hypot(lon_err * projection.meters_per_deg_lon, lat_err * projection.meters_per_deg_lat)
+
+        return lon, lat, bucket * self.height_bucket, collision_distance + half_diagonal + REFINE_TOLERANCE
+
+    def get(self, longitude: float, latitude: float, height: float, collision_distance: float) -> Optional[List[dict]]:
+        """
+        查询缓存，命中时返回精确复核后的碰撞建筑列表，未命中返回 None。
+        """
+        key = self.make_key(longitude, latitude, height, collision_distance)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return self._refine(entry, longitude, latitude, height, collision_distance)
+
+    def put(self, key: tuple, candidates: List[dict], generation: int,
+            longitude: float, latitude: float, height: float, collision_distance: float) -> List[dict]:
+        """
+        写入超集查询结果，并返回 (longitude, latitude, height) 这一点的精确复核结果。
+        candidates 的每项带 collision_geom（碰撞检测几何的 WKT，EPSG:4326），复核后从返回结果中去掉，
+        与未使用缓存时的结果一致。
+        generation 为发起查询前读取的 self.generation，期间发生过失效则不写入缓存。
+        """
+        lon, lat, _, search_distance = self.superset_query(key)
+        projection = LocalProjection(lon, lat)
+        geoms = shapely.transform(shapely.from_wkt([c["collision_geom"] for c in candidates]),
+                                  projection.forward_coords)
+        candidates = [{k: v for k, v in c.items() if k != "collision_geom"} for c in candidates]
+
+        # 缓存条目影响范围：超集查询的搜索圆外包框（度）
+        d_lon = search_distance / projection.meters_per_deg_lon
+        d_lat = search_distance / projection.meters_per_deg_lat
+        bounds = (lon - d_lon, lat - d_lat, lon + d_lon, lat + d_lat)
+
+        entry = _CacheEntry(candidates, geoms, projection, time.monotonic() + self.ttl, bounds)
+
+        with self._lock:
+            if generation == self.generation:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+        return self._refine(entry, longitude, latitude, height, collision_distance)
+
+    def _refine(self, entry: _CacheEntry, longitude: float, latitude: float, height: float,
+                collision_distance: float) -> List[dict]:
+        if not entry.candidates:
+            return []
+
+        x, y = entry.projection.forward(longitude, latitude)
+        distances = shapely.distance(entry.geoms, Point(x, y))
+
+        result = []
+        for candidate, distance in zip(entry.candidates, distances):
+            building_height = candidate["building_height"]
+            if building_height is not None and height < building_height \
+                    and distance <= collision_distance + REFINE_TOLERANCE:
+                result.append(candidate)
+        return result
+
+    def invalidate(self, bounds: Bounds):
+        """
+        删除与 bounds 相交的缓存条目，bounds 为 None 时清空全部缓存。
+        """
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            if bounds is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                stale_keys = [k for k, e in self._entries.items() if bounds_intersect(e.bounds, bounds)]
+                for k in stale_keys:
+                    del self._entries[k]
+                removed = len(stale_keys)
+
+        logger.info(f"碰撞结果缓存失效: 范围={bounds}, 删除 {removed} 条")
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total * 100 if total > 0 else 0,
+                "invalidations": self.invalidations,
+            }
+
+
+# --- 全局缓存实例 ---
+collision_cache: Optional[CollisionCache] = None
+
+
+def init_collision_cache(max_size: int, ttl: float, geohash_precision: int, height_bucket: float):
+    """
+    初始化全局碰撞结果缓存，并注册建筑物变更监听以自动失效。
+    """
+    global collision_cache
+    if not SHAPELY_AVAILABLE:
+        logger.warning("⚠️ 未安装 Shapely，碰撞结果缓存已禁用")
+        return None
+
+    collision_cache = CollisionCache(max_size, ttl, geohash_precision, height_bucket)
+    register_buildings_changed_listener(collision_cache.invalidate)
+    logger.info(f"碰撞结果缓存已启用: size={max_size}, ttl={ttl}s, geohash={geohash_precision}, "
+                f"height_bucket={height_bucket}m")
+    return collision_cache
@@ -0,0 +1,243 @@
+import threading
+import time
+from typing import List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+from database.database_conn import get_db_connection
+from service.building_events import Bounds, register_buildings_changed_listener
+from utils.geo_utils import LocalProjection
+from utils.logger import logger
+
+# 内存引擎依赖 numpy + shapely 2.x（STRtree 的 dwithin 谓词）
+try:
+    import numpy as np
+    import shapely
+    import shapely.ops
+    from shapely.geometry import LineString, Point
+    from shapely.strtree import STRtree
+    SHAPELY_AVAILABLE = True
+except ImportError:
+    SHAPELY_AVAILABLE = False
+
+
+class BuildingIndex:
+    """
+    建筑物内存 R-tree（STRtree）索引。
+    启动时把 hz_yuhang_buildings 的轮廓投影到以数据中心为原点的局部米制平面，
+    查询时在本地完成与 ST_DWithin(geography) + 高度过滤 等价的判断，不访问数据库。
+    行中带有 collision_geom（导入时简化的碰撞检测几何，原轮廓的外扩超集）时用它做距离判断，返回结果中的 geom 不变。
+    """
+
+    def __init__(self, rows: List[dict]):
+        if not SHAPELY_AVAILABLE:
+            raise RuntimeError("内存碰撞引擎需要安装 numpy 和 shapely>=2.0")
+
+        self._rows = rows
+        self._heights = np.array(
+            [float(r["building_height"]) if r["building_height"] is not None else np.nan for r in rows],
+            dtype=float
+        )
+        # 所有建筑物的最大高度，查询高度不低于它时不可能碰撞，无需查询 R-tree
+        self._max_height = float(np.nanmax(self._heights)) if np.any(~np.isnan(self._heights)) else -np.inf
+
+        geoms = shapely.from_wkt([r.pop("collision_geom", None) or r["geom"] for r in rows])
+
+        # 以所有建筑物的外包框中心作为投影原点
+        if len(rows) > 0:
+            min_x, min_y, max_x, max_y = shapely.total_bounds(geoms)
+            self.projection = LocalProjection((min_x + max_x) / 2, (min_y + max_y) / 2)
+        else:
+            self.projection = LocalProjection(0.0, 0.0)
+
+        self._geoms = shapely.transform(geoms, self.projection.forward_coords)
+        self._tree = STRtree(self._geoms)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def query(self, longitude: float, latitude: float, height: float, collision_distance: float) -> List[dict]:
+        """
+        判断点是否与某栋建筑发生碰撞，返回结构与 get_collision_buildings_info 相同。
+        """
+        if height >= self._max_height:
+            return []
+
+        x, y = self.projection.forward(longitude, latitude)
+        indices = self._tree.query(Point(x, y), predicate="dwithin", distance=collision_distance)
+
+        # NaN（高度为空）与任何值比较都为 False，与 SQL 中 NULL 的行为一致
+        indices = np.sort(indices[self._heights[indices] > height])
+        return [dict(self._rows[i]) for i in indices]
+
+    def query_path_hits(self, vertices: List[tuple], clearance: float) -> List[dict]:
+        """
+        三维折线走廊查询，返回结构与 get_path_collision_hits 相同，
+        可直接交给 summarize_path_collisions 做高度插值。
+        """
+        hits = []
+
+        for segment_index in range(len(vertices) - 1):
+            lon0, lat0, alt0 = vertices[segment_index]
+            lon1, lat1, alt1 = vertices[segment_index + 1]
+            if min(alt0, alt1) >= self._max_height:
+                continue
+            x0, y0 = self.projection.forward(lon0, lat0)
+            x1, y1 = self.projection.forward(lon1, lat1)
+
+            degenerate = x0 == x1 and y0 == y1
+            segment = Point(x0, y0) if degenerate else LineString([(x0, y0), (x1, y1)])
+
+            indices = self._tree.query(segment, predicate="dwithin", distance=clearance)
+            indices = np.sort(indices[self._heights[indices] > min(alt0, alt1)])
+
+            for i in indices:
+                if degenerate:
+                    fractions = [(0.0, 0.0)]
+                else:
+                    # 航段落在建筑物 clearance 缓冲区内的部分，可能是多段
+                    zone = segment.intersection(self._geoms[i].buffer(clearance))
+                    fractions = [
+                        (segment.project(Point(part.coords[0]), normalized=True),
+                         segment.project(Point(part.coords[-1]), normalized=True))
+                        for part in shapely.get_parts(zone) if not part.is_empty
+                    ]
+                    if not fractions:
+                        closest = shapely.ops.nearest_points(segment, self._geoms[i])[0]
+                        fraction = segment.project(closest, normalized=True)
+                        fractions = [(fraction, fraction)]
+
+                for frac_start, frac_end in fractions:
+                    hit = dict(self._rows[i])
+                    hit.update({
+                        "segment_index": segment_index,
+                        "alt_start": alt0,
+                        "alt_end": alt1,
+                        "frac_start": frac_start,
+                        "frac_end": frac_end,
+                    })
+                    hits.append(hit)
+
+        return hits
+
+
+def load_building_index(conn) -> BuildingIndex:
+    """
+    从数据库加载全部建筑物并构建内存索引。
+    """
+    query = """
+        SELECT
+            osm_id, name, ST_AsText(geom) AS geom, building_height,
+            ST_AsText(ST_Transform(geom_collision, 4326)) AS collision_geom
+        FROM
+            hz_yuhang_buildings
+        WHERE
+            geom IS NOT NULL AND is_valid
+    """
+
+    start_time = time.time()
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(query)
+        rows = cur.fetchall()
+
+    index = BuildingIndex(rows)
+    logger.info("内存碰撞索引构建完成: %d 栋建筑物, 耗时 %.2f 秒", len(index), time.time() - start_time)
+    return index
+
+
+# --- 全局索引实例 ---
+building_index: Optional[BuildingIndex] = None
+
+# 建筑物变更后索引过期：版本号在变更时递增，后台线程重建完成后记录构建时的版本号。
+# 两者不同时查询改走数据库，避免漏掉新增或加高的建筑物
+_changed_version = 0
+_built_version = 0
+_version_lock = threading.Lock()
+_rebuild_event = threading.Event()
+_rebuild_thread: Optional[threading.Thread] = None
+_stopped = False
+
+
+def _load(conn):
+    global building_index, _built_version
+    with _version_lock:
+        version = _changed_version
+    index = load_building_index(conn)
+    with _version_lock:
+        building_index = index
+        _built_version = version
+
+
+def init_building_index(conn, start: bool = True):
+    """
+    初始化全局内存索引，注册建筑物变更监听并启动后台重建线程。
+    应该在应用启动时调用一次；多进程预加载时在主进程中传 start=False 构建，
+    fork 之后各进程再调用 start_building_index_rebuild()（线程不会随 fork 复制）。
+    """
+    # 先注册监听：加载期间发生的变更会在加载完成后由后台线程补上
+    register_buildings_changed_listener(invalidate_building_index)
+    _load(conn)
+    if start:
+        start_building_index_rebuild()
+
+
+def invalidate_building_index(bounds: Bounds):
+    """
+    建筑物变更监听器：标记索引过期（立即生效），由后台线程整体重建后替换。
+    STRtree 构建后不能修改，因此不区分变更范围。
+    """
+    global _changed_version
+    with _version_lock:
+        _changed_version += 1
+    _rebuild_event.set()
+
+
+def is_building_index_current() -> bool:
+    """索引已加载且包含最近一次建筑物变更"""
+    with _version_lock:
+        return building_index is not None and _built_version == _changed_version
+
+
+def _rebuild_loop():
+    while True:
+        _rebuild_event.wait()
+        _rebuild_event.clear()
+        if _stopped:
+            return
+        try:
+            with get_db_connection(statement_timeout=0) as conn:
+                _load(conn)
+        except Exception as e:
+            logger.error(f"❌ 内存碰撞索引重建失败: {e}")
+            # 索引保持过期，稍后重试
+            time.sleep(5)
+            _rebuild_event.set()
+
+
+def start_building_index_rebuild():
+    """启动后台重建线程"""
+    global _rebuild_thread, _stopped
+    _stopped = False
+    _rebuild_thread = threading.Thread(target=_rebuild_loop, name="building-index-rebuild", daemon=True)
+    _rebuild_thread.start()
+    if not is_building_index_current():
+        _rebuild_event.set()
+
+
+def close_building_index():
+    global _rebuild_thread, _stopped
+    _stopped = True
+    _rebuild_event.set()
+    if _rebuild_thread is not None:
+        _rebuild_thread.join(timeout=10)
+        _rebuild_thread = None
+
+
+def get_building_index() -> BuildingIndex:
+    """
+    获取全局内存索引，未初始化时抛出异常。
+    """
+    if building_index is None:
+        logger.error("❌ 内存碰撞索引未初始化，请先调用 init_building_index()")
+        raise RuntimeError("Building index not initialized")
+    return building_index
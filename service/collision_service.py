@@ -1,8 +1,17 @@
 import time  # 导入 time 模块
 from psycopg2.extras import RealDictCursor
-from typing import List
+from typing import List, Optional
 from utils.logger import logger
 
+# 碰撞检测使用的米制投影（EPSG:4549, CGCS2000 / 3-degree Gauss-Kruger CM 120E），
+# 与 sql/add_geometry_simplification.sql 中 geom_collision 列的 SRID 一致
+METRIC_SRID = 4549
+
+# 以下查询使用导入时简化过的 geom_collision（原轮廓的外扩超集，顶点少、不会漏报，见 sql/add_geometry_simplification.sql）。
+# 高度条件统一写成 building_height > 参数::numeric：与列类型一致，
+# 才能使用 (geom_collision, building_height) 复合 GiST 索引在索引内按高度剪枝（见 sql/add_height_index.sql、sql/add_geometry_simplification.sql）；
+# 该索引只包含 is_valid 的行，查询需带上 is_valid 条件（见 sql/add_geometry_validation.sql）
+
 
 def get_collision_buildings_info(conn, longitude: float, latitude: float, height: float, collision_distance: float) -> \
 List[dict]:
@@ -17,10 +26,12 @@ List[dict]:
             hz_yuhang_buildings
         WHERE 
             ST_DWithin(
-                geom::geography, 
-                ST_SetSRID(ST_MakePoint(%(longitude)s, %(latitude)s), 4326)::geography, %(collision_distance)s)
-            AND %(height)s < building_height
-    """
+                geom_collision,
+                ST_Transform(ST_SetSRID(ST_MakePoint(%(longitude)s, %(latitude)s), 4326), {metric_srid}),
+                %(collision_distance)s)
+            AND building_height > %(height)s::numeric
+            AND is_valid
+    """.format(metric_srid=METRIC_SRID)
 
     params = {
         "longitude": longitude,
@@ -50,3 +61,324 @@ List[dict]:
 
         # 4. 返回结果
         return result
+
+
+def get_collision_buildings_info_batch(conn, points: List[tuple], chunk_size: int = 1000) -> List[List[dict]]:
+    """
+    批量判断多个点是否与建筑发生碰撞。
+    points 为 (longitude, latitude, height, collision_distance) 元组列表，
+    每个分块通过 unnest + LATERAL 在一次 SQL 往返中完成查询。
+    返回与输入顺序一致的结果列表，每个元素为该点匹配的建筑物列表。
+    """
+    query = """
+        SELECT
+            p.idx, b.osm_id, b.name, b.geom, b.building_height
+        FROM
+            unnest(%(longitudes)s::float8[], %(latitudes)s::float8[],
+                   %(heights)s::float8[], %(collision_distances)s::float8[])
+                WITH ORDINALITY AS p(longitude, latitude, height, collision_distance, idx)
+        CROSS JOIN LATERAL (
+            SELECT
+                osm_id, name, ST_AsText(geom) AS geom, building_height
+            FROM
+                hz_yuhang_buildings
+            WHERE
+                ST_DWithin(
+                    geom_collision,
+                    ST_Transform(ST_SetSRID(ST_MakePoint(p.longitude, p.latitude), 4326), {metric_srid}),
+                    p.collision_distance)
+                AND building_height > p.height::numeric
+                AND is_valid
+        ) b
+        ORDER BY p.idx
+    """.format(metric_srid=METRIC_SRID)
+
+    results = [[] for _ in points]
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        start_time = time.time()
+
+        for offset in range(0, len(points), chunk_size):
+            chunk = points[offset:offset + chunk_size]
+            params = {
+                "longitudes": [p[0] for p in chunk],
+                "latitudes": [p[1] for p in chunk],
+                "heights": [p[2] for p in chunk],
+                "collision_distances": [p[3] for p in chunk]
+            }
+
+            cur.execute(query, params)
+            for row in cur.fetchall():
+                # WITH ORDINALITY 从 1 开始
+                idx = row.pop("idx")
+                results[offset + idx - 1].append(row)
+
+        execution_time = time.time() - start_time
+        logger.info("Batch query for %d points executed in %.4f seconds", len(points), execution_time)
+
+    return results
+
+
+def get_path_collision_hits(conn, vertices: List[tuple], clearance: float) -> List[dict]:
+    """
+    查询三维折线（航线）走廊内的候选碰撞。
+    vertices 为 (longitude, latitude, altitude) 顶点列表，一条航线只需一次 SQL 查询。
+    返回每个 (航段, 建筑物) 命中记录，包含航段进入/离开建筑物 clearance 范围时
+    在航段上的位置比例 frac_start/frac_end（0~1），高度插值由 summarize_path_collisions 完成。
+    """
+    query = """
+        WITH pts AS (
+            SELECT longitude, latitude, altitude, idx
+            FROM unnest(%(longitudes)s::float8[], %(latitudes)s::float8[], %(altitudes)s::float8[])
+                WITH ORDINALITY AS t(longitude, latitude, altitude, idx)
+        ), segs AS (
+            SELECT
+                p1.idx - 1 AS segment_index,
+                p1.altitude AS alt_start,
+                p2.altitude AS alt_end,
+                ST_Transform(ST_SetSRID(ST_MakeLine(ST_MakePoint(p1.longitude, p1.latitude),
+                                                    ST_MakePoint(p2.longitude, p2.latitude)), 4326),
+                             {metric_srid}) AS line
+            FROM pts p1
+            JOIN pts p2 ON p2.idx = p1.idx + 1
+        )
+        SELECT
+            s.segment_index, s.alt_start, s.alt_end,
+            b.osm_id, b.name, ST_AsText(b.geom) AS geom, b.building_height,
+            CASE WHEN ST_Length(s.line) = 0 THEN 0 ELSE
+                ST_LineLocatePoint(s.line, COALESCE(ST_StartPoint(part.geom), part.geom,
+                                                    ST_ClosestPoint(s.line, b.geom_collision)))
+            END AS frac_start,
+            CASE WHEN ST_Length(s.line) = 0 THEN 0 ELSE
+                ST_LineLocatePoint(s.line, COALESCE(ST_EndPoint(part.geom), part.geom,
+                                                    ST_ClosestPoint(s.line, b.geom_collision)))
+            END AS frac_end
+        FROM
+            segs s
+        JOIN hz_yuhang_buildings b
+            ON ST_DWithin(b.geom_collision, s.line, %(clearance)s)
+            AND b.building_height > LEAST(s.alt_start, s.alt_end)::numeric
+            AND b.is_valid
+        -- 航段落在建筑物 clearance 缓冲区内的部分，可能是多段（航段和缓冲区都在米制投影下计算）
+        LEFT JOIN LATERAL ST_Dump(
+            ST_Intersection(s.line, ST_Buffer(b.geom_collision, %(clearance)s))
+        ) AS part ON NOT ST_IsEmpty(part.geom)
+        ORDER BY s.segment_index, frac_start
+    """.format(metric_srid=METRIC_SRID)
+
+    params = {
+        "longitudes": [v[0] for v in vertices],
+        "latitudes": [v[1] for v in vertices],
+        "altitudes": [v[2] for v in vertices],
+        "clearance": clearance
+    }
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        start_time = time.time()
+
+        cur.execute(query, params)
+        result = cur.fetchall()
+
+        execution_time = time.time() - start_time
+        logger.info("Path query for %d vertices executed in %.4f seconds", len(vertices), execution_time)
+
+        return result
+
+
+def _first_fraction_below_roof(alt_start: float, alt_end: float, frac_start: float, frac_end: float,
+                               building_height: float):
+    """
+    航段高度沿航段线性插值，返回 [frac_start, frac_end] 内第一个高度低于楼顶的位置比例，
+    不存在则返回 None。
+    """
+    if frac_start > frac_end:
+        frac_start, frac_end = frac_end, frac_start
+
+    altitude_at_start = alt_start + (alt_end - alt_start) * frac_start
+    if altitude_at_start < building_height:
+        return frac_start
+
+    # 进入区间时高于楼顶，只有下降航段才可能在区间内降到楼顶以下
+    if alt_end < alt_start:
+        frac_cross = (alt_start - building_height) / (alt_start - alt_end)
+        if frac_cross < frac_end:
+            return frac_cross
+
+    return None
+
+
+def summarize_path_collisions(vertices: List[tuple], hits: List[dict]) -> dict:
+    """
+    根据走廊查询的命中记录做高度插值，汇总航线碰撞结果。
+    返回:
+    - is_collision: 是否发生碰撞
+    - first_hit: 沿航线第一个碰撞位置（航段序号、经纬度、插值高度、建筑物 osm_id）
+    - building_infos: 所有碰撞建筑物，按沿航线首次碰撞的先后排序
+    """
+    first_hits = {}
+
+    for hit in hits:
+        segment_index = hit["segment_index"]
+        lon0, lat0, alt0 = vertices[segment_index]
+        lon1, lat1, alt1 = vertices[segment_index + 1]
+
+        if hit["building_height"] is None:
+            continue
+
+        if lon0 == lon1 and lat0 == lat1:
+            # 原地升降的航段，整段高度都出现在同一位置
+            frac_start, frac_end = 0.0, 1.0
+        else:
+            frac_start, frac_end = hit["frac_start"], hit["frac_end"]
+
+        fraction = _first_fraction_below_roof(alt0, alt1, frac_start, frac_end, float(hit["building_height"]))
+        if fraction is None:
+            continue
+
+        key = hit["osm_id"]
+        position = (segment_index, fraction)
+        if key not in first_hits or position < first_hits[key][0]:
+            first_hits[key] = (position, hit)
+
+    building_infos = []
+    for (segment_index, fraction), hit in sorted(first_hits.values(), key=lambda item: item[0]):
+        lon0, lat0, alt0 = vertices[segment_index]
+        lon1, lat1, alt1 = vertices[segment_index + 1]
+        building_infos.append({
+            "osm_id": hit["osm_id"],
+            "name": hit["name"],
+            "geom": hit["geom"],
+            "building_height": hit["building_height"],
+            "segment_index": segment_index,
+            "longitude": lon0 + (lon1 - lon0) * fraction,
+            "latitude": lat0 + (lat1 - lat0) * fraction,
+            "altitude": alt0 + (alt1 - alt0) * fraction,
+        })
+
+    result = {
+        "is_collision": len(building_infos) > 0,
+    }
+
+    if building_infos:
+        first = building_infos[0]
+        result["first_hit"] = {
+            "segment_index": first["segment_index"],
+            "longitude": first["longitude"],
+            "latitude": first["latitude"],
+            "altitude": first["altitude"],
+            "osm_id": first["osm_id"],
+        }
+        result["building_infos"] = building_infos
+
+    return result
+
+
+# get_collision_buildings_info_async 的查询（asyncpg 按语句文本缓存预编译语句）
+_ASYNC_COLLISION_QUERY_TEMPLATE = """
+        SELECT 
+            osm_id, name, ST_AsText(geom) AS geom, building_height{extra_columns}
+        FROM 
+            hz_yuhang_buildings
+        WHERE 
+            ST_DWithin(
+                geom_collision,
+                ST_Transform(ST_SetSRID(ST_MakePoint($1::float8, $2::float8), 4326), {metric_srid}),
+                $4::float8)
+            AND building_height > $3::float8::numeric
+            AND is_valid
+    """
+ASYNC_COLLISION_QUERY = _ASYNC_COLLISION_QUERY_TEMPLATE.format(extra_columns="", metric_srid=METRIC_SRID)
+# 同时返回经纬度下的碰撞检测几何，供碰撞结果缓存在本地按同一几何复核（见 service/collision_cache.py）
+ASYNC_COLLISION_CANDIDATES_QUERY = _ASYNC_COLLISION_QUERY_TEMPLATE.format(
+    extra_columns=",\n            ST_AsText(ST_Transform(geom_collision, 4326)) AS collision_geom",
+    metric_srid=METRIC_SRID)
+
+
+async def get_collision_buildings_info_async(conn, longitude: float, latitude: float, height: float,
+                                             collision_distance: float, with_collision_geom: bool = False) -> List[dict]:
+    """
+    get_collision_buildings_info 的异步版本（asyncpg 连接），等待数据库时不阻塞事件循环。
+    返回匹配的建筑物列表；with_collision_geom 为 True 时每项多一个 collision_geom（碰撞检测几何的 WKT，EPSG:4326）。
+    """
+    start_time = time.time()
+
+    query = ASYNC_COLLISION_CANDIDATES_QUERY if with_collision_geom else ASYNC_COLLISION_QUERY
+    records = await conn.fetch(query, longitude, latitude, height, collision_distance)
+
+    execution_time = time.time() - start_time
+    logger.info("Async database query executed in %.4f seconds", execution_time)
+
+    return [dict(record) for record in records]
+
+
+# 最近障碍物查询每次按 KNN 顺序多取的候选数，用于按精确距离重排
+CLEARANCE_CANDIDATE_EXTRA = 16
+
+
+# get_nearest_obstacles_async 的查询
+ASYNC_CLEARANCE_QUERY = """
+        WITH q AS (
+            SELECT ST_Transform(ST_SetSRID(ST_MakePoint($1::float8, $2::float8), 4326), {metric_srid}) AS pt
+        )
+        SELECT
+            b.osm_id, b.name, ST_AsText(b.geom) AS geom, b.building_height,
+            ST_Distance(b.geom_metric, q.pt) AS horizontal_distance,
+            b.building_height::float8 - $3::float8 AS vertical_margin,
+            b.geom_collision <-> q.pt AS knn_distance
+        FROM hz_yuhang_buildings b, q
+        WHERE b.building_height > $3::float8::numeric
+            AND b.is_valid
+            AND ($5::float8 IS NULL OR ST_DWithin(b.geom_collision, q.pt, $5::float8))
+        ORDER BY b.geom_collision <-> q.pt
+        LIMIT $4
+    """.format(metric_srid=METRIC_SRID)
+
+
+async def prepare_async_statements(conn):
+    """
+    asyncpg 连接池的 init 回调：新连接建立后用不返回结果的参数各执行一次异步查询，
+    预编译语句进入该连接的语句缓存，首个请求不再承担解析和规划的往返。
+    预编译语句属于数据库会话，无法在进程间共享，每个进程的每个连接各自预热。
+    """
+    await conn.fetch(ASYNC_COLLISION_QUERY, 0.0, 0.0, 1e9, 0.0)
+    await conn.fetch(ASYNC_COLLISION_CANDIDATES_QUERY, 0.0, 0.0, 1e9, 0.0)
+    await conn.fetch(ASYNC_CLEARANCE_QUERY, 0.0, 0.0, 1e9, 0, 0.0)
+
+
+async def get_nearest_obstacles_async(conn, longitude: float, latitude: float, height: float, k: int = 1,
+                                      max_distance: Optional[float] = None) -> List[dict]:
+    """
+    查询高于 height 的最近 k 栋建筑物（asyncpg 连接），按水平距离从近到远返回。
+    每项包含 horizontal_distance（到原轮廓的精确水平距离，米，点在轮廓内为 0）
+    和 vertical_margin（建筑物高出查询高度的米数）。max_distance 不为空时只在该范围内查找。
+
+    GiST 索引按 geom_collision <-> 点 的顺序扫描候选（KNN，高度条件在索引内剪枝），再用 geom_metric 计算精确距离重排。
+    geom_collision 是原轮廓的外扩超集，到它的距离不大于精确距离：已扫描候选中最远的 KNN 距离
+    不小于第 k 个精确距离时，未扫描的建筑物不可能更近，结果即为精确的前 k 个；否则加大候选数重查。
+    """
+    start_time = time.time()
+
+    limit = k + CLEARANCE_CANDIDATE_EXTRA
+    while True:
+        records = await conn.fetch(ASYNC_CLEARANCE_QUERY, longitude, latitude, height, limit, max_distance)
+        nearest = sorted((dict(record) for record in records), key=lambda r: (r["horizontal_distance"], r["osm_id"]))
+        if max_distance is not None:
+            nearest = [r for r in nearest if r["horizontal_distance"] <= max_distance]
+
+        # 候选没有取满时已扫描全部符合条件的建筑物
+        if len(records) < limit:
+            break
+        # 未扫描的建筑物精确距离不小于已扫描候选中最远的 KNN 距离
+        scanned_distance = records[-1]["knn_distance"]
+        if len(nearest) >= k and nearest[k - 1]["horizontal_distance"] <= scanned_distance:
+            break
+        if max_distance is not None and scanned_distance > max_distance:
+            break
+        limit *= 4
+
+    execution_time = time.time() - start_time
+    logger.info("Nearest obstacle query executed in %.4f seconds (candidates=%d)", execution_time, len(records))
+
+    for item in nearest:
+        del item["knn_distance"]
+    return nearest[:k]
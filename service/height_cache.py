@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import geohash2
+
+from utils.logger import logger
+
+# --- 高度缓存配置 ---
+HEIGHT_CACHE_ENABLED = os.getenv("HEIGHT_CACHE_ENABLED", "true").lower() == "true"
+HEIGHT_CACHE_PATH = os.getenv("HEIGHT_CACHE_PATH", "cache/height_cache.sqlite3")
+HEIGHT_CACHE_TTL = float(os.getenv("HEIGHT_CACHE_TTL", str(30 * 24 * 3600)))  # 默认 30 天
+HEIGHT_CACHE_MAX_ENTRIES = int(os.getenv("HEIGHT_CACHE_MAX_ENTRIES", "1000000"))
+# geohash 10 位约 1.2m x 0.6m，中心点几乎重合的建筑物共用一条缓存
+HEIGHT_CACHE_GEOHASH_PRECISION = int(os.getenv("HEIGHT_CACHE_GEOHASH_PRECISION", "10"))
+
+# 每写入多少条检查一次容量，避免每次写入都 COUNT
+_EVICT_CHECK_INTERVAL = 1000
+
+
+class HeightCache:
+    """
+    高度接口结果的本地磁盘缓存（SQLite）。
+    以建筑物中心点的 geohash 为键，支持 TTL 过期和按条数淘汰（先淘汰最早写入的）。
+    单个 SQLite 连接加锁后可在多个抓取线程间共享。
+    """
+
+    def __init__(self, path: str = HEIGHT_CACHE_PATH, ttl: float = HEIGHT_CACHE_TTL,
+                 max_entries: int = HEIGHT_CACHE_MAX_ENTRIES, geohash_precision: int = HEIGHT_CACHE_GEOHASH_PRECISION):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.geohash_precision = geohash_precision
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._puts_since_check = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS height_cache (
+                geohash TEXT PRIMARY KEY,
+                height REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS height_cache_created_at_idx ON height_cache (created_at)")
+        self._conn.commit()
+
+    def _key(self, longitude: float, latitude: float) -> str:
+        return geohash2.encode(latitude, longitude, precision=self.geohash_precision)
+
+    def get(self, longitude: float, latitude: float) -> Optional[float]:
+        """
+        查询缓存的高度，不存在或已过期时返回 None。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT height FROM height_cache WHERE geohash = ? AND created_at >= ?",
+                (self._key(longitude, latitude), time.time() - self.ttl)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, longitude: float, latitude: float, height: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO height_cache (geohash, height, created_at) VALUES (?, ?, ?)",
+                (self._key(longitude, latitude), height, time.time())
+            )
+            self._conn.commit()
+
+            self._puts_since_check += 1
+            if self._puts_since_check >= _EVICT_CHECK_INTERVAL:
+                self._puts_since_check = 0
+                self._evict()
+
+    def _evict(self):
+        """
+        删除过期条目，超过容量时按写入时间淘汰最早的条目（调用方持有锁）。
+        """
+        self._conn.execute("DELETE FROM height_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM height_cache").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM height_cache WHERE geohash IN "
+                "(SELECT geohash FROM height_cache ORDER BY created_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._conn.close()
+
+
+# --- 全局缓存实例 ---
+height_cache: Optional[HeightCache] = None
+# 多个抓取线程可能同时首次调用 get_height_cache，只打开一次
+_init_lock = threading.Lock()
+
+
+def get_height_cache() -> Optional[HeightCache]:
+    """
+    获取全局高度缓存（首次调用时打开），未启用时返回 None。
+    """
+    global height_cache
+    if not HEIGHT_CACHE_ENABLED:
+        return None
+    if height_cache is None:
+        with _init_lock:
+            if height_cache is None:
+                height_cache = HeightCache()
+                logger.info(f"高度缓存已启用: {HEIGHT_CACHE_PATH}, ttl={HEIGHT_CACHE_TTL}s, "
+                            f"max={HEIGHT_CACHE_MAX_ENTRIES}")
+    return height_cache
@@ -0,0 +1,438 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import requests
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from requests.adapters import HTTPAdapter
+
+from service.building_events import notify_buildings_changed
+from service.height_cache import get_height_cache
+from utils.geo_utils import merge_bounds
+
+# 建筑物高度查询接口
+HEIGHT_API_URL = os.getenv("HEIGHT_API_URL", "http://localhost:3100/api/get_building_height")
+
+# 碰撞检测使用的建筑物表，只有这张表的更新需要通知碰撞结果缓存
+BUILDINGS_TABLE = "hz_yuhang_buildings"
+
+# 断点记录表，每次补全任务（run_id）一行
+CHECKPOINT_TABLE = "building_enrichment_checkpoints"
+
+# 各阶段之间的结束标记
+_END = object()
+
+
+def _pending_conditions(height_column, only_missing=False, stale_before=None, stale_column="update_time"):
+    """
+    待处理建筑物的筛选条件（参数 %(last_gid)s、%(stale_before)s）。
+    only_missing 只处理高度为空的建筑物；stale_before 额外处理 stale_column 早于该时间的建筑物。
+    """
+    conditions = [
+        sql.SQL("is_valid"),  # 几何有效且非空（导入时由触发器校验，见 sql/add_geometry_validation.sql）
+        sql.SQL("gid > %(last_gid)s"),
+    ]
+    if only_missing or stale_before is not None:
+        pending = [sql.SQL("{} IS NULL").format(sql.Identifier(height_column))]
+        if stale_before is not None:
+            pending.append(sql.SQL("{} < %(stale_before)s").format(sql.Identifier(stale_column)))
+        conditions.append(sql.SQL("({})").format(sql.SQL(" OR ").join(pending)))
+    return sql.SQL(" AND ").join(conditions)
+
+
+def _count_buildings(conn, table, height_column, start_gid=0, only_missing=False, stale_before=None,
+                     stale_column="update_time"):
+    """统计待处理的建筑物数量，用于进度和预计剩余时间"""
+    query = sql.SQL("SELECT count(*) FROM {table} WHERE {conditions}").format(
+        table=sql.Identifier(table),
+        conditions=_pending_conditions(height_column, only_missing, stale_before, stale_column))
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute(query, {"last_gid": start_gid, "stale_before": stale_before})
+        count = cur.fetchone()[0]
+    conn.commit()
+    return count
+
+
+def _read_buildings(conn, table, height_column, batch_size, start_gid=0, only_missing=False,
+                    stale_before=None, stale_column="update_time"):
+    """
+    读取阶段：按 gid 键集分页（WHERE gid > last_gid）读取建筑物中心点，
+    逐批产出 (last_gid, [(gid, longitude, latitude, bounds), ...])。
+    筛选条件见 _pending_conditions。
+    """
+    # 中心点和外包框直接以数值列返回，不再经过 WKT 往返
+    query = sql.SQL("""
+        SELECT gid, ST_X(c) AS longitude, ST_Y(c) AS latitude,
+               ST_XMin(geom), ST_YMin(geom), ST_XMax(geom), ST_YMax(geom)
+        FROM {table}
+        CROSS JOIN LATERAL ST_Centroid(geom) AS c
+        WHERE {conditions}
+        ORDER BY gid
+        LIMIT %(batch_size)s
+    """).format(table=sql.Identifier(table),
+                conditions=_pending_conditions(height_column, only_missing, stale_before, stale_column))
+
+    # 连接池中的连接默认使用 RealDictCursor，这里按元组读取结果
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    last_gid = start_gid
+    page_no = 0
+
+    try:
+        while True:
+            cur.execute(query, {"last_gid": last_gid, "batch_size": batch_size, "stale_before": stale_before})
+            buildings = cur.fetchall()
+            # 每页读取后结束事务，读取连接不在整个补全过程中保持 idle in transaction（会阻碍 VACUUM 和 CLUSTER）
+            conn.commit()
+
+            if not buildings:
+                break
+
+            batch = [(gid, longitude, latitude, (min_x, min_y, max_x, max_y))
+                     for gid, longitude, latitude, min_x, min_y, max_x, max_y in buildings]
+
+            page_no += 1
+            last_gid = buildings[-1][0]
+            print(f"读取第 {page_no} 批，共 {len(batch)} 个建筑物，gid 至 {last_gid}")
+            yield last_gid, batch
+    finally:
+        cur.close()
+
+
+def _load_checkpoint(conn, run_id):
+    """
+    读取断点，返回 (last_gid, finished)，不存在时返回 None。
+    """
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {checkpoint_table} (
+                run_id text PRIMARY KEY,
+                table_name text NOT NULL,
+                last_gid bigint NOT NULL DEFAULT 0,
+                finished boolean NOT NULL DEFAULT false,
+                updated_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """).format(checkpoint_table=sql.Identifier(CHECKPOINT_TABLE)))
+        cur.execute(sql.SQL("SELECT last_gid, finished FROM {checkpoint_table} WHERE run_id = %s").format(
+            checkpoint_table=sql.Identifier(CHECKPOINT_TABLE)), (run_id,))
+        row = cur.fetchone()
+    conn.commit()
+    return row
+
+
+def _save_checkpoint(cur, run_id, table, last_gid, finished=False):
+    """
+    写入断点（不提交，由调用方与高度更新在同一事务中提交）。
+    """
+    cur.execute(sql.SQL("""
+        INSERT INTO {checkpoint_table} (run_id, table_name, last_gid, finished, updated_at)
+        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (run_id) DO UPDATE
+        SET last_gid = EXCLUDED.last_gid, finished = EXCLUDED.finished, updated_at = EXCLUDED.updated_at
+    """).format(checkpoint_table=sql.Identifier(CHECKPOINT_TABLE)), (run_id, table, last_gid, finished))
+
+
+class _CheckpointTracker:
+    """
+    跟踪每一页建筑物的完成情况。抓取和写入是并发的，各页完成顺序不确定，
+    断点只推进到"之前所有页都已处理完"的最后一个 gid，保证续跑时不会漏掉建筑物。
+    """
+
+    def __init__(self, start_gid):
+        self.last_gid = start_gid
+        self._pages = deque()  # [[last_gid, remaining], ...]，按 gid 顺序
+        self._page_by_no = {}
+        self._lock = threading.Lock()
+
+    def add_page(self, page_no, last_gid, count):
+        with self._lock:
+            page = [last_gid, count]
+            self._pages.append(page)
+            self._page_by_no[page_no] = page
+
+    def resolve(self, page_no, count=1):
+        with self._lock:
+            self._page_by_no[page_no][1] -= count
+
+    def checkpoint(self):
+        with self._lock:
+            while self._pages and self._pages[0][1] <= 0:
+                self.last_gid = self._pages.popleft()[0]
+            return self.last_gid
+
+
+def _fetch_height(session, api_url, longitude, latitude, timeout):
+    """
+    抓取阶段：调用高度接口，返回 (building_height, 错误信息)
+    """
+    try:
+        response = session.get(api_url, params={"longitude": longitude, "latitude": latitude}, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+
+        if data.get('success') and 'height' in data:
+            return float(data['height']), None
+        return None, "API无有效数据"
+
+    except requests.exceptions.RequestException as e:
+        return None, f"API请求失败 - {str(e)}"
+    except (ValueError, KeyError) as e:
+        return None, f"数据解析错误 - {str(e)}"
+
+
+def _write_heights(conn, table, height_column, rows, run_id, last_gid, finished=False):
+    """
+    写入阶段：一条 UPDATE ... FROM (VALUES ...) 批量更新高度，并在同一事务中写入断点
+    """
+    with conn.cursor() as cur:
+        if rows:
+            execute_values(cur, sql.SQL("""
+                UPDATE {table} AS t
+                SET {height_column} = v.height
+                FROM (VALUES %s) AS v(gid, height)
+                WHERE t.gid = v.gid
+            """).format(table=sql.Identifier(table), height_column=sql.Identifier(height_column)).as_string(conn),
+                rows, template="(%s, %s::numeric)", page_size=len(rows))
+        _save_checkpoint(cur, run_id, table, last_gid, finished)
+    conn.commit()
+
+
+def enrich_building_heights(conn, table=BUILDINGS_TABLE, height_column="building_height", batch_size=1000,
+                            max_workers=16, write_batch_size=500, write_conn=None, api_url=HEIGHT_API_URL,
+                            timeout=10, run_id=None, only_missing=False, stale_before=None,
+                            stale_column="update_time", use_height_cache=True, progress=None):
+    """
+    流水线方式补全建筑物高度，读取、接口抓取、写入三个阶段并行进行：
+    - 读取：按 gid 键集分页从 table 读取建筑物中心点
+    - 抓取：max_workers 个线程并发调用高度接口，每个线程复用自己的 keep-alive 会话
+    - 写入：单独线程累计 write_batch_size 条后用 execute_values 批量 UPDATE，并在同一事务中提交断点
+    write_conn 为写入阶段使用的独立连接，必须传入且不能是 conn：读取线程每页都会提交/回滚 conn 上的事务，
+    共用连接会提交或中止写入线程未完成的批次和断点。
+    整体吞吐由高度接口决定，而不是逐条串行处理。
+
+    run_id 标识一次补全任务，传入已有的 run_id 时从上次提交的 gid 之后继续；
+    only_missing / stale_before 只处理高度为空或 stale_column 早于 stale_before 的建筑物。
+    use_height_cache 为 True 时先查本地高度缓存（见 service/height_cache.py），命中则不调用高度接口。
+    progress(done, total) 为进度回调（例如后台任务的 Job.report），每读取一批调用一次；
+    回调抛出异常（如任务取消）时停止读取，等在途请求写完并提交断点后返回，之后可用同一 run_id 继续。
+    """
+    if write_conn is None or write_conn is conn:
+        raise ValueError("write_conn 必须是与读取连接 conn 不同的独立连接")
+    start_time = time.time()
+
+    run_id = run_id or uuid.uuid4().hex
+    checkpoint = _load_checkpoint(conn, run_id)
+    start_gid = 0
+    if checkpoint:
+        start_gid, finished = checkpoint
+        if finished:
+            print(f"任务 {run_id} 已完成，无需继续")
+            return {
+                "run_id": run_id,
+                "last_gid": start_gid,
+                "finished": True,
+                "total_processed": 0,
+                "total_success": 0,
+                "total_errors": 0,
+                "success_rate": 0,
+            }
+        print(f"任务 {run_id} 从 gid > {start_gid} 继续")
+
+    tracker = _CheckpointTracker(start_gid)
+    state = {"reader_failed": False, "stopped": False}
+    total = _count_buildings(conn, table, height_column, start_gid, only_missing, stale_before,
+                             stale_column) if progress else None
+
+    stats = {"processed": 0, "success": 0, "errors": 0, "api_calls": 0, "api_seconds": 0.0, "cache_hits": 0, "cache_misses": 0}
+    height_cache = get_height_cache() if use_height_cache else None
+    stats_lock = threading.Lock()
+
+    # 抓取阶段：每个线程一个 Session，复用 HTTP 长连接
+    thread_local = threading.local()
+
+    def get_session():
+        session = getattr(thread_local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            thread_local.session = session
+        return session
+
+    # 限制在途请求数，避免读取阶段远快于接口时占用过多内存
+    in_flight = threading.BoundedSemaphore(max_workers * 4)
+    write_queue = queue.Queue(maxsize=write_batch_size * 4)
+
+    def fetch(page_no, building):
+        gid, longitude, latitude, bounds = building
+        try:
+            cache_hit = False
+            api_seconds = None
+            if longitude is None or latitude is None:
+                building_height, error = None, "无法获取中心点"
+            else:
+                try:
+                    building_height = height_cache.get(longitude, latitude) if height_cache else None
+                    if building_height is not None:
+                        cache_hit, error = True, None
+                    else:
+                        request_start = time.time()
+                        building_height, error = _fetch_height(get_session(), api_url, longitude, latitude, timeout)
+                        api_seconds = time.time() - request_start
+                        if height_cache and error is None:
+                            height_cache.put(longitude, latitude, building_height)
+                except Exception as e:
+                    building_height, error = None, f"处理错误 - {str(e)}"
+            with stats_lock:
+                stats["processed"] += 1
+                if api_seconds is not None:
+                    stats["api_calls"] += 1
+                    stats["api_seconds"] += api_seconds
+                if cache_hit:
+                    stats["cache_hits"] += 1
+                elif height_cache:
+                    stats["cache_misses"] += 1
+                if error:
+                    stats["errors"] += 1
+            if error:
+                print(f"✗ gid {gid}: {error}")
+                tracker.resolve(page_no)
+            else:
+                write_queue.put((gid, building_height, bounds, page_no))
+        finally:
+            in_flight.release()
+
+    # 写入阶段
+    def writer():
+        pending = []
+        pending_pages = []
+        pending_bounds = None
+
+        def flush(final=False):
+            nonlocal pending, pending_pages, pending_bounds
+            if not pending and not final:
+                return
+            # 本批写入后各页的完成情况；写入失败的建筑物同样视为已处理（高度仍为空，可用 only_missing 重跑）
+            for page_no in pending_pages:
+                tracker.resolve(page_no)
+            last_gid = tracker.checkpoint()
+            finished = final and not state["reader_failed"] and not state["stopped"]
+            try:
+                _write_heights(write_conn, table, height_column, pending, run_id, last_gid, finished)
+                with stats_lock:
+                    stats["success"] += len(pending)
+                if pending:
+                    print(f"已写入 {len(pending)} 条高度数据，断点 gid={last_gid}")
+                if pending and table == BUILDINGS_TABLE:
+                    notify_buildings_changed(pending_bounds)
+            except Exception as e:
+                print(f"✗ 批量写入 {len(pending)} 条高度数据失败: {str(e)}")
+                write_conn.rollback()
+                with stats_lock:
+                    stats["errors"] += len(pending)
+            pending = []
+            pending_pages = []
+            pending_bounds = None
+
+        while True:
+            item = write_queue.get()
+            if item is _END:
+                flush(final=True)
+                break
+            gid, building_height, bounds, page_no = item
+            pending.append((gid, building_height))
+            pending_pages.append(page_no)
+            pending_bounds = merge_bounds(pending_bounds, bounds)
+            if len(pending) >= write_batch_size:
+                flush()
+
+    # 读取阶段在独立线程中预取下一批
+    read_queue = queue.Queue(maxsize=2)
+
+    def reader():
+        try:
+            for page in _read_buildings(conn, table, height_column, batch_size, start_gid, only_missing,
+                                        stale_before, stale_column):
+                if state["stopped"]:
+                    break
+                read_queue.put(page)
+        except Exception as e:
+            print(f"✗ 读取建筑物时出错: {str(e)}")
+            state["reader_failed"] = True
+        finally:
+            read_queue.put(_END)
+
+    reader_thread = threading.Thread(target=reader, name="height-enrichment-reader", daemon=True)
+    writer_thread = threading.Thread(target=writer, name="height-enrichment-writer", daemon=True)
+    reader_thread.start()
+    writer_thread.start()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="height-enrichment-fetch") as executor:
+        page_no = 0
+        while True:
+            page = read_queue.get()
+            if page is _END:
+                break
+            page_no += 1
+            last_gid, batch = page
+            tracker.add_page(page_no, last_gid, len(batch))
+            for building in batch:
+                in_flight.acquire()
+                executor.submit(fetch, page_no, building)
+
+            if progress:
+                try:
+                    progress(stats["processed"], total)
+                except Exception as e:
+                    print(f"任务 {run_id} 停止读取: {str(e)}")
+                    # 停止读取，丢弃已预取未提交的批次（断点不会越过它们）
+                    state["stopped"] = True
+                    while read_queue.get() is not _END:
+                        pass
+                    break
+
+    write_queue.put(_END)
+    reader_thread.join()
+    writer_thread.join()
+
+    elapsed = time.time() - start_time
+    total_processed = stats["processed"]
+    total_success = stats["success"]
+    total_errors = stats["errors"]
+
+    if progress and not state["stopped"]:
+        try:
+            progress(total_processed, total)
+        except Exception:
+            # 已全部完成，忽略此时的取消
+            pass
+
+    # 输出最终统计
+    print(f"\n全部处理完成!")
+    print(f"总计处理: {total_processed}")
+    print(f"成功更新: {total_success}")
+    print(f"处理失败: {total_errors}")
+    print(f"总体成功率: {total_success / total_processed * 100:.1f}%" if total_processed > 0 else "0%")
+    print(f"耗时: {elapsed:.2f} 秒, {total_processed / elapsed if elapsed > 0 else 0:.1f} 个/秒")
+    print(f"高度缓存命中: {stats['cache_hits']}, 未命中: {stats['cache_misses']}")
+    print(f"任务 {run_id} 断点 gid={tracker.last_gid}")
+
+    return {
+        "run_id": run_id,
+        "last_gid": tracker.last_gid,
+        "finished": not state["reader_failed"] and not state["stopped"],
+        "total_processed": total_processed,
+        "total_success": total_success,
+        "total_errors": total_errors,
+        "success_rate": total_success / total_processed * 100 if total_processed > 0 else 0,
+        "elapsed_seconds": elapsed,
+        "buildings_per_second": total_processed / elapsed if elapsed > 0 else 0,
+        "cache_hits": stats["cache_hits"],
+        "cache_misses": stats["cache_misses"],
+        "avg_api_ms": stats["api_seconds"] / stats["api_calls"] * 1000 if stats["api_calls"] > 0 else 0
+    }
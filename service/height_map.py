@@ -0,0 +1,336 @@
+import math
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from psycopg2.extensions import cursor as TupleCursor
+
+from database.database_conn import get_db_connection
+from service.building_events import Bounds, register_buildings_changed_listener
+from utils.geo_utils import LocalProjection
+from utils.logger import logger
+
+# 高度以分米存为 uint16（向上取整），最大 6553.5 米
+HEIGHT_SCALE = 10
+MAX_HEIGHT_VALUE = 65535
+
+# 查询窗口在 collision_distance 之外再放宽的距离（米），吸收局部投影与 PostGIS 米制投影之间的厘米级差异
+WINDOW_MARGIN = 0.05
+
+# geom_collision 的坐标系（见 sql/add_geometry_simplification.sql）
+COLLISION_SRID = 4549
+# 增量重建时经纬度外包框投影到 COLLISION_SRID 后再外扩的距离（米）
+ENVELOPE_MARGIN = 1.0
+
+# 待重建的分块超过该数量时改为整体重建
+MAX_INCREMENTAL_TILES = 64
+
+
+class HeightMap:
+    """
+    建筑物 2.5D 高度栅格：以 cell_size 米为格，记录每个格子内（外包框与格子相交的）建筑物的最大高度。
+    栅格按 tile_size x tile_size 分块稀疏存储，没有建筑物的分块不占内存。
+
+    is_clear 取查询点周围 collision_distance 范围（外扩一格）内的最大高度，查询高度不低于它时一定不会碰撞，
+    可以跳过精确查询；否则需要继续做精确查询。栅格只会高估高度，不会把碰撞判成无碰撞。
+    建筑物变更后受影响的分块先标记为待重建（查询直接走精确查询），再由后台线程从数据库重建。
+    """
+
+    def __init__(self, cell_size: float = 2.0, tile_size: int = 256):
+        self.cell_size = cell_size
+        self.tile_size = tile_size
+        self.projection: Optional[LocalProjection] = None
+
+        self._tiles: Dict[Tuple[int, int], np.ndarray] = {}
+        # 待重建的分块 {分块: 标记时的版本号}，以及需要整体重建时的标记
+        self._dirty: Dict[Tuple[int, int], int] = {}
+        self._all_dirty = True
+        self._all_dirty_version = 0
+        self._version = 0
+        self._lock = threading.Lock()
+        self._rebuild_event = threading.Event()
+        self._rebuild_thread = None
+        self._stopped = False
+
+        self.checks = 0
+        self.clear_count = 0
+        self.rebuilds = 0
+
+    # --- 查询 ---
+
+    def is_clear(self, longitude: float, latitude: float, height: float, collision_distance: float) -> bool:
+        """
+        判断点是否一定不会与建筑物碰撞（True 表示可以跳过精确查询）。
+        """
+        self.checks += 1
+        if self._all_dirty:
+            return False
+
+        x, y = self.projection.forward(longitude, latitude)
+        radius = collision_distance + self.cell_size + WINDOW_MARGIN
+        row0, row1 = math.floor((y - radius) / self.cell_size), math.floor((y + radius) / self.cell_size)
+        col0, col1 = math.floor((x - radius) / self.cell_size), math.floor((x + radius) / self.cell_size)
+
+        limit = height * HEIGHT_SCALE
+        t = self.tile_size
+        for tile_row in range(row0 // t, row1 // t + 1):
+            for tile_col in range(col0 // t, col1 // t + 1):
+                key = (tile_row, tile_col)
+                if key in self._dirty:
+                    return False
+                tile = self._tiles.get(key)
+                if tile is None:
+                    continue
+                r0, c0 = tile_row * t, tile_col * t
+                window = tile[max(row0 - r0, 0):min(row1 - r0 + 1, t), max(col0 - c0, 0):min(col1 - c0 + 1, t)]
+                if window.size and window.max() > limit:
+                    return False
+
+        self.clear_count += 1
+        return True
+
+    # --- 栅格化 ---
+
+    def _rasterize(self, bounds, heights, tiles: dict, only: Optional[set] = None):
+        """
+        把建筑物（投影后的外包框 (N, 4) 数组）按最大高度写入 tiles；only 不为空时只写入其中的分块。
+        每栋建筑物写入其外包框覆盖的全部格子（轮廓相交格子的超集）：逐格与轮廓求交的构建耗时是它的数倍，
+        而可跳过精确查询的比例只高约 1%。
+        """
+        if len(bounds) == 0:
+            return
+        cs = self.cell_size
+        t = self.tile_size
+        values = np.minimum(np.ceil(np.asarray(heights, dtype=float) * HEIGHT_SCALE), MAX_HEIGHT_VALUE)
+        col0, row0, col1, row1 = np.floor(bounds / cs).astype(np.int64).T
+        widths = col1 - col0 + 1
+        counts = widths * (row1 - row0 + 1)
+
+        # 展开每栋建筑物外包框内的全部格子
+        owner = np.repeat(np.arange(len(bounds)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = row0[owner] + offset // widths[owner]
+        cols = col0[owner] + offset % widths[owner]
+        cell_values = values[owner].astype(np.uint16)
+
+        tile_rows, tile_cols = rows // t, cols // t
+        order = np.lexsort((tile_cols, tile_rows))
+        rows, cols, cell_values = rows[order], cols[order], cell_values[order]
+        tile_rows, tile_cols = tile_rows[order], tile_cols[order]
+        boundaries = np.flatnonzero((np.diff(tile_rows) != 0) | (np.diff(tile_cols) != 0)) + 1
+
+        for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(rows)]):
+            key = (int(tile_rows[start]), int(tile_cols[start]))
+            if only is not None and key not in only:
+                continue
+            tile = tiles.get(key)
+            if tile is None:
+                tile = tiles[key] = np.zeros((t, t), dtype=np.uint16)
+            np.maximum.at(tile, (rows[start:end] - key[0] * t, cols[start:end] - key[1] * t), cell_values[start:end])
+
+    def _load_buildings(self, conn, envelope=None):
+        """
+        读取有效建筑物碰撞检测几何（外扩超集）的外包框和高度，envelope 为 (min_lon, min_lat, max_lon, max_lat)。
+        返回投影后的外包框 (N, 4) 数组和高度数组。局部投影的 x 只与经度有关、y 只与纬度有关，
+        经纬度外包框投影后就是投影后几何的外包框，无需传输整个轮廓。
+        """
+        query = """
+            SELECT ST_XMin(g), ST_YMin(g), ST_XMax(g), ST_YMax(g), building_height
+            FROM hz_yuhang_buildings
+            CROSS JOIN LATERAL ST_Transform(geom_collision, 4326) AS g
+            WHERE is_valid AND building_height IS NOT NULL
+        """
+        params = None
+        if envelope is not None:
+            # 按 geom_collision（外扩超集）筛选：只有外扩部分伸入分块的建筑物也要参与重建。
+            # 把经纬度外包框投影到 geom_collision 的坐标系再比较，可使用 (geom_collision, building_height) 索引；
+            # 投影后的边是弦而不是曲线，外扩 ENVELOPE_MARGIN 米吸收差异（多读入的建筑物由 _rasterize 的 only 过滤）
+            query += (" AND geom_collision && ST_Expand(ST_Transform(ST_MakeEnvelope(%s, %s, %s, %s, 4326), "
+                      f"{COLLISION_SRID}), {ENVELOPE_MARGIN})")
+            params = envelope
+
+        with conn.cursor(cursor_factory=TupleCursor) as cur:
+            cur.execute(query, params)
+            rows = np.array(cur.fetchall(), dtype=float).reshape(-1, 5)
+        conn.commit()
+
+        if self.projection is None:
+            # 以所有建筑物的外包框中心作为投影原点，之后的增量重建沿用同一原点
+            if len(rows) > 0:
+                lon0 = (rows[:, 0].min() + rows[:, 2].max()) / 2
+                lat0 = (rows[:, 1].min() + rows[:, 3].max()) / 2
+                self.projection = LocalProjection(lon0, lat0)
+            else:
+                self.projection = LocalProjection(0.0, 0.0)
+
+        bounds = np.empty((len(rows), 4))
+        bounds[:, 0], bounds[:, 1] = self.projection.forward(rows[:, 0], rows[:, 1])
+        bounds[:, 2], bounds[:, 3] = self.projection.forward(rows[:, 2], rows[:, 3])
+        return bounds, rows[:, 4]
+
+    def _tile_envelope(self, keys):
+        """分块集合的经纬度外包框（外扩一格）"""
+        t = self.tile_size * self.cell_size
+        min_x = min(k[1] for k in keys) * t - self.cell_size
+        min_y = min(k[0] for k in keys) * t - self.cell_size
+        max_x = (max(k[1] for k in keys) + 1) * t + self.cell_size
+        max_y = (max(k[0] for k in keys) + 1) * t + self.cell_size
+        min_lon, min_lat = self.projection.inverse(min_x, min_y)
+        max_lon, max_lat = self.projection.inverse(max_x, max_y)
+        return min_lon, min_lat, max_lon, max_lat
+
+    def build(self, conn):
+        """
+        从数据库整体构建栅格。
+        """
+        start_time = time.time()
+        with self._lock:
+            version = self._version
+
+        bounds, heights = self._load_buildings(conn)
+        tiles = {}
+        self._rasterize(bounds, heights, tiles)
+
+        with self._lock:
+            self._tiles = tiles
+            # 构建期间又有变更的分块保持待重建
+            self._dirty = {k: v for k, v in self._dirty.items() if v > version}
+            if self._all_dirty_version <= version:
+                self._all_dirty = False
+            self.rebuilds += 1
+
+        logger.info("高度栅格构建完成: %d 栋建筑物, %d 个分块, %.1f MB, 耗时 %.2f 秒",
+                    len(heights), len(tiles), self.nbytes() / 1024 / 1024, time.time() - start_time)
+
+    def rebuild_tiles(self, conn, keys):
+        """
+        从数据库重建指定分块。
+        """
+        with self._lock:
+            version = self._version
+
+        bounds, heights = self._load_buildings(conn, self._tile_envelope(keys))
+        tiles = {}
+        self._rasterize(bounds, heights, tiles, only=set(keys))
+
+        with self._lock:
+            for key in keys:
+                if key in tiles:
+                    self._tiles[key] = tiles[key]
+                else:
+                    self._tiles.pop(key, None)
+                if self._dirty.get(key, math.inf) <= version:
+                    del self._dirty[key]
+            self.rebuilds += 1
+
+    # --- 增量更新 ---
+
+    def invalidate(self, bounds: Bounds):
+        """
+        建筑物变更监听器：把 bounds 覆盖的分块标记为待重建（立即生效），由后台线程重建。
+        bounds 为 None 或覆盖的分块过多时整体重建。
+        """
+        with self._lock:
+            self._version += 1
+            if bounds is None or self.projection is None:
+                self._all_dirty = True
+                self._all_dirty_version = self._version
+            else:
+                min_x, min_y = self.projection.forward(bounds[0], bounds[1])
+                max_x, max_y = self.projection.forward(bounds[2], bounds[3])
+                size = self.tile_size * self.cell_size
+                # 外扩一格：与变更建筑物相交的格子可能在外包框边界之外半格
+                margin = self.cell_size
+                tile_rows = range(math.floor((min_y - margin) / size), math.floor((max_y + margin) / size) + 1)
+                tile_cols = range(math.floor((min_x - margin) / size), math.floor((max_x + margin) / size) + 1)
+                if len(tile_rows) * len(tile_cols) + len(self._dirty) > MAX_INCREMENTAL_TILES:
+                    self._all_dirty = True
+                    self._all_dirty_version = self._version
+                else:
+                    for tile_row in tile_rows:
+                        for tile_col in tile_cols:
+                            self._dirty[(tile_row, tile_col)] = self._version
+        self._rebuild_event.set()
+
+    def _rebuild_loop(self):
+        while True:
+            self._rebuild_event.wait()
+            self._rebuild_event.clear()
+            if self._stopped:
+                return
+            try:
+                with get_db_connection(statement_timeout=0) as conn:
+                    if self._all_dirty:
+                        self.build(conn)
+                    elif self._dirty:
+                        with self._lock:
+                            keys = list(self._dirty)
+                        self.rebuild_tiles(conn, keys)
+                        logger.info(f"高度栅格已重建 {len(keys)} 个分块")
+            except Exception as e:
+                logger.error(f"❌ 高度栅格重建失败: {e}")
+                # 失败的分块保持待重建，稍后重试
+                time.sleep(5)
+                self._rebuild_event.set()
+
+    def start(self):
+        """启动后台重建线程"""
+        self._rebuild_thread = threading.Thread(target=self._rebuild_loop, name="height-map-rebuild", daemon=True)
+        self._rebuild_thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._rebuild_event.set()
+        if self._rebuild_thread is not None:
+            self._rebuild_thread.join(timeout=10)
+
+    # --- 统计 ---
+
+    def nbytes(self) -> int:
+        return sum(tile.nbytes for tile in list(self._tiles.values()))
+
+    def stats(self) -> dict:
+        return {
+            "cell_size": self.cell_size,
+            "tile_size": self.tile_size,
+            "tiles": len(self._tiles),
+            "memory_mb": self.nbytes() / 1024 / 1024,
+            "dirty_tiles": len(self._dirty),
+            "all_dirty": self._all_dirty,
+            "checks": self.checks,
+            "clear_count": self.clear_count,
+            "clear_rate": self.clear_count / self.checks * 100 if self.checks > 0 else 0,
+            "rebuilds": self.rebuilds,
+        }
+
+
+# --- 全局高度栅格 ---
+height_map: Optional[HeightMap] = None
+
+
+def init_height_map(conn, cell_size: float = 2.0, tile_size: int = 256, start: bool = True) -> HeightMap:
+    """
+    构建全局高度栅格，注册建筑物变更监听并启动后台重建线程。
+    应该在应用启动时调用一次；多进程预加载时在主进程中传 start=False 构建，
+    fork 之后各进程再调用 height_map.start()（线程不会随 fork 复制）。
+    """
+    global height_map
+    height_map = HeightMap(cell_size, tile_size)
+    # 先注册监听：构建期间发生的变更会在构建完成后由后台线程补上
+    register_buildings_changed_listener(height_map.invalidate)
+    height_map.build(conn)
+    if start:
+        height_map.start()
+    return height_map
+
+
+def get_height_map() -> Optional[HeightMap]:
+    return height_map
+
+
+def close_height_map():
+    global height_map
+    if height_map is not None:
+        height_map.stop()
+        height_map = None
@@ -0,0 +1,311 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from utils.logger import logger
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """任务被取消时由 Job.report 抛出，业务代码收到后应尽快停止并清理"""
+
+
+class Job:
+    """
+    一个后台任务及其进度。
+    业务函数通过 report(done, total) 上报进度；请求取消后 report 抛出 JobCancelled。
+    """
+
+    def __init__(self, kind: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = PENDING
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        # 结束状态是否已写入任务存储
+        self.saved = False
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        # 串行写入存储，避免同步线程的旧进度覆盖结束状态
+        self._save_lock = threading.Lock()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def report(self, done: int, total: Optional[int] = None):
+        """
+        上报进度（已处理条数、总条数），已请求取消时抛出 JobCancelled。
+        """
+        with self._lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"任务 {self.id} 已取消")
+
+    def progress(self):
+        """当前进度 (已处理条数, 总条数)"""
+        with self._lock:
+            return self.done, self.total
+
+    def snapshot(self) -> dict:
+        done, total = self.progress()
+        return job_snapshot({
+            "job_id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "cancel_requested": self.cancel_requested,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "done": done,
+            "total": total,
+            "result": self.result,
+            "error": self.error,
+        })
+
+
+def job_snapshot(fields: dict) -> dict:
+    """任务状态和进度（速率为条/秒，eta_seconds 为预计剩余秒数，总数未知时为 None）"""
+    done, total = fields["done"], fields["total"]
+    started_at, finished_at = fields["started_at"], fields["finished_at"]
+    end = finished_at or time.time()
+    elapsed = end - started_at if started_at else 0
+    rate = done / elapsed if elapsed > 0 else 0
+    eta = None
+    if fields["status"] == RUNNING and total is not None and rate > 0:
+        eta = max(total - done, 0) / rate
+
+    return {
+        "job_id": fields["job_id"],
+        "kind": fields["kind"],
+        "params": fields["params"],
+        "status": fields["status"],
+        "cancel_requested": fields["cancel_requested"],
+        "created_at": fields["created_at"],
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "progress": {
+            "done": done,
+            "total": total,
+            "percent": done / total * 100 if total else None,
+            "rows_per_second": rate,
+            "elapsed_seconds": elapsed,
+            "eta_seconds": eta,
+        },
+        "result": fields["result"],
+        "error": fields["error"],
+    }
+
+
+class JobRunner:
+    """
+    后台任务执行器：任务在独立的线程池中运行，不占用请求所在的事件循环。
+    store 为 None 时任务状态只保存在本进程内存中，只保留最近 history_size 个已结束的任务；
+    多进程部署时传入 JobStore：任务状态写入数据库，查询和取消可以由任一进程处理，
+    本进程的后台线程每 sync_interval 秒写入进度和心跳、读取其他进程发出的取消请求。
+    """
+
+    def __init__(self, max_workers: int = 2, history_size: int = 100, store=None, sync_interval: float = 2.0):
+        self.history_size = history_size
+        self.store = store
+        self.sync_interval = sync_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-runner")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sync_thread = None
+        if store is not None:
+            store.ensure_table()
+            self._sync_thread = threading.Thread(target=self._sync_loop, name="job-sync", daemon=True)
+            self._sync_thread.start()
+
+    def submit(self, kind: str, fn: Callable[[Job], Optional[dict]], exclusive: bool = False,
+               **params) -> Optional[Job]:
+        """
+        提交任务，立即返回 Job。fn(job) 在线程池中执行，返回值作为任务结果；
+        返回 None 视为失败（与各导入函数出错时返回 None 的约定一致）。
+        exclusive=True 时如果已有同类未结束的任务（包括其他进程提交的）则不提交，返回 None。
+        """
+        job = Job(kind, params)
+        with self._lock:
+            if exclusive and self.store is None and any(
+                    j.kind == kind and j.status not in FINISHED_STATUSES for j in self._jobs.values()):
+                return None
+            if self.store is not None and not self.store.insert(job, exclusive=exclusive):
+                return None
+            self._jobs[job.id] = job
+            self._trim()
+        self._executor.submit(self._run, job, fn)
+        logger.info(f"已提交后台任务 {job.id}: {kind} {params}")
+        return job
+
+    def _run(self, job: Job, fn):
+        if job.cancel_requested:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            self._save(job)
+            return
+
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._save(job)
+        try:
+            job.result = fn(job)
+            if job.cancel_requested:
+                job.status = CANCELLED
+            elif job.result is None:
+                job.status = FAILED
+                job.error = "任务执行失败，详见日志"
+            else:
+                job.status = SUCCEEDED
+        except JobCancelled as e:
+            job.status = CANCELLED
+            job.result = getattr(e, "partial_result", None)
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            # 部分已提交的任务（例如并行导入中已完成的分片）在异常上附带 partial_result
+            job.result = getattr(e, "partial_result", None)
+            logger.error(f"❌ 后台任务 {job.id} 执行失败: {e}\n{traceback.format_exc()}")
+        finally:
+            job.finished_at = time.time()
+            logger.info(f"后台任务 {job.id} 结束: {job.status}, 耗时 {job.finished_at - job.started_at:.2f} 秒")
+            self._save(job)
+
+    def _save(self, job: Job):
+        """把任务状态写入存储；失败时由同步线程重试（结束状态未写入前一直发送心跳）"""
+        if self.store is None:
+            return
+        with job._save_lock:
+            # 写入前已是结束状态时，写入的一定是结束状态；写入期间才结束的由之后的写入标记
+            finished = job.status in FINISHED_STATUSES
+            try:
+                if self.store.save(job):
+                    job.cancel()
+                if finished:
+                    job.saved = True
+            except Exception as e:
+                logger.error(f"❌ 保存后台任务 {job.id} 状态失败: {e}")
+
+    def _sync_loop(self):
+        """写入本进程任务的进度和心跳、读取取消请求，并清理心跳超时和超出保留数量的任务"""
+        while not self._stopped.wait(self.sync_interval):
+            for job in self._local_jobs():
+                self._save(job)
+            with self._lock:
+                for job_id in [job_id for job_id, job in self._jobs.items() if job.saved]:
+                    del self._jobs[job_id]
+            try:
+                self.store.maintain(self.history_size)
+            except Exception as e:
+                logger.error(f"❌ 清理后台任务失败: {e}")
+
+    def _trim(self):
+        """删除超出保留数量的已结束任务（调用方持有锁）"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATUSES]
+        for job_id in finished[:max(len(finished) - self.history_size, 0)]:
+            del self._jobs[job_id]
+
+    def _local_jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """任务快照，不存在时返回 None"""
+        if self.store is not None:
+            return self.store.get(job_id)
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.snapshot() if job is not None else None
+
+    def list(self) -> List[dict]:
+        if self.store is not None:
+            return self.store.list()
+        return [job.snapshot() for job in self._local_jobs()]
+
+    def active(self, kind: str) -> Optional[dict]:
+        """同类未结束的任务快照"""
+        if self.store is not None:
+            return self.store.active(kind)
+        for job in self._local_jobs():
+            if job.kind == kind and job.status not in FINISHED_STATUSES:
+                return job.snapshot()
+        return None
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """
+        请求取消任务：未开始的任务不再执行，运行中的任务在下次上报进度时停止。
+        其他进程执行的任务在该进程下次同步（sync_interval 秒内）时收到取消请求。返回任务快照。
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and job.status not in FINISHED_STATUSES:
+            job.cancel()
+            logger.info(f"已请求取消后台任务 {job_id}")
+        if self.store is not None:
+            return self.store.request_cancel(job_id)
+        return job.snapshot() if job is not None else None
+
+    def shutdown(self):
+        """取消所有未结束的任务，等待线程池退出并写入各任务的结束状态"""
+        for job in self._local_jobs():
+            if job.status not in FINISHED_STATUSES:
+                job.cancel()
+        self._executor.shutdown(wait=True)
+        self._stopped.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join(timeout=10)
+        for job in self._local_jobs():
+            if not job.saved:
+                self._save(job)
+
+
+# --- 全局任务执行器 ---
+job_runner: Optional[JobRunner] = None
+
+
+def init_job_runner(max_workers: int = 2, history_size: int = 100, store=None,
+                    sync_interval: float = 2.0) -> JobRunner:
+    """
+    初始化全局后台任务执行器，store 见 JobRunner
+    """
+    global job_runner
+    job_runner = JobRunner(max_workers, history_size, store, sync_interval)
+    logger.info(f"后台任务执行器已启动: workers={max_workers}, history={history_size}, "
+                f"store={'database' if store is not None else 'memory'}")
+    return job_runner
+
+
+def get_job_runner() -> Optional[JobRunner]:
+    return job_runner
+
+
+def close_job_runner():
+    global job_runner
+    if job_runner is not None:
+        job_runner.shutdown()
+        job_runner = None
@@ -0,0 +1,160 @@
+import json
+from typing import Callable, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from service.job_runner import Job, job_snapshot, PENDING, RUNNING, FAILED, FINISHED_STATUSES
+from utils.logger import logger
+
+JOB_TABLE = "building_jobs"
+
+_COLUMNS = ("job_id", "kind", "params", "status", "cancel_requested", "created_at", "started_at", "finished_at",
+            "done", "total", "result", "error")
+
+
+class JobStore:
+    """
+    后台任务状态的 PostgreSQL 存储，多个 Web 进程共享同一份任务列表：
+    任一进程都可以查询、取消其他进程提交的任务。
+    执行任务的进程定期写入进度和心跳（heartbeat_at），并读取取消标记；
+    心跳超过 stale_seconds 未更新的未结束任务（进程已退出）标记为失败。
+    connect 为返回数据库连接上下文管理器的函数（如 get_db_connection）。
+    """
+
+    def __init__(self, connect: Callable, stale_seconds: float = 60):
+        self.connect = connect
+        self.stale_seconds = stale_seconds
+
+    def ensure_table(self):
+        """创建任务表（已存在时跳过）；多个进程同时启动时用 advisory 锁串行执行"""
+        with self.connect() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (JOB_TABLE,))
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {JOB_TABLE} (
+                        job_id text PRIMARY KEY,
+                        kind text NOT NULL,
+                        params jsonb,
+                        status text NOT NULL,
+                        cancel_requested boolean NOT NULL DEFAULT false,
+                        created_at double precision NOT NULL,
+                        started_at double precision,
+                        finished_at double precision,
+                        done bigint NOT NULL DEFAULT 0,
+                        total bigint,
+                        result jsonb,
+                        error text,
+                        heartbeat_at timestamptz NOT NULL DEFAULT now()
+                    )
+                """)
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {JOB_TABLE}_status_idx ON {JOB_TABLE} (status, kind)")
+            conn.commit()
+
+    def insert(self, job: Job, exclusive: bool = False) -> bool:
+        """
+        登记新提交的任务。exclusive=True 时如果已有同类未结束（且心跳未超时）的任务则不登记，返回 False；
+        检查和插入在同一事务中按任务类型加 advisory 锁，多个进程同时提交时只有一个成功。
+        """
+        with self.connect() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                if exclusive:
+                    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{JOB_TABLE}:{job.kind}",))
+                    cur.execute(f"""
+                        SELECT 1 FROM {JOB_TABLE}
+                        WHERE kind = %s AND status IN (%s, %s)
+                            AND heartbeat_at > now() - make_interval(secs => %s)
+                        LIMIT 1
+                    """, (job.kind, PENDING, RUNNING, self.stale_seconds))
+                    if cur.fetchone():
+                        conn.rollback()
+                        return False
+                cur.execute(f"""
+                    INSERT INTO {JOB_TABLE} (job_id, kind, params, status, created_at)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (job.id, job.kind, _to_json(job.params), job.status, job.created_at))
+            conn.commit()
+        return True
+
+    def save(self, job: Job) -> bool:
+        """
+        写入任务的状态、进度和结果，并更新心跳。返回是否已被请求取消（可能由其他进程请求）。
+        已是结束状态的行不再更新，迟到的进度写入不会覆盖结束状态。
+        """
+        done, total = job.progress()
+        with self.connect() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(f"""
+                    UPDATE {JOB_TABLE}
+                    SET status = %s, started_at = %s, finished_at = %s, done = %s, total = %s,
+                        result = %s, error = %s, heartbeat_at = now()
+                    WHERE job_id = %s AND status NOT IN %s
+                    RETURNING cancel_requested
+                """, (job.status, job.started_at, job.finished_at, done, total, _to_json(job.result), job.error,
+                      job.id, FINISHED_STATUSES))
+                row = cur.fetchone()
+            conn.commit()
+        return bool(row and row[0])
+
+    def request_cancel(self, job_id: str) -> Optional[dict]:
+        """为未结束的任务设置取消标记，由执行该任务的进程在下次同步时停止；返回任务快照，不存在时返回 None"""
+        with self.connect() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(f"""
+                    UPDATE {JOB_TABLE} SET cancel_requested = true
+                    WHERE job_id = %s AND status NOT IN %s
+                """, (job_id, FINISHED_STATUSES))
+            conn.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        rows = self._select("WHERE job_id = %s", (job_id,))
+        return rows[0] if rows else None
+
+    def list(self) -> List[dict]:
+        return self._select("ORDER BY created_at", ())
+
+    def active(self, kind: str) -> Optional[dict]:
+        """同类未结束的任务（最早提交的一个）"""
+        rows = self._select("WHERE kind = %s AND status IN (%s, %s) ORDER BY created_at LIMIT 1",
+                            (kind, PENDING, RUNNING))
+        return rows[0] if rows else None
+
+    def _select(self, where: str, params: tuple) -> List[dict]:
+        with self.connect() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(f"SELECT {', '.join(_COLUMNS)} FROM {JOB_TABLE} {where}", params)
+                rows = cur.fetchall()
+            conn.commit()
+        return [job_snapshot(dict(zip(_COLUMNS, row))) for row in rows]
+
+    def maintain(self, history_size: int):
+        """
+        标记心跳超时的未结束任务为失败（执行它的进程已退出），并只保留最近 history_size 个已结束的任务。
+        """
+        with self.connect() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute(f"""
+                    UPDATE {JOB_TABLE}
+                    SET status = %s, error = '执行任务的进程已退出', finished_at = extract(epoch FROM now())
+                    WHERE status IN (%s, %s) AND heartbeat_at < now() - make_interval(secs => %s)
+                    RETURNING job_id
+                """, (FAILED, PENDING, RUNNING, self.stale_seconds))
+                stale = [row[0] for row in cur.fetchall()]
+                cur.execute(f"""
+                    DELETE FROM {JOB_TABLE}
+                    WHERE status IN %s AND job_id NOT IN (
+                        SELECT job_id FROM {JOB_TABLE} WHERE status IN %s
+                        ORDER BY finished_at DESC NULLS LAST LIMIT %s
+                    )
+                """, (FINISHED_STATUSES, FINISHED_STATUSES, history_size))
+            conn.commit()
+        if stale:
+            logger.warning(f"⚠️ 后台任务心跳超时，已标记为失败: {', '.join(stale)}")
+
+
+def _to_json(value):
+    """任务参数和结果转为 JSON（无法序列化的值转为字符串）"""
+    if value is None:
+        return None
+    return json.dumps(value, ensure_ascii=False, default=str)
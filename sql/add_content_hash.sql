@@ -0,0 +1,15 @@
+-- 增量导入所需的表结构变更（hz_yuhang_buildings）
+-- 1. content_hash: (几何, 高度) 的内容哈希，由导入程序计算写入
+-- 2. osm_id 唯一索引: 增量导入使用 ON CONFLICT (osm_id) DO UPDATE
+
+ALTER TABLE hz_yuhang_buildings ADD COLUMN IF NOT EXISTS content_hash character varying(64);
+
+COMMENT ON COLUMN hz_yuhang_buildings.content_hash IS '建筑物内容哈希（几何+高度），用于增量导入';
+
+-- 历史全量导入可能产生重复的 osm_id，建唯一索引前只保留 gid 最大（最新导入）的一条
+DELETE FROM hz_yuhang_buildings a
+USING hz_yuhang_buildings b
+WHERE a.osm_id = b.osm_id AND a.gid < b.gid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS hz_yuhang_buildings_osm_id_key
+    ON hz_yuhang_buildings (osm_id);
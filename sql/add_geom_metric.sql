@@ -0,0 +1,38 @@
+-- 预先计算的米制投影几何列（hz_yuhang_buildings）
+-- 碰撞检测使用 geom_metric 做平面 ST_DWithin（单位为米），不再对每个候选行执行 geom::geography 的椭球距离计算。
+--
+-- 投影使用 EPSG:4549（CGCS2000 / 3-degree Gauss-Kruger CM 120E），中央经线 120°E 正好穿过余杭区，
+-- 区内长度变形在 1e-5 以下（40 米距离误差不到 1 毫米）。
+-- 注意 UTM 50N 的东边界就在 120°E，余杭区跨两个 UTM 带，因此不使用 UTM。
+-- 修改 SRID 时需同时修改 service/collision_service.py 中的 METRIC_SRID。
+
+ALTER TABLE hz_yuhang_buildings ADD COLUMN IF NOT EXISTS geom_metric geometry(MultiPolygon, 4549);
+
+COMMENT ON COLUMN hz_yuhang_buildings.geom_metric IS '建筑物坐标（EPSG:4549 米制投影，由触发器根据 geom 维护）';
+
+-- 触发器函数：geom 变化时同步 geom_metric
+CREATE OR REPLACE FUNCTION sync_hz_yuhang_buildings_geom_metric()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.geom_metric = ST_Transform(NEW.geom, 4549);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_sync_geom_metric ON hz_yuhang_buildings;
+
+CREATE TRIGGER trg_sync_geom_metric
+BEFORE INSERT OR UPDATE OF geom ON hz_yuhang_buildings
+FOR EACH ROW
+EXECUTE FUNCTION sync_hz_yuhang_buildings_geom_metric();
+
+-- 回填已有数据
+UPDATE hz_yuhang_buildings
+SET geom_metric = ST_Transform(geom, 4549)
+WHERE geom IS NOT NULL AND geom_metric IS NULL;
+
+-- 创建 GIST 索引
+CREATE INDEX IF NOT EXISTS hz_yuhang_buildings_geom_metric_idx
+    ON hz_yuhang_buildings USING gist (geom_metric);
+
+ANALYZE hz_yuhang_buildings;
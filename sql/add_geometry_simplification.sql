@@ -0,0 +1,84 @@
+-- 导入时简化碰撞检测使用的几何（hz_yuhang_buildings），需先执行 sql/add_geometry_validation.sql
+-- 建筑物轮廓由栅格描边得到，带有大量间距约 0.00003° 的台阶顶点（平均每栋 20 多个顶点，4~6 个即可表达），
+-- 每个顶点都会增加 ST_DWithin 距离计算的开销。
+--
+-- geom_collision 为碰撞检测专用的简化几何（EPSG:4549），由触发器根据 geom_metric 计算：
+-- 1. 去掉重复点后做拓扑保持的 Douglas-Peucker 简化，共线顶点和偏离不超过容差的台阶顶点被去掉
+-- 2. 简化结果按与原轮廓的实际 Hausdorff 距离（GEOS 的拓扑保持简化不严格保证偏差不超过容差）加 1 厘米外扩，
+--    mitre 连接不产生圆弧顶点；外扩后必须完全覆盖原轮廓，否则保留原几何
+-- 因此 geom_collision 总是原轮廓的超集，碰撞判断不会漏报，最多多报距离约 2 倍容差以内的建筑物。
+-- geom、geom_metric 保持原样，接口返回的轮廓不变。
+--
+-- 容差（米）取会话参数 buildings.simplify_tolerance，未设置时为 0.5；0 表示不简化。
+-- 导入程序按环境变量 BUILDING_SIMPLIFY_TOLERANCE 设置该参数（见 service/buildings_service_file.py）。
+
+ALTER TABLE hz_yuhang_buildings ADD COLUMN IF NOT EXISTS geom_collision geometry(MultiPolygon, 4549);
+ALTER TABLE hz_yuhang_buildings ADD COLUMN IF NOT EXISTS collision_vertex_count integer;
+
+COMMENT ON COLUMN hz_yuhang_buildings.geom_collision IS '碰撞检测用的简化几何（EPSG:4549，原轮廓的外扩超集，由触发器维护）';
+COMMENT ON COLUMN hz_yuhang_buildings.collision_vertex_count IS '碰撞检测几何的顶点数（由触发器维护）';
+
+-- 简化几何并外扩为原几何的超集，不满足覆盖或顶点没有减少时返回原几何
+CREATE OR REPLACE FUNCTION simplify_collision_geom(g geometry, tolerance float8)
+RETURNS geometry AS $$
+DECLARE
+    s geometry;
+    d float8;
+BEGIN
+    IF g IS NULL OR tolerance IS NULL OR tolerance <= 0 THEN
+        RETURN g;
+    END IF;
+
+    s = ST_SimplifyPreserveTopology(ST_RemoveRepeatedPoints(g), tolerance);
+    d = ST_HausdorffDistance(g, s);
+    IF d > 0 THEN
+        s = ST_Buffer(s, d + 0.01, 'join=mitre');
+    END IF;
+
+    IF ST_IsEmpty(s) OR NOT ST_Covers(s, g) OR ST_NPoints(s) >= ST_NPoints(g) THEN
+        RETURN g;
+    END IF;
+    RETURN ST_Multi(s);
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- 当前会话的简化容差（米）
+CREATE OR REPLACE FUNCTION buildings_simplify_tolerance()
+RETURNS float8 AS $$
+    SELECT COALESCE(NULLIF(current_setting('buildings.simplify_tolerance', true), '')::float8, 0.5)
+$$ LANGUAGE sql STABLE;
+
+-- 触发器函数：geom 变化时同步 geom_metric 和 geom_collision（替换 sql/add_geom_metric.sql 中的版本）
+CREATE OR REPLACE FUNCTION sync_hz_yuhang_buildings_geom_metric()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.geom_metric = ST_Transform(NEW.geom, 4549);
+    NEW.geom_collision = simplify_collision_geom(NEW.geom_metric, buildings_simplify_tolerance());
+    NEW.collision_vertex_count = ST_NPoints(NEW.geom_collision);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 回填已有数据
+UPDATE hz_yuhang_buildings
+SET (geom_collision, collision_vertex_count) = (
+    SELECT s, ST_NPoints(s) FROM simplify_collision_geom(geom_metric, buildings_simplify_tolerance()) AS s
+)
+WHERE geom_metric IS NOT NULL;
+
+-- 顶点数减少情况
+SELECT count(*) AS building_count,
+       sum(vertex_count) AS vertex_count,
+       sum(collision_vertex_count) AS collision_vertex_count,
+       round(100 - 100.0 * sum(collision_vertex_count) / NULLIF(sum(vertex_count), 0), 1) AS reduction_percent
+FROM hz_yuhang_buildings
+WHERE is_valid;
+
+-- 碰撞检测改用 geom_collision，复合索引随之替换
+CREATE INDEX IF NOT EXISTS hz_yuhang_buildings_geom_collision_height_valid_idx
+    ON hz_yuhang_buildings USING gist (geom_collision, building_height)
+    WHERE is_valid;
+
+DROP INDEX IF EXISTS hz_yuhang_buildings_geom_metric_height_valid_idx;
+
+ANALYZE hz_yuhang_buildings;
@@ -0,0 +1,78 @@
+-- 导入时一次性校验和修复几何（hz_yuhang_buildings、hz_yuhang_buildings_shuijingzhu），需先执行 sql/add_height_index.sql
+-- 写入 geom 时由触发器修复：无效几何用 ST_MakeValid 修复，只保留面并统一为 MultiPolygon，
+-- 同时记录 is_valid（修复后几何有效且非空）和 vertex_count（顶点数）。
+-- 碰撞查询和高度补全只需判断 is_valid，不再对每一行执行 ST_IsValid / ST_IsEmpty。
+-- 新插入的行修复后为空时触发器丢弃该行（导入程序将其记入拒绝文件）；更新为空几何时 geom 置空、is_valid = false。
+
+ALTER TABLE hz_yuhang_buildings ADD COLUMN IF NOT EXISTS is_valid boolean NOT NULL DEFAULT false;
+ALTER TABLE hz_yuhang_buildings ADD COLUMN IF NOT EXISTS vertex_count integer;
+ALTER TABLE hz_yuhang_buildings_shuijingzhu ADD COLUMN IF NOT EXISTS is_valid boolean NOT NULL DEFAULT false;
+ALTER TABLE hz_yuhang_buildings_shuijingzhu ADD COLUMN IF NOT EXISTS vertex_count integer;
+
+COMMENT ON COLUMN hz_yuhang_buildings.is_valid IS '几何有效且非空（由触发器维护）';
+COMMENT ON COLUMN hz_yuhang_buildings.vertex_count IS '几何顶点数（由触发器维护）';
+COMMENT ON COLUMN hz_yuhang_buildings_shuijingzhu.is_valid IS '几何有效且非空（由触发器维护）';
+COMMENT ON COLUMN hz_yuhang_buildings_shuijingzhu.vertex_count IS '几何顶点数（由触发器维护）';
+
+-- 修复几何：无效时 ST_MakeValid，只保留面（修复可能产生线、点），统一为 MultiPolygon，结果为空时返回 NULL
+CREATE OR REPLACE FUNCTION repair_building_geom(g geometry)
+RETURNS geometry AS $$
+    SELECT CASE WHEN ST_IsEmpty(r) THEN NULL ELSE r END
+    FROM (
+        SELECT ST_Multi(ST_CollectionExtract(CASE WHEN ST_IsValid(g) THEN g ELSE ST_MakeValid(g) END, 3)) AS r
+    ) t
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+-- 触发器函数：写入 geom 时修复几何并维护 is_valid、vertex_count
+CREATE OR REPLACE FUNCTION repair_buildings_geom()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.geom IS NOT NULL THEN
+        NEW.geom = repair_building_geom(NEW.geom);
+        -- 修复后为空的新行直接丢弃
+        IF NEW.geom IS NULL AND TG_OP = 'INSERT' THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    NEW.is_valid = NEW.geom IS NOT NULL AND ST_IsValid(NEW.geom);
+    NEW.vertex_count = ST_NPoints(NEW.geom);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 同一时机的 BEFORE 触发器按名称顺序执行，trg_repair_geom 先于 trg_sync_geom_metric，
+-- geom_metric 由修复后的几何计算
+DROP TRIGGER IF EXISTS trg_repair_geom ON hz_yuhang_buildings;
+
+CREATE TRIGGER trg_repair_geom
+BEFORE INSERT OR UPDATE OF geom ON hz_yuhang_buildings
+FOR EACH ROW
+EXECUTE FUNCTION repair_buildings_geom();
+
+DROP TRIGGER IF EXISTS trg_repair_geom ON hz_yuhang_buildings_shuijingzhu;
+
+CREATE TRIGGER trg_repair_geom
+BEFORE INSERT OR UPDATE OF geom ON hz_yuhang_buildings_shuijingzhu
+FOR EACH ROW
+EXECUTE FUNCTION repair_buildings_geom();
+
+-- 回填已有数据（UPDATE OF geom 触发修复，同时重新计算 geom_metric）
+UPDATE hz_yuhang_buildings SET geom = geom WHERE geom IS NOT NULL;
+UPDATE hz_yuhang_buildings_shuijingzhu SET geom = geom WHERE geom IS NOT NULL;
+
+-- 修复后仍无效或为空的行数（这些行不参与碰撞检测和高度补全）
+SELECT 'hz_yuhang_buildings' AS table_name, count(*) AS invalid_count
+FROM hz_yuhang_buildings WHERE NOT is_valid
+UNION ALL
+SELECT 'hz_yuhang_buildings_shuijingzhu', count(*)
+FROM hz_yuhang_buildings_shuijingzhu WHERE NOT is_valid;
+
+-- 碰撞检测的复合索引只包含有效行，查询条件需带上 is_valid 才能使用
+CREATE INDEX IF NOT EXISTS hz_yuhang_buildings_geom_metric_height_valid_idx
+    ON hz_yuhang_buildings USING gist (geom_metric, building_height)
+    WHERE is_valid;
+
+DROP INDEX IF EXISTS hz_yuhang_buildings_geom_metric_height_idx;
+
+ANALYZE hz_yuhang_buildings;
+ANALYZE hz_yuhang_buildings_shuijingzhu;
@@ -0,0 +1,15 @@
+-- 包含高度的空间索引（hz_yuhang_buildings），需先执行 sql/add_geom_metric.sql
+-- GiST 复合索引 (geom_metric, building_height)：索引内部节点同时记录外包框和高度范围，
+-- 查询 ST_DWithin(geom_metric, ...) AND building_height > 高度 时，最大高度低于查询高度的子树在索引中直接剪枝；
+-- 查询高度高于附近所有建筑物时只扫描索引，不访问表数据。
+-- 注意：高度条件需写成 building_height > 参数::numeric，与列类型一致才能使用索引。
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE INDEX IF NOT EXISTS hz_yuhang_buildings_geom_metric_height_idx
+    ON hz_yuhang_buildings USING gist (geom_metric, building_height);
+
+-- 复合索引的首列即 geom_metric，只按距离查询时同样可用，单列索引不再需要
+DROP INDEX IF EXISTS hz_yuhang_buildings_geom_metric_idx;
+
+ANALYZE hz_yuhang_buildings;
@@ -4,12 +4,19 @@ CREATE TABLE IF NOT EXISTS hzdk_buildings
 (
     gid integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
     building_id bigint ,
+    osm_id bigint ,
     building_type character varying(80) ,
     building_name character varying(80) ,
     building_addr character varying(512),
     area_code character varying(20) ,
     geom geometry(MultiPolygon, 4326) ,
+    geom_metric geometry(MultiPolygon, 4549) ,
+    geom_collision geometry(MultiPolygon, 4549) ,
     building_height numeric(10,2) ,
+    is_valid boolean NOT NULL DEFAULT false ,
+    vertex_count integer ,
+    collision_vertex_count integer ,
+    content_hash character varying(64) ,
     create_time timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
     update_time timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
@@ -19,12 +26,19 @@ COMMENT ON TABLE hzdk_buildings IS '余杭区建筑物信息表';
 
 -- 字段注释（更标准方式，兼容所有客户端工具）
 COMMENT ON COLUMN hzdk_buildings.building_id IS '建筑物id';
+COMMENT ON COLUMN hzdk_buildings.osm_id IS '建筑物 osm_id（由中心点 geohash 计算或取自数据）';
 COMMENT ON COLUMN hzdk_buildings.building_type IS '建筑物类型';
 COMMENT ON COLUMN hzdk_buildings.building_name IS '建筑物名称';
 COMMENT ON COLUMN hzdk_buildings.building_addr IS '建筑物地址';
 COMMENT ON COLUMN hzdk_buildings.area_code IS '区域编码';
 COMMENT ON COLUMN hzdk_buildings.geom IS '建筑物坐标';
+COMMENT ON COLUMN hzdk_buildings.geom_metric IS '建筑物坐标（EPSG:4549 米制投影，由触发器根据 geom 维护）';
+COMMENT ON COLUMN hzdk_buildings.geom_collision IS '碰撞检测用的简化几何（EPSG:4549，原轮廓的外扩超集，由触发器维护）';
 COMMENT ON COLUMN hzdk_buildings.building_height IS '建筑物高度';
+COMMENT ON COLUMN hzdk_buildings.is_valid IS '几何有效且非空（由触发器维护）';
+COMMENT ON COLUMN hzdk_buildings.vertex_count IS '几何顶点数（由触发器维护）';
+COMMENT ON COLUMN hzdk_buildings.collision_vertex_count IS '碰撞检测几何的顶点数（由触发器维护）';
+COMMENT ON COLUMN hzdk_buildings.content_hash IS '建筑物内容哈希（几何+高度），用于增量导入';
 COMMENT ON COLUMN hzdk_buildings.create_time IS '创建时间';
 COMMENT ON COLUMN hzdk_buildings.update_time IS '更新时间';
 
@@ -32,6 +46,14 @@ COMMENT ON COLUMN hzdk_buildings.update_time IS '更新时间';
 CREATE INDEX IF NOT EXISTS hzdk_buildings_geom_idx
     ON hzdk_buildings USING gist (geom);
 CREATE INDEX idx_hzdk_buildings_geom_geog ON hzdk_buildings USING GIST (geography(geom));
+-- 碰撞检测使用简化后的米制投影列 geom_collision 做平面距离判断，复合索引同时按高度剪枝（需要 btree_gist 扩展），只包含有效几何
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+CREATE INDEX IF NOT EXISTS hzdk_buildings_geom_collision_height_valid_idx
+    ON hzdk_buildings USING gist (geom_collision, building_height)
+    WHERE is_valid;
+-- 增量导入使用 ON CONFLICT (osm_id) DO UPDATE
+CREATE UNIQUE INDEX IF NOT EXISTS hzdk_buildings_osm_id_key
+    ON hzdk_buildings (osm_id);
 
 -- 创建触发器函数：自动更新 update_time
 CREATE OR REPLACE FUNCTION update_hzdk_buildings_modtime()
@@ -42,6 +64,87 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- 简化碰撞检测几何并外扩为原几何的超集，不满足覆盖或顶点没有减少时返回原几何（与 sql/add_geometry_simplification.sql 相同）
+CREATE OR REPLACE FUNCTION simplify_collision_geom(g geometry, tolerance float8)
+RETURNS geometry AS $$
+DECLARE
+    s geometry;
+    d float8;
+BEGIN
+    IF g IS NULL OR tolerance IS NULL OR tolerance <= 0 THEN
+        RETURN g;
+    END IF;
+
+    s = ST_SimplifyPreserveTopology(ST_RemoveRepeatedPoints(g), tolerance);
+    d = ST_HausdorffDistance(g, s);
+    IF d > 0 THEN
+        s = ST_Buffer(s, d + 0.01, 'join=mitre');
+    END IF;
+
+    IF ST_IsEmpty(s) OR NOT ST_Covers(s, g) OR ST_NPoints(s) >= ST_NPoints(g) THEN
+        RETURN g;
+    END IF;
+    RETURN ST_Multi(s);
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- 当前会话的简化容差（米），取会话参数 buildings.simplify_tolerance，未设置时为 0.5
+CREATE OR REPLACE FUNCTION buildings_simplify_tolerance()
+RETURNS float8 AS $$
+    SELECT COALESCE(NULLIF(current_setting('buildings.simplify_tolerance', true), '')::float8, 0.5)
+$$ LANGUAGE sql STABLE;
+
+-- 创建触发器函数：geom 变化时同步 geom_metric（EPSG:4549, CGCS2000 / 3-degree Gauss-Kruger CM 120E）和 geom_collision
+CREATE OR REPLACE FUNCTION sync_hzdk_buildings_geom_metric()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.geom_metric = ST_Transform(NEW.geom, 4549);
+    NEW.geom_collision = simplify_collision_geom(NEW.geom_metric, buildings_simplify_tolerance());
+    NEW.collision_vertex_count = ST_NPoints(NEW.geom_collision);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 创建触发器函数：写入 geom 时修复几何（ST_MakeValid，只保留面并统一为 MultiPolygon），维护 is_valid、vertex_count，
+-- 修复后为空的新行丢弃（与 sql/add_geometry_validation.sql 相同）
+CREATE OR REPLACE FUNCTION repair_building_geom(g geometry)
+RETURNS geometry AS $$
+    SELECT CASE WHEN ST_IsEmpty(r) THEN NULL ELSE r END
+    FROM (
+        SELECT ST_Multi(ST_CollectionExtract(CASE WHEN ST_IsValid(g) THEN g ELSE ST_MakeValid(g) END, 3)) AS r
+    ) t
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION repair_buildings_geom()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.geom IS NOT NULL THEN
+        NEW.geom = repair_building_geom(NEW.geom);
+        IF NEW.geom IS NULL AND TG_OP = 'INSERT' THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    NEW.is_valid = NEW.geom IS NOT NULL AND ST_IsValid(NEW.geom);
+    NEW.vertex_count = ST_NPoints(NEW.geom);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 同一时机的 BEFORE 触发器按名称顺序执行，trg_repair_geom 先于 trg_sync_geom_metric
+DROP TRIGGER IF EXISTS trg_repair_geom ON hzdk_buildings;
+
+CREATE TRIGGER trg_repair_geom
+BEFORE INSERT OR UPDATE OF geom ON hzdk_buildings
+FOR EACH ROW
+EXECUTE FUNCTION repair_buildings_geom();
+
+DROP TRIGGER IF EXISTS trg_sync_geom_metric ON hzdk_buildings;
+
+CREATE TRIGGER trg_sync_geom_metric
+BEFORE INSERT OR UPDATE OF geom ON hzdk_buildings
+FOR EACH ROW
+EXECUTE FUNCTION sync_hzdk_buildings_geom_metric();
+
 -- 创建触发器：在 UPDATE 时自动更新 update_time 字段
 DROP TRIGGER IF EXISTS trg_update_time ON hzdk_buildings;
 
@@ -0,0 +1,105 @@
+import csv
+import json
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+# 从项目根目录导入数据库配置
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.database_conn import db_config
+from service.building_maintenance import cluster_buildings
+from service.collision_service import METRIC_SRID
+
+# 与 get_collision_buildings_info 相同的碰撞查询
+COLLISION_QUERY = """
+    SELECT osm_id, name, ST_AsText(geom) AS geom, building_height
+    FROM hz_yuhang_buildings
+    WHERE ST_DWithin(
+            geom_collision,
+            ST_Transform(ST_SetSRID(ST_MakePoint(%(longitude)s, %(latitude)s), 4326), {metric_srid}),
+            %(collision_distance)s)
+        AND building_height > %(height)s::numeric
+        AND is_valid
+""".format(metric_srid=METRIC_SRID)
+
+
+def load_points(filename):
+    """
+    读取测试点文件，列为 longitude,latitude,height,collision_distance
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [
+            {
+                "longitude": float(row["longitude"]),
+                "latitude": float(row["latitude"]),
+                "height": float(row["height"]),
+                "collision_distance": float(row["collision_distance"]),
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+def measure_buffers(cur, points):
+    """
+    对每个点执行 EXPLAIN (ANALYZE, BUFFERS)，返回 (每次查询访问的共享缓冲区页数, 每次执行耗时毫秒)。
+    页数 = shared hit + shared read，表数据越聚簇，同样的结果需要访问的页越少。
+    """
+    pages = []
+    timings = []
+    for params in points:
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + COLLISION_QUERY, params)
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+        pages.append(root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0))
+        timings.append(plan[0]["Execution Time"])
+    return pages, timings
+
+
+def report(name, pages, timings):
+    print(f"{name}: 平均每次查询访问 {statistics.mean(pages):.1f} 页 (中位数 {statistics.median(pages):.0f}), "
+          f"平均执行 {statistics.mean(timings):.3f} ms")
+
+
+def benchmark(points_file, cluster=True):
+    """
+    统计每次碰撞查询访问的缓冲区页数和执行耗时；cluster=True 时先测一次，强制 CLUSTER 后再测一次。
+    冷缓存耗时需在测试前重启数据库（或清空操作系统页缓存）后运行本脚本。
+    """
+    points = load_points(points_file)
+    print(f"读取到 {len(points)} 个测试点")
+
+    conn = psycopg2.connect(**{k: v for k, v in db_config.items() if v is not None})
+    try:
+        with conn.cursor() as cur:
+            start_time = time.time()
+            pages, timings = measure_buffers(cur, points)
+            print(f"首轮（可能为冷缓存）总耗时 {time.time() - start_time:.2f} 秒")
+            report("CLUSTER 前" if cluster else "当前", pages, timings)
+        conn.commit()
+
+        if cluster:
+            result = cluster_buildings(conn, force=True)
+            print(f"CLUSTER 结果: {result}")
+            if not result.get("clustered"):
+                raise RuntimeError(f"CLUSTER 未执行: {result}")
+            with conn.cursor() as cur:
+                pages, timings = measure_buffers(cur, points)
+                report("CLUSTER 后", pages, timings)
+            conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # --- 请根据你的实际情况修改以下文件名 ---
+    points_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "all_hit_points.csv")
+    # ------------------------------------------
+
+    # 默认对比 CLUSTER 前后，传入 --no-cluster 时只测当前状态
+    benchmark(points_file, cluster="--no-cluster" not in sys.argv[1:])
@@ -0,0 +1,119 @@
+import csv
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+# 从项目根目录导入数据库配置和碰撞查询
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.database_conn import db_config
+from service.collision_service import METRIC_SRID
+
+# 改造前的查询：每个候选行做 geom::geography 椭球距离计算
+GEOGRAPHY_QUERY = """
+    SELECT osm_id
+    FROM hz_yuhang_buildings
+    WHERE ST_DWithin(
+            geom::geography,
+            ST_SetSRID(ST_MakePoint(%(longitude)s, %(latitude)s), 4326)::geography, %(collision_distance)s)
+        AND %(height)s < building_height
+"""
+
+# 改造后的查询：预先计算的米制投影列做平面距离计算
+METRIC_QUERY = """
+    SELECT osm_id
+    FROM hz_yuhang_buildings
+    WHERE ST_DWithin(
+            geom_metric,
+            ST_Transform(ST_SetSRID(ST_MakePoint(%(longitude)s, %(latitude)s), 4326), {metric_srid}),
+            %(collision_distance)s)
+        AND building_height > %(height)s::numeric
+        AND is_valid
+""".format(metric_srid=METRIC_SRID)
+
+
+def load_points(filename):
+    """
+    读取测试点文件，列为 longitude,latitude,height,collision_distance
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [
+            {
+                "longitude": float(row["longitude"]),
+                "latitude": float(row["latitude"]),
+                "height": float(row["height"]),
+                "collision_distance": float(row["collision_distance"]),
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+def run_queries(cur, query, points):
+    """
+    逐点执行查询，返回 (每次查询耗时列表, 每个点命中的 osm_id 集合列表)
+    """
+    timings = []
+    results = []
+    for params in points:
+        start_time = time.perf_counter()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        timings.append(time.perf_counter() - start_time)
+        results.append({row[0] for row in rows})
+    return timings, results
+
+
+def summarize(name, timings):
+    timings_ms = sorted(t * 1000 for t in timings)
+    p95 = timings_ms[int(len(timings_ms) * 0.95) - 1] if timings_ms else 0
+    print(f"{name}: 平均 {statistics.mean(timings_ms):.3f} ms, 中位数 {statistics.median(timings_ms):.3f} ms, "
+          f"P95 {p95:.3f} ms, 总计 {sum(timings_ms) / 1000:.2f} 秒")
+    return statistics.mean(timings_ms)
+
+
+def benchmark(points_file, rounds=3):
+    """
+    在同一批测试点上对比 geography 查询和 geom_metric 查询的耗时，并检查两者结果是否一致。
+    先各预热一轮，使两种查询都在热缓存下比较。
+    """
+    points = load_points(points_file)
+    print(f"读取到 {len(points)} 个测试点")
+
+    conn = psycopg2.connect(**{k: v for k, v in db_config.items() if v is not None})
+    try:
+        with conn.cursor() as cur:
+            run_queries(cur, GEOGRAPHY_QUERY, points)
+            run_queries(cur, METRIC_QUERY, points)
+
+            geography_timings, metric_timings = [], []
+            geography_results = metric_results = None
+            for _ in range(rounds):
+                timings, geography_results = run_queries(cur, GEOGRAPHY_QUERY, points)
+                geography_timings.extend(timings)
+                timings, metric_results = run_queries(cur, METRIC_QUERY, points)
+                metric_timings.extend(timings)
+
+            geography_mean = summarize("geography", geography_timings)
+            metric_mean = summarize("geom_metric", metric_timings)
+            if metric_mean > 0:
+                print(f"加速比: {geography_mean / metric_mean:.2f}x")
+
+            # 两种距离算法在边界上可能有毫米级差异，列出结果不一致的点便于核对
+            mismatches = [i for i, (a, b) in enumerate(zip(geography_results, metric_results)) if a != b]
+            print(f"结果不一致的点: {len(mismatches)} / {len(points)}")
+            for i in mismatches[:10]:
+                print(f"  第 {i + 1} 个点 {points[i]}: geography={sorted(geography_results[i])}, "
+                      f"geom_metric={sorted(metric_results[i])}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # --- 请根据你的实际情况修改以下文件名 ---
+    points_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "all_hit_points.csv")
+    # ------------------------------------------
+
+    benchmark(points_file)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 从项目根目录导入 service / database / utils（与 benchmark 脚本相同）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,53 @@
+from service.building_maintenance import ensure_geohash_index, GEOHASH_INDEX
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self._conn.queries.append(" ".join(query.split()))
+
+    def fetchone(self):
+        return self._conn.index_row
+
+
+class _Conn:
+    """记录执行的 SQL，index_row 为 pg_index 查询的结果（索引不存在时为 None）"""
+
+    def __init__(self, index_row):
+        self.index_row = index_row
+        self.queries = []
+
+    def cursor(self, cursor_factory=None):
+        return _Cursor(self)
+
+    def commit(self):
+        pass
+
+
+def test_geohash_index_is_not_partial():
+    conn = _Conn(None)
+
+    ensure_geohash_index(conn)
+
+    create = [q for q in conn.queries if q.startswith("CREATE INDEX")]
+    assert len(create) == 1
+    # CLUSTER 不能使用部分索引
+    assert "WHERE" not in create[0]
+    assert not any(q.startswith("DROP INDEX") for q in conn.queries)
+
+
+def test_existing_partial_index_is_rebuilt():
+    conn = _Conn((True,))
+
+    ensure_geohash_index(conn)
+
+    drop = conn.queries.index(f"DROP INDEX {GEOHASH_INDEX}")
+    assert conn.queries[drop + 1].startswith(f"CREATE INDEX IF NOT EXISTS {GEOHASH_INDEX}")
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from service.building_reader import read_buildings, count_records
+
+shapely = pytest.importorskip("shapely")
+pyogrio_raw = pytest.importorskip("pyogrio.raw")
+
+
+@pytest.fixture
+def flatgeobuf_file(tmp_path):
+    """两栋建筑物的小 FlatGeobuf 文件，第二栋没有高度"""
+    polygon = shapely.Polygon([(120.0, 30.0), (120.001, 30.0), (120.001, 30.001), (120.0, 30.001)])
+    multipolygon = shapely.MultiPolygon([
+        shapely.Polygon([(120.01, 30.01), (120.011, 30.01), (120.011, 30.011), (120.01, 30.011)]),
+    ])
+    path = tmp_path / "buildings.fgb"
+    pyogrio_raw.write(
+        str(path),
+        geometry=shapely.to_wkb([shapely.MultiPolygon([polygon]), multipolygon]),
+        field_data=[np.array([12.5, np.nan]), np.array(["A", "B"], dtype=object)],
+        fields=["building_height", "name"],
+        driver="FlatGeobuf",
+        geometry_type="MultiPolygon",
+        crs="EPSG:4326",
+    )
+    return str(path)
+
+
+def test_read_flatgeobuf(flatgeobuf_file):
+    records = list(read_buildings(flatgeobuf_file, batch_size=1))
+
+    # FlatGeobuf 的空间索引会按 Hilbert 顺序重排要素，按名称比较
+    assert sorted(r.line_num for r in records) == [1, 2]
+    assert all(r.error is None for r in records)
+    by_name = {r.attributes["name"]: r for r in records}
+    assert by_name["A"].height == 12.5
+    assert by_name["B"].height is None
+    assert by_name["A"].attributes == {"name": "A"}
+    assert by_name["A"].wkt.startswith("MULTIPOLYGON")
+    assert shapely.from_wkt(by_name["B"].wkt).equals(shapely.from_wkt(
+        "MULTIPOLYGON (((120.01 30.01, 120.011 30.01, 120.011 30.011, 120.01 30.011, 120.01 30.01)))"))
+
+
+def test_count_records_flatgeobuf(flatgeobuf_file):
+    assert count_records(flatgeobuf_file) == 2
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import shapely
+
+from service.buildings_service_file import calculate_centroids
+
+
+WKT_GEOMS = [
+    "POLYGON((120.0 30.0,120.001 30.0,120.001 30.002,120.0 30.002,120.0 30.0))",
+    # 带洞的多边形
+    "POLYGON((120.0 30.0,120.004 30.0,120.004 30.004,120.0 30.004,120.0 30.0),"
+    "(120.0005 30.0005,120.0015 30.0005,120.0015 30.0015,120.0005 30.0015,120.0005 30.0005))",
+    # 大小不同的两部分，中心点偏向面积大的部分
+    "MULTIPOLYGON(((120.1 30.1,120.101 30.1,120.101 30.101,120.1 30.1)),"
+    "((120.2 30.2,120.203 30.2,120.203 30.203,120.2 30.203,120.2 30.2)))",
+    "MULTIPOLYGON (((119.95 30.35, 119.951 30.351, 119.95 30.352, 119.949 30.351, 119.95 30.35)))",
+]
+
+
+def test_centroids_match_shapely():
+    lons, lats = calculate_centroids(WKT_GEOMS)
+
+    expected = shapely.centroid(shapely.from_wkt(WKT_GEOMS))
+    np.testing.assert_allclose(lons, shapely.get_x(expected), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(lats, shapely.get_y(expected), rtol=0, atol=1e-9)
+
+
+def test_unparseable_geometry_is_nan():
+    lons, lats = calculate_centroids([WKT_GEOMS[0], "not a geometry", ""])
+
+    assert not np.isnan(lons[0])
+    assert np.isnan(lons[1:]).all() and np.isnan(lats[1:]).all()
+
+
+def test_zero_area_polygon_falls_back_to_vertices():
+    # 面积为 0 的多边形没有面积加权中心点，取顶点均值，仍落在几何范围内
+    lons, lats = calculate_centroids(["POLYGON((120.0 30.0,120.002 30.0,120.001 30.0,120.0 30.0))"])
+
+    assert 120.0 <= lons[0] <= 120.002
+    assert lats[0] == pytest.approx(30.0)
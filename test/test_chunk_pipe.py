@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from service.building_reader import ChunkPipe
+
+
+def test_stream_reads_lines_across_chunks():
+    pipe = ChunkPipe(max_chunks=4)
+    chunks = [b"a,1\nb", b",2\n", b"", b"c,3", b"\n", None]
+
+    producer = threading.Thread(target=lambda: [pipe.feed(chunk) for chunk in chunks])
+    producer.start()
+    lines = pipe.stream.readlines()
+    producer.join()
+
+    assert lines == [b"a,1\n", b"b,2\n", b"c,3\n"]
+    assert pipe.stream.read() == b""
+
+
+def test_producer_error_is_raised_to_reader():
+    pipe = ChunkPipe()
+    pipe.feed(b"a,1\n")
+    pipe.feed(ConnectionAbortedError("上传中断"))
+
+    assert pipe.stream.readline() == b"a,1\n"
+    with pytest.raises(ConnectionAbortedError):
+        pipe.stream.read()
+
+
+def test_feed_applies_backpressure_until_consumer_closes():
+    pipe = ChunkPipe(max_chunks=1)
+    assert pipe.try_feed(b"a")
+    # 队列已满：不阻塞的写入失败，阻塞写入一直等到消费者关闭
+    assert not pipe.try_feed(b"b")
+
+    fed = []
+    producer = threading.Thread(target=lambda: fed.append(pipe.feed(b"b")))
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive()
+
+    pipe.close()
+    producer.join(5)
+    assert fed == [False]
+    assert pipe.closed
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+shapely = pytest.importorskip("shapely")
+
+from service.collision_cache import CollisionCache
+
+LON, LAT = 120.0, 30.0
+# 查询点以东约 9.6~19 米的建筑物，原轮廓与外扩后的碰撞检测几何（向西多出约 1 米）
+FOOTPRINT = "MULTIPOLYGON(((120.0001 29.99995,120.0002 29.99995,120.0002 30.00005,120.0001 30.00005,120.0001 29.99995)))"
+COLLISION = "MULTIPOLYGON(((120.00009 29.99995,120.0002 29.99995,120.0002 30.00005,120.00009 30.00005,120.00009 29.99995)))"
+
+
+def _candidate(height=50.0):
+    return {"osm_id": 1, "name": "A", "geom": FOOTPRINT, "building_height": height, "collision_geom": COLLISION}
+
+
+def _put(cache, height=10.0, collision_distance=10.0, candidates=None):
+    key = cache.make_key(LON, LAT, height, collision_distance)
+    return cache.put(key, [_candidate()] if candidates is None else candidates, cache.generation,
+                     LON, LAT, height, collision_distance)
+
+
+def test_make_key_quantizes_position_and_height():
+    cache = CollisionCache(geohash_precision=9, height_bucket=5.0)
+    key = cache.make_key(LON, LAT, 12.0, 10)
+    assert key == cache.make_key(LON + 1e-6, LAT + 1e-6, 14.9, 10.0)
+    assert key != cache.make_key(LON, LAT, 15.0, 10.0)
+    assert key != cache.make_key(LON, LAT, 12.0, 20.0)
+    assert key != cache.make_key(LON + 0.001, LAT, 12.0, 10.0)
+
+
+def test_superset_query_covers_cell():
+    cache = CollisionCache(geohash_precision=9, height_bucket=5.0)
+    key = cache.make_key(LON, LAT, 12.0, 10.0)
+    lon, lat, height, distance = cache.superset_query(key)
+    assert height == 10.0
+    # 第 9 级 geohash 网格约 4.8 x 4.8 米，半对角线约 3.4 米
+    assert 10.0 + 3.0 < distance < 10.0 + 4.0
+    assert abs(lon - LON) < 1e-4 and abs(lat - LAT) < 1e-4
+
+
+def test_refine_uses_collision_geometry():
+    cache = CollisionCache()
+    # 到原轮廓约 9.6 米，到碰撞检测几何约 8.7 米：按 geom_collision 判断，9 米距离内碰撞
+    result = _put(cache, collision_distance=9.0)
+    assert [c["osm_id"] for c in result] == [1]
+    assert "collision_geom" not in result[0]
+    assert cache.get(LON, LAT, 10.0, 9.0) == result
+    assert _put(cache, collision_distance=8.0) == []
+    # 高于建筑物不碰撞
+    assert cache.get(LON, LAT, 11.0, 9.0) == result
+    assert _put(cache, height=60.0, collision_distance=9.0) == []
+
+
+def test_ttl_expires_entries():
+    cache = CollisionCache(ttl=0.05)
+    _put(cache)
+    assert cache.get(LON, LAT, 10.0, 10.0) is not None
+    time.sleep(0.06)
+    assert cache.get(LON, LAT, 10.0, 10.0) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_invalidate_by_bounds():
+    cache = CollisionCache()
+    _put(cache)
+
+    cache.invalidate((121.0, 31.0, 121.1, 31.1))
+    assert cache.get(LON, LAT, 10.0, 10.0) is not None
+
+    cache.invalidate((LON, LAT, LON + 0.0001, LAT + 0.0001))
+    assert cache.get(LON, LAT, 10.0, 10.0) is None
+
+    _put(cache)
+    cache.invalidate(None)
+    assert cache.stats()["size"] == 0
+
+
+def test_put_skips_results_started_before_invalidation():
+    cache = CollisionCache()
+    key = cache.make_key(LON, LAT, 10.0, 10.0)
+    generation = cache.generation
+    cache.invalidate(None)
+    result = cache.put(key, [_candidate()], generation, LON, LAT, 10.0, 10.0)
+    assert [c["osm_id"] for c in result] == [1]
+    assert cache.get(LON, LAT, 10.0, 10.0) is None
@@ -0,0 +1,108 @@
+import contextlib
+import time
+
+from service import collision_index
+from service.building_events import notify_buildings_changed
+from service.collision_index import BuildingIndex
+
+
+def _square(lon, lat, size=0.0001):
+    return (f"MULTIPOLYGON((({lon} {lat},{lon + size} {lat},{lon + size} {lat + size},"
+            f"{lon} {lat + size},{lon} {lat})))")
+
+
+def _rows():
+    # 约 10 米见方的三栋建筑物，东西方向相距约 100 米；C 的高度为空
+    return [
+        {"osm_id": 1, "name": "A", "geom": _square(120.0000, 30.0), "building_height": 50.0},
+        {"osm_id": 2, "name": "B", "geom": _square(120.0010, 30.0), "building_height": 20.0},
+        {"osm_id": 3, "name": "C", "geom": _square(120.0020, 30.0), "building_height": None},
+    ]
+
+
+def test_query_within_distance_and_below_roof():
+    index = BuildingIndex(_rows())
+
+    # 距 A 东侧约 1.9 米
+    hits = index.query(120.00012, 30.00005, 10.0, 2.0)
+
+    assert [hit["osm_id"] for hit in hits] == [1]
+    assert index.query(120.00012, 30.00005, 10.0, 1.0) == []
+    assert index.query(120.00012, 30.00005, 60.0, 2.0) == []
+
+
+def test_query_skips_buildings_without_height():
+    index = BuildingIndex(_rows())
+
+    assert index.query(120.00205, 30.00005, 0.0, 2.0) == []
+
+
+def test_query_uses_collision_geom_and_returns_original_geom():
+    rows = _rows()
+    # 碰撞几何向东外扩约 10 米
+    rows[0]["collision_geom"] = (
+        "POLYGON((120.0000 30.0,120.0002 30.0,120.0002 30.0001,120.0000 30.0001,120.0000 30.0))"
+    )
+    index = BuildingIndex(rows)
+
+    hits = index.query(120.00015, 30.00005, 10.0, 0.5)
+
+    assert [hit["osm_id"] for hit in hits] == [1]
+    assert hits[0]["geom"] == _square(120.0000, 30.0)
+    assert "collision_geom" not in hits[0]
+
+
+class _Cursor:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return [dict(row) for row in self._rows]
+
+
+class _Conn:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self, cursor_factory=None):
+        return _Cursor(self.rows)
+
+
+def test_index_is_stale_until_rebuilt_after_change(monkeypatch):
+    rows = _rows()
+    conn = _Conn(rows)
+
+    @contextlib.contextmanager
+    def connect(**_):
+        yield conn
+
+    monkeypatch.setattr(collision_index, "get_db_connection", connect)
+    collision_index.init_building_index(conn, start=False)
+    assert collision_index.is_building_index_current()
+    # 新增一栋建筑物，导入流程提交后发出变更通知
+    rows.append({"osm_id": 4, "name": "D", "geom": _square(120.0030, 30.0), "building_height": 30.0})
+    notify_buildings_changed((120.0030, 30.0, 120.0031, 30.0001))
+
+    # 重建完成前索引过期，查询应改走数据库
+    assert not collision_index.is_building_index_current()
+
+    collision_index.start_building_index_rebuild()
+    try:
+        deadline = time.time() + 5
+        while not collision_index.is_building_index_current() and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        collision_index.close_building_index()
+
+    assert collision_index.is_building_index_current()
+    hits = collision_index.get_building_index().query(120.00305, 30.00005, 10.0, 1.0)
+    assert [hit["osm_id"] for hit in hits] == [4]
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from database import connection_pool
+from database.connection_pool import BoundedConnectionPool, PoolOverloaded, PoolTimeout
+
+
+class _Info:
+    transaction_status = connection_pool.psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class _FakeConnection:
+    info = _Info()
+
+    def __init__(self):
+        self.closed = 0
+        self.cursor_factory = None
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    created = []
+
+    def connect(dsn, **kwargs):
+        conn = _FakeConnection()
+        created.append(conn)
+        return conn
+
+    monkeypatch.setattr(connection_pool.psycopg2, "connect", connect)
+    return created
+
+
+def test_timeout_when_pool_exhausted(connections):
+    pool = BoundedConnectionPool("dsn", 0, 1, timeout=0.05, retry_after=3)
+    conn = pool.getconn()
+
+    start = time.monotonic()
+    with pytest.raises(PoolTimeout) as error:
+        pool.getconn()
+    assert time.monotonic() - start >= 0.05
+    assert error.value.retry_after == 3
+    assert pool.stats()["timeouts"] == 1
+
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_waiter_gets_released_connection(connections):
+    pool = BoundedConnectionPool("dsn", 0, 1, timeout=2.0)
+    conn = pool.getconn()
+    threading.Timer(0.05, pool.putconn, (conn,)).start()
+
+    assert pool.getconn() is conn
+    stats = pool.stats()
+    assert stats["waited_checkouts"] == 1
+    assert stats["max_wait_ms"] >= 40
+
+
+def test_overloaded_when_waiting_queue_full(connections):
+    pool = BoundedConnectionPool("dsn", 0, 1, timeout=0.5, max_waiting=0)
+    pool.getconn()
+    with pytest.raises(PoolOverloaded):
+        pool.getconn()
+    assert pool.stats()["rejected"] == 1
+
+
+def test_recycle_after_max_lifetime(connections):
+    pool = BoundedConnectionPool("dsn", 0, 1, max_lifetime=0.0)
+    conn = pool.getconn()
+    time.sleep(0.01)
+    pool.putconn(conn)
+
+    assert conn.closed
+    stats = pool.stats()
+    assert stats["recycled"] == 1
+    assert stats["size"] == 0
+    assert pool.getconn() is not conn
+    assert pool.stats()["created"] == 2
+
+
+def test_pool_timeout_returns_429():
+    web = pytest.importorskip("api.web")
+    response = asyncio.run(web.pool_exhausted_handler(None, PoolTimeout("5 秒内没有空闲的数据库连接", 2)))
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+    assert "服务繁忙" in json.loads(response.body)["detail"]["message"]
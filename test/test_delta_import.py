@@ -0,0 +1,120 @@
+import io
+
+from service.building_reader import BuildingRecord
+from service import buildings_service_file
+from service.buildings_service_file import _copy_to_staging, _dedup_staged, _make_reject, content_hash, \
+    generate_osm_ids, source_osm_id
+
+SQUARE = "MULTIPOLYGON(((120.0 30.0,120.001 30.0,120.001 30.001,120.0 30.001,120.0 30.0)))"
+MOVED = "MULTIPOLYGON(((120.1 30.1,120.101 30.1,120.101 30.101,120.1 30.101,120.1 30.1)))"
+
+
+class _CopyCursor:
+    """只记录 COPY 内容的游标，暂存表中没有需要重新分配的 id"""
+
+    def __init__(self):
+        self.copied = []
+
+    def execute(self, query, params=None):
+        pass
+
+    def copy_expert(self, query, file):
+        data = file.read()
+        self.copied = [line.split("\t") for line in data.splitlines()]
+
+    def fetchall(self):
+        return []
+
+
+def _stage(records):
+    cur = _CopyCursor()
+    reject_file = io.StringIO()
+    stats = {"total_count": 0, "error_count": 0}
+    _copy_to_staging(cur, records, "staging_test", _make_reject(reject_file, stats), stats)
+    return cur.copied, reject_file.getvalue(), stats
+
+
+def test_content_hash_ignores_formatting():
+    assert content_hash(SQUARE, 12.5) == content_hash(SQUARE.replace(",", ", ").lower(), 12.50)
+    assert content_hash(SQUARE, 12.5) == content_hash(SQUARE.replace("120.0 ", "120.000 "), 12.5)
+    assert content_hash(SQUARE, 12.5) != content_hash(SQUARE, 12.51)
+    assert content_hash(SQUARE, 12.5) != content_hash(SQUARE, None)
+    assert content_hash(SQUARE, 12.5) != content_hash(MOVED, 12.5)
+
+
+def test_source_osm_id():
+    assert source_osm_id({"osm_id": 123}) == 123
+    assert source_osm_id({"osm_id": "456"}) == 456
+    assert source_osm_id({"osm_id": 789.0}) == 789
+    assert source_osm_id({}) is None
+    assert source_osm_id({"osm_id": None}) is None
+    assert source_osm_id({"osm_id": 12.5}) is None
+    assert source_osm_id({"osm_id": "abc"}) is None
+    assert source_osm_id({"osm_id": -1}) is None
+    assert source_osm_id({"osm_id": True}) is None
+
+
+def test_copy_uses_source_osm_id():
+    copied, rejects, stats = _stage([
+        BuildingRecord(1, MOVED, 10.0, {"osm_id": 42}, None, "a"),
+        BuildingRecord(2, SQUARE, 20.0, {}, None, "b"),
+        BuildingRecord(3, SQUARE, 30.0, {"osm_id": 42}, None, "c"),
+    ])
+
+    by_line = {int(row[0]): row for row in copied}
+    # 自带 id 的建筑物即使中心点移动也使用原 id；没有 id 的按中心点网格生成
+    assert by_line[1][3] == "42" and by_line[1][6] == "t"
+    assert by_line[2][3] == str(generate_osm_ids([SQUARE])[0][0]) and by_line[2][6] == "f"
+    # 同一个自带 id 重复出现时拒绝后面的行
+    assert 3 not in by_line
+    assert rejects == "3\tosm_id 42 重复\tc\n"
+    assert stats == {"total_count": 3, "error_count": 1}
+
+
+def test_copy_defers_duplicates_across_chunks(monkeypatch):
+    # 每块一条记录：块之间不保留已分配的 id，重复的自带 id 都写入暂存表，由 _dedup_staged 处理
+    monkeypatch.setattr(buildings_service_file, "OSM_ID_CHUNK_SIZE", 1)
+    copied, rejects, stats = _stage([
+        BuildingRecord(1, MOVED, 10.0, {"osm_id": 42}, None, "a"),
+        BuildingRecord(2, SQUARE, 30.0, {"osm_id": 42}, None, "b"),
+    ])
+
+    assert [row[3] for row in copied] == ["42", "42"]
+    assert rejects == ""
+    assert stats == {"total_count": 2, "error_count": 0}
+
+
+class _DedupCursor:
+    """返回固定的重复 osm_id 行，记录 DELETE / UPDATE"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.writes = []
+
+    def execute(self, query, params=None):
+        if query.startswith(("DELETE", "UPDATE")):
+            self.writes.append((query.split()[0], params))
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_dedup_staged_prefers_first_source_row():
+    (generated_id,), (geohash_str,) = generate_osm_ids([SQUARE])
+    cur = _DedupCursor([
+        # (分片, 行号, osm_id, geohash, wkt, 高度, source_id)
+        (0, 9, generated_id, "wtmk0", MOVED, 10.0, True),
+        (0, 2, generated_id, "wtmk0", MOVED, 20.0, True),
+        (0, 5, generated_id, geohash_str, SQUARE, 30.0, False),
+    ])
+    assigned = {generated_id: geohash_str}
+
+    rejected = _dedup_staged(cur, ["staging_test"], assigned)
+
+    # 后出现的自带 id 行被拒绝，生成 id 的行加盐重新分配
+    assert rejected == [(0, 9, f"osm_id {generated_id} 重复", f"{MOVED},10.0")]
+    assert cur.writes[0] == ("DELETE", (9,))
+    assert cur.writes[1][0] == "UPDATE"
+    new_osm_id, line_num = cur.writes[1][1]
+    assert line_num == 5 and new_osm_id != generated_id
+    assert new_osm_id in assigned
@@ -0,0 +1,27 @@
+import geohash2
+import numpy as np
+
+from service.buildings_service_file import centroid_geohashes
+from utils.geo_utils import geohash_encode_array
+
+
+def test_geohash_encode_array_matches_geohash2():
+    rng = np.random.default_rng(7)
+    lats = np.concatenate([rng.uniform(-90, 90, 500), rng.uniform(30.2, 30.5, 500), [0.0, 90.0, -90.0]])
+    lons = np.concatenate([rng.uniform(-180, 180, 500), rng.uniform(119.8, 120.1, 500), [0.0, 180.0, -180.0]])
+
+    for precision in (1, 10, 12):
+        expected = [geohash2.encode(lat, lon, precision=precision) for lat, lon in zip(lats, lons)]
+        assert geohash_encode_array(lats, lons, precision) == expected
+
+
+def test_geohash_encode_array_empty():
+    assert geohash_encode_array([], [], 10) == []
+
+
+def test_centroid_geohashes_skips_unparseable_geometry():
+    wkt_geom = "POLYGON((120.0 30.0,120.001 30.0,120.001 30.001,120.0 30.001,120.0 30.0))"
+
+    geohashes = centroid_geohashes([wkt_geom, "not a geometry"])
+
+    assert geohashes == [geohash2.encode(30.0005, 120.0005, precision=10), None]
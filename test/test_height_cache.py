@@ -0,0 +1,35 @@
+import threading
+import time
+
+from service import height_cache
+
+
+def test_get_height_cache_opens_once_across_threads(monkeypatch):
+    created = []
+
+    class SlowCache:
+        def __init__(self):
+            # 放大检查与赋值之间的时间窗口
+            time.sleep(0.05)
+            created.append(self)
+
+    monkeypatch.setattr(height_cache, "HEIGHT_CACHE_ENABLED", True)
+    monkeypatch.setattr(height_cache, "height_cache", None)
+    monkeypatch.setattr(height_cache, "HeightCache", SlowCache)
+
+    barrier = threading.Barrier(8)
+    results = []
+
+    def fetch():
+        barrier.wait()
+        results.append(height_cache.get_height_cache())
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(result is created[0] for result in results)
+
@@ -0,0 +1,60 @@
+import pytest
+
+from service.height_enrichment import _read_buildings, enrich_building_heights
+
+
+class _PagedCursor:
+    def __init__(self, pages):
+        self._pages = list(pages)
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self._rows = self._pages.pop(0) if self._pages else []
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class _Conn:
+    """记录每页读取时连接是否处于事务中"""
+
+    def __init__(self, pages):
+        self.cursor_obj = _PagedCursor(pages)
+        self.commits = 0
+
+    def cursor(self, cursor_factory=None):
+        return self.cursor_obj
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_read_buildings_commits_after_each_page():
+    pages = [
+        [(1, 120.0, 30.0, 119.9, 29.9, 120.1, 30.1), (2, 120.2, 30.2, 120.1, 30.1, 120.3, 30.3)],
+        [(5, 120.5, 30.5, 120.4, 30.4, 120.6, 30.6)],
+    ]
+    conn = _Conn(pages)
+
+    seen = []
+    for last_gid, batch in _read_buildings(conn, "hz_yuhang_buildings", "building_height", batch_size=2):
+        # 调用方处理一页时读取连接已经结束事务
+        seen.append((last_gid, [gid for gid, *_ in batch], conn.commits))
+
+    assert seen == [(2, [1, 2], 1), (5, [5], 2)]
+    # 最后一页为空时也结束事务
+    assert conn.commits == 3
+
+
+def test_enrichment_requires_dedicated_write_connection():
+    conn = _Conn([])
+
+    with pytest.raises(ValueError):
+        enrich_building_heights(conn)
+    with pytest.raises(ValueError):
+        enrich_building_heights(conn, write_conn=conn)
+    # 校验在读取断点之前完成，没有使用连接
+    assert conn.commits == 0
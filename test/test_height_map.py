@@ -0,0 +1,103 @@
+import numpy as np
+
+from service.height_map import HeightMap, HEIGHT_SCALE
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self._conn.queries.append((query, params))
+
+    def fetchall(self):
+        return self._conn.rows
+
+
+class _Conn:
+    """返回固定行 (xmin, ymin, xmax, ymax, 高度) 并记录查询的连接"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def cursor(self, cursor_factory=None):
+        return _Cursor(self)
+
+    def commit(self):
+        pass
+
+
+# 两栋建筑物（经纬度外包框），原点附近约 100 米见方范围内
+BUILDINGS = [
+    (120.0000, 30.0000, 120.0001, 30.0001, 30.0),
+    (120.0005, 30.0005, 120.0006, 30.0006, 80.04),
+]
+
+
+def _built_map(cell_size=2.0, tile_size=8):
+    height_map = HeightMap(cell_size=cell_size, tile_size=tile_size)
+    height_map.build(_Conn(BUILDINGS))
+    return height_map
+
+
+def test_rasterize_keeps_max_height_per_cell():
+    height_map = HeightMap(cell_size=1.0, tile_size=4)
+    tiles = {}
+    # 两个外包框在格子 (1, 1) 重叠，跨越分块边界
+    bounds = np.array([[0.5, 0.5, 1.5, 1.5], [1.2, 1.2, 4.5, 1.8]])
+    height_map._rasterize(bounds, [10.0, 20.01], tiles)
+
+    assert set(tiles) == {(0, 0), (0, 1)}
+    assert tiles[(0, 0)][0, 0] == 10 * HEIGHT_SCALE
+    # 高度按分米向上取整，重叠的格子取最大值
+    assert tiles[(0, 0)][1, 1] == 201
+    assert tiles[(0, 1)][1, 0] == 201
+    assert tiles[(0, 0)][2, 2] == 0
+
+    only = {}
+    height_map._rasterize(bounds, [10.0, 20.01], only, only={(0, 1)})
+    assert set(only) == {(0, 1)}
+
+
+def test_is_clear():
+    height_map = _built_map()
+    lon, lat = 120.00005, 30.00005
+
+    # 建筑物正上方：高于建筑物才可跳过精确查询
+    assert not height_map.is_clear(lon, lat, 29.0, 5.0)
+    assert height_map.is_clear(lon, lat, 31.0, 5.0)
+    # 窗口覆盖到较高的建筑物
+    assert not height_map.is_clear(lon, lat, 31.0, 100.0)
+    # 远离所有建筑物
+    assert height_map.is_clear(120.01, 30.01, 0.0, 5.0)
+
+
+def test_is_clear_false_while_dirty():
+    height_map = _built_map()
+    lon, lat = 120.01, 30.01
+    assert height_map.is_clear(lon, lat, 0.0, 5.0)
+
+    height_map.invalidate((lon, lat, lon, lat))
+    assert not height_map.is_clear(lon, lat, 0.0, 5.0)
+
+    height_map.invalidate(None)
+    assert not height_map.is_clear(120.05, 30.05, 0.0, 5.0)
+
+
+def test_rebuild_tiles_filters_on_collision_geometry():
+    height_map = _built_map()
+    conn = _Conn(BUILDINGS)
+    height_map.rebuild_tiles(conn, [(0, 0)])
+
+    query, params = conn.queries[-1]
+    # 按外扩后的碰撞检测几何筛选，而不是原轮廓 geom
+    assert "geom_collision &&" in query
+    assert "geom &&" not in query
+    assert len(params) == 4
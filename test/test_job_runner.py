@@ -0,0 +1,197 @@
+import threading
+import time
+
+from service.job_runner import JobRunner, job_snapshot, CANCELLED, SUCCEEDED, PENDING, RUNNING, FINISHED_STATUSES
+
+
+class FakeJobStore:
+    """内存中的任务存储，行为与 JobStore 一致，模拟多个进程共享的任务表"""
+
+    def __init__(self):
+        self.rows = {}
+        self.maintained = 0
+        self._lock = threading.Lock()
+
+    def ensure_table(self):
+        pass
+
+    def insert(self, job, exclusive=False):
+        with self._lock:
+            if exclusive and any(row["kind"] == job.kind and row["status"] in (PENDING, RUNNING)
+                                 for row in self.rows.values()):
+                return False
+            self.rows[job.id] = {
+                "job_id": job.id, "kind": job.kind, "params": job.params, "status": job.status,
+                "cancel_requested": False, "created_at": job.created_at, "started_at": None, "finished_at": None,
+                "done": 0, "total": None, "result": None, "error": None,
+            }
+            return True
+
+    def save(self, job):
+        # 与 JobStore.save 相同：先取出要写入的值，再执行更新
+        values = dict(status=job.status, started_at=job.started_at, finished_at=job.finished_at, done=job.done,
+                      total=job.total, result=job.result, error=job.error)
+        self.before_update(job)
+        with self._lock:
+            row = self.rows[job.id]
+            if row["status"] in FINISHED_STATUSES:
+                return False
+            row.update(values)
+            return row["cancel_requested"]
+
+    def before_update(self, job):
+        pass
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            row = self.rows.get(job_id)
+            if row is None:
+                return None
+            row["cancel_requested"] = True
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self.rows.get(job_id)
+            return job_snapshot(dict(row)) if row else None
+
+    def list(self):
+        with self._lock:
+            return [job_snapshot(dict(row)) for row in self.rows.values()]
+
+    def active(self, kind):
+        return next((row for row in self.list() if row["kind"] == kind and row["status"] in (PENDING, RUNNING)),
+                    None)
+
+    def maintain(self, history_size):
+        self.maintained += 1
+
+
+def _wait_status(store, job_id, statuses, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        snapshot = store.get(job_id)
+        if snapshot["status"] in statuses:
+            return snapshot
+        time.sleep(0.01)
+    raise AssertionError(f"任务 {job_id} 未在 {timeout} 秒内进入 {statuses}")
+
+
+def test_final_status_is_persisted_and_local_copy_dropped():
+    store = FakeJobStore()
+    runner = JobRunner(max_workers=1, store=store, sync_interval=0.02)
+    try:
+        job = runner.submit("import", lambda job: {"success_count": 3}, file_path="a.txt")
+        snapshot = _wait_status(store, job.id, (SUCCEEDED,))
+        deadline = time.time() + 5
+        while runner._local_jobs() and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        runner.shutdown()
+
+    assert snapshot["result"] == {"success_count": 3}
+    assert snapshot["params"] == {"file_path": "a.txt"}
+    # 结束状态写入存储后本进程不再保留，查询走存储
+    assert runner._local_jobs() == []
+    assert runner.get(job.id)["status"] == SUCCEEDED
+    assert store.maintained > 0
+
+
+class SlowSyncJobStore(FakeJobStore):
+    """同步线程取出 RUNNING 状态后，等任务结束再写入，模拟与结束状态的写入同时进行"""
+
+    def __init__(self):
+        super().__init__()
+        self.sync_save_started = threading.Event()
+        self.delayed = False
+
+    def before_update(self, job):
+        if threading.current_thread().name != "job-sync" or self.delayed or job.status != RUNNING:
+            return
+        self.delayed = True
+        self.sync_save_started.set()
+        deadline = time.time() + 5
+        while job.status not in FINISHED_STATUSES and time.time() < deadline:
+            time.sleep(0.01)
+        # 给结束状态的写入留出时间
+        time.sleep(0.05)
+
+
+def test_sync_save_does_not_overwrite_final_status():
+    store = SlowSyncJobStore()
+    runner = JobRunner(max_workers=1, store=store, sync_interval=0.02)
+    go = threading.Event()
+    try:
+        job = runner.submit("import", lambda job: go.wait(5) and {"success_count": 1})
+        assert store.sync_save_started.wait(5)
+        go.set()
+        _wait_status(store, job.id, (SUCCEEDED,))
+        deadline = time.time() + 5
+        while runner._local_jobs() and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+    finally:
+        runner.shutdown()
+
+    assert store.get(job.id)["status"] == SUCCEEDED
+    assert store.get(job.id)["result"] == {"success_count": 1}
+
+
+def test_cancel_requested_through_store_stops_job():
+    store = FakeJobStore()
+    runner = JobRunner(max_workers=1, store=store, sync_interval=0.02)
+    started = threading.Event()
+
+    def run(job):
+        started.set()
+        for i in range(500):
+            job.report(i, 500)
+            time.sleep(0.01)
+        return {"done": True}
+
+    try:
+        job = runner.submit("update_buildings_info", run)
+        assert started.wait(5)
+        # 模拟其他进程收到取消请求：只修改存储中的标记，由本进程的同步线程传给任务
+        store.request_cancel(job.id)
+        snapshot = _wait_status(store, job.id, (CANCELLED,))
+    finally:
+        runner.shutdown()
+
+    assert snapshot["cancel_requested"] is True
+    assert snapshot["progress"]["done"] < 499
+
+
+def test_exclusive_submit_returns_none_while_active():
+    store = FakeJobStore()
+    runner = JobRunner(max_workers=1, store=store, sync_interval=0.02)
+    release = threading.Event()
+    try:
+        first = runner.submit("cluster_buildings", lambda job: release.wait(5) and {"clustered": True},
+                              exclusive=True)
+        second = runner.submit("cluster_buildings", lambda job: {"clustered": True}, exclusive=True)
+        active = runner.active("cluster_buildings")
+        release.set()
+        _wait_status(store, first.id, (SUCCEEDED,))
+        third = runner.submit("cluster_buildings", lambda job: {"clustered": True}, exclusive=True)
+    finally:
+        runner.shutdown()
+
+    assert second is None
+    assert active["job_id"] == first.id
+    assert third is not None
+
+
+def test_exclusive_submit_without_store():
+    runner = JobRunner(max_workers=1)
+    release = threading.Event()
+    try:
+        first = runner.submit("cluster_buildings", lambda job: release.wait(5) and {}, exclusive=True)
+        second = runner.submit("cluster_buildings", lambda job: {}, exclusive=True)
+        active = runner.active("cluster_buildings")
+    finally:
+        release.set()
+        runner.shutdown()
+
+    assert second is None
+    assert active["job_id"] == first.id
@@ -0,0 +1,71 @@
+import time
+
+from service.buildings_service_file import _compute_shards, _read_shard_lines
+from service.job_runner import JobRunner, JobCancelled, CANCELLED, FAILED
+
+
+def _write_lines(path, count):
+    lines = [f"MULTIPOLYGON(((120.{i:03d} 30.0,120.{i:03d} 30.1,120.{i + 1:03d} 30.1,120.{i:03d} 30.0))),{i}\n"
+             for i in range(count)]
+    path.write_text("".join(lines), encoding="utf-8")
+    return lines
+
+
+def test_compute_shards_aligns_to_lines(tmp_path):
+    path = tmp_path / "buildings.txt"
+    lines = _write_lines(path, 100)
+
+    shards = _compute_shards(str(path), 4)
+
+    assert len(shards) == 4
+    assert shards[0][0] == 0
+    assert shards[-1][1] == path.stat().st_size
+    # 分片首尾相接，每片之后的行号连续，合起来恰好是原文件的全部行
+    read = []
+    for (start, end, first_line_num), (next_start, _, _) in zip(shards, shards[1:] + [(shards[-1][1], None, None)]):
+        assert end == next_start
+        read.extend(_read_shard_lines(str(path), start, end, first_line_num))
+    assert [line_num for line_num, _ in read] == list(range(1, 101))
+    assert [line for _, line in read] == lines
+
+
+def test_compute_shards_more_shards_than_lines(tmp_path):
+    path = tmp_path / "buildings.txt"
+    _write_lines(path, 2)
+
+    shards = _compute_shards(str(path), 8)
+
+    assert len(shards) <= 2
+    assert [first_line_num for _, _, first_line_num in shards] == list(range(1, len(shards) + 1))
+
+
+def _wait(job, timeout=5.0):
+    deadline = time.time() + timeout
+    while job.finished_at is None and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_job_records_partial_result():
+    runner = JobRunner(max_workers=1)
+
+    def failing(job):
+        error = RuntimeError("分片 2 失败")
+        error.partial_result = {"partial": True, "committed_shards": [0, 1]}
+        raise error
+
+    def cancelled(job):
+        error = JobCancelled("已取消")
+        error.partial_result = {"partial": True, "committed_shards": [0]}
+        raise error
+
+    try:
+        failed_job = _wait(runner.submit("import", failing))
+        cancelled_job = _wait(runner.submit("import", cancelled))
+    finally:
+        runner.shutdown()
+
+    assert failed_job.status == FAILED
+    assert failed_job.result == {"partial": True, "committed_shards": [0, 1]}
+    assert cancelled_job.status == CANCELLED
+    assert cancelled_job.result == {"partial": True, "committed_shards": [0]}
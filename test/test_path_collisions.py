@@ -0,0 +1,91 @@
+import pytest
+
+from service.collision_index import BuildingIndex
+from service.collision_service import summarize_path_collisions
+
+
+def _hit(osm_id, segment_index, frac_start, frac_end, building_height):
+    return {"osm_id": osm_id, "name": f"b{osm_id}", "geom": "POLYGON EMPTY", "building_height": building_height,
+            "segment_index": segment_index, "frac_start": frac_start, "frac_end": frac_end}
+
+
+def test_summarize_interpolates_descent_and_orders_by_first_hit():
+    # 第一段从 100 米降到 0 米，第二段贴地飞行
+    vertices = [(0.0, 0.0, 100.0), (1.0, 0.0, 0.0), (2.0, 0.0, 0.0)]
+    hits = [
+        _hit(3, 1, 0.0, 1.0, 10.0),
+        # 进入区间时 80 米，降到 50 米的位置在区间内
+        _hit(1, 0, 0.2, 0.8, 50.0),
+        # 区间内最低 70 米，高于楼顶
+        _hit(2, 0, 0.1, 0.3, 40.0),
+        # 同一建筑物之后的命中不影响第一次碰撞位置
+        _hit(1, 1, 0.0, 1.0, 50.0),
+        _hit(4, 1, 0.0, 1.0, None),
+    ]
+
+    result = summarize_path_collisions(vertices, hits)
+
+    assert result["is_collision"] is True
+    assert [info["osm_id"] for info in result["building_infos"]] == [1, 3]
+    first = result["building_infos"][0]
+    assert first["segment_index"] == 0
+    assert first["longitude"] == pytest.approx(0.5)
+    assert first["altitude"] == pytest.approx(50.0)
+    assert result["first_hit"]["osm_id"] == 1
+    assert result["building_infos"][1]["longitude"] == pytest.approx(1.0)
+
+
+def test_summarize_vertical_segment_uses_whole_height_range():
+    vertices = [(0.0, 0.0, 30.0), (0.0, 0.0, 10.0)]
+
+    result = summarize_path_collisions(vertices, [_hit(1, 0, 0.0, 0.0, 20.0)])
+
+    assert result["is_collision"] is True
+    assert result["first_hit"]["altitude"] == pytest.approx(20.0)
+
+
+def test_summarize_without_hits():
+    assert summarize_path_collisions([(0.0, 0.0, 10.0), (1.0, 0.0, 10.0)], []) == {"is_collision": False}
+
+
+def _index():
+    def square(lon):
+        return f"POLYGON(({lon} 30.0,{lon + 0.0001} 30.0,{lon + 0.0001} 30.0001,{lon} 30.0001,{lon} 30.0))"
+
+    return BuildingIndex([
+        {"osm_id": 1, "name": "A", "geom": square(120.0000), "building_height": 50.0},
+        {"osm_id": 2, "name": "B", "geom": square(120.0010), "building_height": 20.0},
+    ])
+
+
+def test_query_path_hits_through_building():
+    index = _index()
+    vertices = [(119.9995, 30.00005, 10.0), (120.0005, 30.00005, 10.0)]
+
+    hits = index.query_path_hits(vertices, clearance=2.0)
+    result = summarize_path_collisions(vertices, hits)
+
+    assert [hit["osm_id"] for hit in hits] == [1]
+    assert 0 < hits[0]["frac_start"] < hits[0]["frac_end"] < 1
+    # 在 A 西侧约 clearance 米处进入走廊
+    entry = index.projection.forward(result["first_hit"]["longitude"], 30.00005)[0]
+    west_edge = index.projection.forward(120.0000, 30.00005)[0]
+    assert entry == pytest.approx(west_edge - 2.0, abs=0.01)
+    assert result["first_hit"]["osm_id"] == 1
+
+
+def test_query_path_hits_above_all_buildings():
+    index = _index()
+
+    assert index.query_path_hits([(119.9995, 30.00005, 60.0), (120.0015, 30.00005, 60.0)], clearance=2.0) == []
+
+
+def test_query_path_hits_vertical_descent():
+    index = _index()
+    vertices = [(120.00105, 30.00005, 30.0), (120.00105, 30.00005, 10.0)]
+
+    hits = index.query_path_hits(vertices, clearance=2.0)
+    result = summarize_path_collisions(vertices, hits)
+
+    assert [hit["osm_id"] for hit in hits] == [2]
+    assert result["first_hit"]["altitude"] == pytest.approx(20.0)
@@ -0,0 +1,59 @@
+import asyncio
+import contextlib
+
+import pytest
+
+web = pytest.importorskip("api.web")
+
+
+class _Request:
+    """只提供 headers 和 stream() 的请求体"""
+
+    def __init__(self, chunks):
+        self.headers = {}
+        self._chunks = chunks
+
+    async def stream(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+@contextlib.contextmanager
+def _fake_connection(**_):
+    yield object()
+
+
+@pytest.fixture
+def upload(monkeypatch, tmp_path):
+    monkeypatch.setattr(web, "UPLOAD_REJECT_DIR", str(tmp_path))
+    monkeypatch.setattr(web, "get_db_connection", _fake_connection)
+
+    def call(importer, chunks):
+        monkeypatch.setattr(web, "insert_buildings_from_stream", importer)
+        return asyncio.run(web.upload_buildings_info(_Request(chunks), file_name="buildings.txt", file_format=None,
+                                                     mode="bulk", delete_missing=False))
+    return call
+
+
+def test_upload_returns_progress(upload):
+    def importer(conn, stream, file_format, gzipped, reject_file_path, upsert, delete_missing, progress):
+        lines = stream.read().decode("utf-8").splitlines()
+        progress(len(lines))
+        return {"success_count": len(lines), "error_count": 0, "total_count": len(lines)}
+
+    result = upload(importer, [b"a,1\n", b"b,2\n"])
+
+    assert result["success_count"] == 2
+    assert result["progress"] == {"bytes_received": 8, "records_processed": 2}
+
+
+def test_upload_wraps_import_error(upload):
+    def importer(conn, stream, file_format, gzipped, reject_file_path, upsert, delete_missing, progress):
+        stream.read()
+        raise RuntimeError("数据库不可用")
+
+    result = upload(importer, [b"a,1\n"])
+
+    assert result["success"] is False
+    assert "数据库不可用" in result["message"]
+    assert result["progress"]["bytes_received"] == 4